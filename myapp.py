@@ -45,10 +45,10 @@ def load_config():
 
 def load_gsheets():
     global TABLES
-    tables_config = db.GSHEET_CONFIG[UI_SHEET]['sheets'].copy()
-    for t in tables_config:
+    sheets = db.get_sheets(UI_SHEET)
+    for t in sheets:
         TABLES[t] = {}
-        TABLES[t]['gsheet'] = db.get_sheet(UI_SHEET, t)
+        TABLES[t]['gsheet'] = sheets[t]
 
 
 def get_reporting_config(tbl):
@@ -92,12 +92,12 @@ def update():
     form_responses = TABLES['form']['gsheet'].copy()
     records = TABLES['records']['gsheet'].copy()
 
-    # 03 append new form responses to records and post to gsheet
-    records = records.append(form_responses)
-    db.post_to_gsheet(records,
-                      UI_SHEET,
-                      'records',
-                      input_option='USER_ENTERED')
+    # 03 append new form responses to records and post only the new rows to gsheet
+    records = pd.concat([records, form_responses], ignore_index=True)
+    db.post_delta_to_gsheet(records,
+                            UI_SHEET,
+                            'records',
+                            input_option='USER_ENTERED')
 
 
 if __name__ == "__main__":
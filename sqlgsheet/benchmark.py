@@ -0,0 +1,244 @@
+""" this module benchmarks the database sync on synthetic master and slave sqlite databases
+and reports throughput, peak memory and per-phase timings as json
+
+each case generates a master table and a slave copy with
+    overlap: share of the master rows present in the slave
+    update_ratio: share of the shared rows updated, half in the master and half in the slave
+    insert_ratio: rows added to the slave only, as a share of the rows
+    delete_ratio: rows deleted from the master since the last sync, still in the slave, as a share of the rows
+    skew: seconds the slave clock runs ahead (+) or behind (-) the master for its updates
+
+then times merge_edits on the two tables read into memory, and a full DBSyncer.sync cycle.
+each case runs in its own process so the peak memory of one case does not carry over to the next
+
+    python -m sqlgsheet.benchmark --rows 10000 100000 1000000 --output sync_benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlgsheet import sync
+from sqlgsheet import instrument
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+TABLE_NAME = 'events'
+KEY = 'id'
+LAST_MODIFIED = 'last_modified'
+BENCHMARK_CASE = {
+    'rows': 10000,
+    'overlap': 0.9,
+    'update_ratio': 0.05,
+    'insert_ratio': 0.01,
+    'delete_ratio': 0.01,
+    'skew': 0,
+    'sync_mode': 'full',
+    'apply_mode': 'rows',
+    'seed': 0
+}
+START_TIME = pd.Timestamp('2024-01-01')
+HISTORY_SECONDS = 365 * 24 * 3600
+
+
+def make_tables(rows, overlap, update_ratio, insert_ratio, delete_ratio, skew, seed=0) -> tuple:
+    """ returns synthetic (master, slave) tables for a case, see module description
+    """
+    rng = np.random.default_rng(seed)
+    n_delete = int(rows * delete_ratio)
+    n_insert = int(rows * insert_ratio)
+    base = _random_rows(rng, np.arange(rows + n_delete), START_TIME, HISTORY_SECONDS)
+    last_sync = START_TIME + pd.Timedelta(seconds=HISTORY_SECONDS)
+    # rows deleted from the master after the last sync, still in the slave
+    deleted = base.iloc[rows:]
+    master = base.iloc[:rows].copy()
+    in_slave = rng.random(rows) < overlap
+    slave = pd.concat([master[in_slave], deleted], ignore_index=True)
+
+    # updates after the last sync, split between the master and the slave
+    updated = rng.random(len(slave)) < update_ratio
+    updated[len(slave) - len(deleted):] = False
+    in_master = rng.random(len(slave)) < 0.5
+    offsets = pd.to_timedelta(rng.integers(1, 3600, len(slave)), unit='s')
+    slave_updates = updated & ~in_master
+    slave.loc[slave_updates, LAST_MODIFIED] = last_sync + offsets[slave_updates] + pd.Timedelta(seconds=skew)
+    slave.loc[slave_updates, 'value'] = rng.random(slave_updates.sum())
+    master_updates = master.index.isin(slave.loc[updated & in_master, KEY])
+    master.loc[master_updates, LAST_MODIFIED] = last_sync + pd.to_timedelta(
+        rng.integers(1, 3600, master_updates.sum()), unit='s')
+    master.loc[master_updates, 'value'] = rng.random(master_updates.sum())
+
+    # rows added to the slave after the updates, newer than any master row
+    inserted = _random_rows(rng, np.arange(rows + n_delete, rows + n_delete + n_insert),
+                            last_sync + pd.Timedelta(seconds=3600 + skew), 3600)
+    slave = pd.concat([slave, inserted], ignore_index=True)
+    return master.reset_index(drop=True), slave
+
+
+def _random_rows(rng, ids, start, seconds) -> pd.DataFrame:
+    return pd.DataFrame({
+        KEY: ids,
+        LAST_MODIFIED: start + pd.to_timedelta(rng.integers(0, seconds, len(ids)), unit='s'),
+        'value': rng.random(len(ids)),
+        'label': rng.choice(['alpha', 'beta', 'gamma', 'delta'], len(ids))
+    })
+
+
+def write_database(tbl, path):
+    eng = create_engine(f'sqlite:///{path}')
+    with eng.begin() as con:
+        con.exec_driver_sql(f'CREATE TABLE {TABLE_NAME} ({KEY} INTEGER PRIMARY KEY, '
+                            f'{LAST_MODIFIED} DATETIME, value FLOAT, label VARCHAR(16))')
+    tbl.to_sql(TABLE_NAME, eng, if_exists='append', index=False, chunksize=50000)
+    eng.dispose()
+
+
+def run_case(case, work_dir=None) -> dict:
+    """ runs one benchmark case and returns its results
+
+    :param case: case parameters, missing parameters default to BENCHMARK_CASE
+    :param work_dir: (optional) directory of the generated databases, a temporary directory by default
+    :return: parameters, edit counts, timings in seconds by phase, throughput in rows per second
+        and peak resident memory in MB
+    """
+    case = {**BENCHMARK_CASE, **case}
+    temp_dir = tempfile.mkdtemp(dir=work_dir)
+    stats = instrument.Aggregator()
+    instrument.add_hook(stats)
+    phases = {}
+    try:
+        master_path = os.path.join(temp_dir, 'master.db')
+        slave_path = os.path.join(temp_dir, 'slave.db')
+        with _timer(phases, 'generate'):
+            master, slave = make_tables(case['rows'], case['overlap'], case['update_ratio'],
+                                        case['insert_ratio'], case['delete_ratio'], case['skew'], case['seed'])
+        with _timer(phases, 'write'):
+            write_database(master, master_path)
+            write_database(slave, slave_path)
+
+        with _timer(phases, 'merge_edits'):
+            edits = sync.merge_edits(master, slave, KEY, LAST_MODIFIED)
+        edit_counts = {r: {a: len(edits[r][a]) for a in edits[r]} for r in edits}
+        del master, slave, edits
+
+        sync_config = {
+            'master': {'db_type': 'sqlite', 'database': f'sqlite:///{master_path}'},
+            'slave': {'db_type': 'sqlite', 'database': f'sqlite:///{slave_path}'},
+            'tables': {TABLE_NAME: {'key': KEY, 'last_modified': LAST_MODIFIED}},
+            'sync_mode': case['sync_mode'],
+            'apply_mode': case['apply_mode'],
+            'watermarks': os.path.join(temp_dir, 'watermarks.json')
+        }
+        stats.reset()
+        syncer = sync.DBSyncer(sync_config=sync_config)
+        with _timer(phases, 'sync'):
+            syncer.db_connect()
+            syncer.sync()
+        status = syncer.sync_status()
+        sync_phases = {name: s['total_seconds'] for name, s in stats.stats().items()}
+    finally:
+        instrument.remove_hook(stats)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    total_rows = case['rows'] * (1 + case['insert_ratio'] + case['delete_ratio'])
+    return {
+        'case': case,
+        'status': status,
+        'edits': edit_counts,
+        'seconds': phases,
+        'sync_seconds': sync_phases,
+        'rows_per_second': {
+            'merge_edits': total_rows / phases['merge_edits'] if phases['merge_edits'] else None,
+            'sync': total_rows / phases['sync'] if phases['sync'] else None
+        },
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def run(cases, work_dir=None, isolate=True) -> dict:
+    """ runs the benchmark cases, each in a new process if isolate, and returns the report
+    """
+    results = []
+    for case in cases:
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_case, case, work_dir).result()
+        else:
+            result = run_case(case, work_dir)
+        results.append(result)
+    report = {
+        'created': pd.Timestamp.now().isoformat(),
+        'platform': {'python': platform.python_version(), 'pandas': pd.__version__,
+                     'machine': platform.machine(), 'system': platform.system()},
+        'results': results
+    }
+    return report
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class _timer(object):
+    def __init__(self, phases, name):
+        self.phases = phases
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.phases[self.name] = time.perf_counter() - self.started
+
+
+def _cases(args) -> list:
+    grid = [(rows, overlap, delete_ratio, skew)
+            for rows in args.rows for overlap in args.overlap
+            for delete_ratio in args.delete_ratio for skew in args.skew]
+    return [{'rows': rows, 'overlap': overlap, 'delete_ratio': delete_ratio, 'skew': skew,
+             'update_ratio': args.update_ratio, 'insert_ratio': args.insert_ratio,
+             'sync_mode': args.sync_mode, 'apply_mode': args.apply_mode, 'seed': args.seed}
+            for rows, overlap, delete_ratio, skew in grid]
+
+
+# -----------------------------------------------------
+# CLI
+# -----------------------------------------------------
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark sync.merge_edits and DBSyncer.sync')
+    parser.add_argument('--rows', type=int, nargs='+', default=[BENCHMARK_CASE['rows']])
+    parser.add_argument('--overlap', type=float, nargs='+', default=[BENCHMARK_CASE['overlap']])
+    parser.add_argument('--delete-ratio', type=float, nargs='+', default=[BENCHMARK_CASE['delete_ratio']])
+    parser.add_argument('--skew', type=int, nargs='+', default=[BENCHMARK_CASE['skew']])
+    parser.add_argument('--update-ratio', type=float, default=BENCHMARK_CASE['update_ratio'])
+    parser.add_argument('--insert-ratio', type=float, default=BENCHMARK_CASE['insert_ratio'])
+    parser.add_argument('--sync-mode', choices=sync.SYNC_MODES, default=BENCHMARK_CASE['sync_mode'])
+    parser.add_argument('--apply-mode', choices=sync.APPLY_MODES, default=BENCHMARK_CASE['apply_mode'])
+    parser.add_argument('--seed', type=int, default=BENCHMARK_CASE['seed'])
+    parser.add_argument('--work-dir', default=None, help='directory of the generated databases')
+    parser.add_argument('--no-isolate', action='store_true', help='run all cases in this process')
+    parser.add_argument('--output', default='', help='json file path, prints to stdout by default')
+    args = parser.parse_args()
+
+    report = run(_cases(args), work_dir=args.work_dir, isolate=not args.no_isolate)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    else:
+        print(json.dumps(report, indent=2, default=str))
@@ -0,0 +1,216 @@
+""" this module keeps least recently used caches with a time to live, so that repeated reads of the same
+gsheet ranges within a process, or across short-lived runs sharing a local sqlite file, do not count
+against the api read quota each time.
+
+    cache = RangeCache(ttl=300, max_entries=256, path='gsheet_cache.db')
+    values = cache.get_range(spreadsheetId, 'records!A2:C')
+
+a RangeCache is invalidated by writes to any overlapping range of the same sheet
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# defaults, override per cache
+CACHE_TTL = 300  # seconds
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_BYTES = 50 * 2 ** 20
+
+
+class TTLCache(object):
+    """ least recently used cache of json serializable values, expiring ttl seconds after they are stored.
+    bounded by number of entries and approximate size in bytes. when path is set,
+    entries are also persisted to a local sqlite file and read back on a miss
+    """
+    table_name = 'cache'
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # {key: (stored_at, size, value)}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        if self.path:
+            self._create_table()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """ returns the value of the key, None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.path:
+                entry = self._load(key)
+                if entry is not None:
+                    self._store(key, *entry)
+            if entry is not None and self._expired(entry[0]):
+                self.pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value):
+        stored_at = time.time()
+        serialized = json.dumps(value)
+        with self._lock:
+            self._store(key, stored_at, len(serialized), value)
+            if self.path:
+                with self._connect() as con:
+                    con.execute(f'REPLACE INTO {self.table_name} VALUES (?, ?, ?)',
+                                (self._key_text(key), stored_at, serialized))
+
+    def pop(self, key):
+        with self._lock:
+            self._drop(key)
+            if self.path:
+                with self._connect() as con:
+                    con.execute(f'DELETE FROM {self.table_name} WHERE key = ?', (self._key_text(key),))
+
+    def invalidate(self, match):
+        """ removes every entry whose key satisfies match(key), in memory and in the persisted file
+        """
+        with self._lock:
+            for key in [k for k in self._entries if match(k)]:
+                self._drop(key)
+            if self.path:
+                with self._connect() as con:
+                    keys = [row[0] for row in con.execute(f'SELECT key FROM {self.table_name}')
+                            if match(tuple(json.loads(row[0])))]
+                    con.executemany(f'DELETE FROM {self.table_name} WHERE key = ?', [(k,) for k in keys])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self.path:
+                with self._connect() as con:
+                    con.execute(f'DELETE FROM {self.table_name}')
+
+    def _store(self, key, stored_at, size, value):
+        self._drop(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (stored_at, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _load(self, key):
+        with self._connect() as con:
+            row = con.execute(f'SELECT stored_at, value FROM {self.table_name} WHERE key = ?',
+                              (self._key_text(key),)).fetchone()
+        if row is None:
+            return None
+        stored_at, serialized = row
+        return stored_at, len(serialized), json.loads(serialized)
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _create_table(self):
+        with self._connect() as con:
+            con.execute(f'CREATE TABLE IF NOT EXISTS {self.table_name} '
+                        '(key TEXT PRIMARY KEY, stored_at REAL, value TEXT)')
+
+    @staticmethod
+    def _key_text(key):
+        return json.dumps(list(key))
+
+
+class RangeCache(TTLCache):
+    """ cache of gsheet range values keyed by (spreadsheetId, rangeName)
+    """
+    table_name = 'range_cache'
+
+    def get_range(self, spreadsheetId, rangeName):
+        values = self.get((spreadsheetId, rangeName))
+        return None if values is None else [list(row) for row in values]
+
+    def put_range(self, spreadsheetId, rangeName, values):
+        self.put((spreadsheetId, rangeName), [list(row) for row in values])
+
+    def invalidate_range(self, spreadsheetId, rangeName):
+        """ removes the cached ranges of the spreadsheet that overlap rangeName
+        """
+        bounds = range_bounds(rangeName)
+        self.invalidate(lambda key: key[0] == spreadsheetId and ranges_overlap(bounds, range_bounds(key[1])))
+
+
+class DriveCache(TTLCache):
+    """ cache of google drive folder ids and file metadata, see gdrive
+    """
+    table_name = 'drive_cache'
+
+
+def range_bounds(rangeName):
+    """ returns (sheet, first_col, first_row, last_col, last_row) of an A1 range, open ends as None.
+    a range without a sheet name has sheet '', which overlaps any sheet, and
+    a sheet name alone covers the whole sheet
+    """
+    if '!' not in rangeName:
+        if re.match(r'^[A-Za-z]{1,3}\d+(:[A-Za-z]{1,3}\d*)?$', rangeName):
+            rangeName = '!' + rangeName
+        else:
+            rangeName = rangeName + '!'
+    sheet, _, address = rangeName.rpartition('!')
+    sheet = sheet.strip("'").lower()
+    match = re.match(r'^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$', address.upper())
+    if match is None or not address:
+        return sheet, None, None, None, None
+    first_col, first_row, last_col, last_row = match.groups()
+    if last_col is None and last_row is None:  # single cell
+        last_col, last_row = first_col, first_row
+    return (sheet, _column_number(first_col), int(first_row) if first_row else None,
+            _column_number(last_col), int(last_row) if last_row else None)
+
+
+def ranges_overlap(a, b):
+    if a[0] and b[0] and a[0] != b[0]:
+        return False
+    return _intervals_overlap(a[1], a[3], b[1], b[3]) and _intervals_overlap(a[2], a[4], b[2], b[4])
+
+
+def _intervals_overlap(start_a, end_a, start_b, end_b):
+    start_a = 1 if start_a is None else start_a
+    start_b = 1 if start_b is None else start_b
+    end_a = float('inf') if end_a is None else end_a
+    end_b = float('inf') if end_b is None else end_b
+    return start_a <= end_b and start_b <= end_a
+
+
+def _column_number(col):
+    if not col:
+        return None
+    number = 0
+    for c in col:
+        number = number * 26 + ord(c) - ord('A') + 1
+    return number
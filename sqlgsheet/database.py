@@ -5,22 +5,37 @@
 # -----------------------------------------------------
 import os
 import sys
+import asyncio
 import shutil
 import json
+import threading
+import weakref
+import uuid
+import hashlib
+import datetime
+import decimal
+from contextlib import contextmanager
+import re
+import numpy as np
 import pandas as pd
-import datetime as dt
 from typing import Optional
-from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine, Connection
 from sqlalchemy.engine.reflection import Inspector
 from sqlalchemy import MetaData
+from sqlalchemy.exc import NoSuchTableError
 from sqlalchemy.sql.expression import bindparam
 from sqlalchemy import delete
 from sqlalchemy import update
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.dialects import mysql as mysql_dialect
+from sqlalchemy import Table, select, text, func, cast, literal, union_all, and_, or_, true, false, case
+from sqlalchemy import types as sqltypes
 from sqlgsheet import gsheet as gs
 from sqlgsheet import gdrive as gd
 from sqlgsheet import fso
 from sqlgsheet import mysql
+from sqlgsheet import pool
+from sqlgsheet import instrument
 
 ##-----------------------------------------------------
 # Module variables
@@ -30,6 +45,23 @@ DB_SOURCE = 'local'    # remote=MySQL, local=sqlite, generic=templates.DBConnect
 PATH_GSHEET_CONFIG = 'gsheet_config.json'
 PATH_DB_CONFIG = 'db_config.json'
 NUMERIC_TYPES = ['int', 'float']
+DEFAULT_CHUNKSIZE = 10000
+UPSERT_METHODS = ['auto', 'native', 'staging']
+UPSERT_DIALECTS = ['sqlite', 'mysql']
+UPSERT_BATCHSIZE = 1000
+STAGING_THRESHOLD = 50000  # rows, above which 'auto' upserts through a staging table
+POST_MODES = ['clear', 'overwrite']
+FINGERPRINT_FIELD = 'fingerprint'
+FINGERPRINT_SQL_DIALECTS = ['mysql']  # dialects computing the md5 fingerprint in sql
+FINGERPRINT_METHODS = ['hash', 'md5']  # see fingerprint_rows
+FINGERPRINT_METHOD = 'hash'
+FINGERPRINT_NULL = '\\N'  # text of null values in a fingerprint
+FINGERPRINT_SEPARATOR = '\x1f'  # unit separator between the field texts of an md5 fingerprint
+FINGERPRINT_INT_FLOAT_MAX = 1e15  # integral floats below this are written as integers in an md5 fingerprint
+RANGE_SUMMARY_FIELDS = ['count', 'digest', 'last_modified']
+RANGE_SPLITS_FIELD = 'splits'  # keys splitting a range into parts, see range_splits
+RANGE_BATCHSIZE = 200  # key ranges per query
+DELTA_MAX_CHANGE_RATIO = 0.5  # share of changed cells above which a delta post rewrites the full range
 SQL_DB_NAME = 'sqlite:///myapp.db'
 SQL_DATA_TYPES = {'INTEGER()':'int',
                   'REAL()':'float',
@@ -44,12 +76,18 @@ SQL_DATA_TYPES = {'INTEGER()':'int',
 # dynamic : config
 GSHEET_CONFIG = {}
 DB_CONFIG = {}
+SHEET_SNAPSHOTS = {}  # {(wkbid, rngid): RAW str values of the table} last read or posted state of each range
+COERCION_PLANS = {}  # {(wkb_name, rng_code): [(field, data_type, converter)]} compiled from GSHEET_CONFIG
+COERCION_ERRORS = {}  # {(wkb_name, rng_code): pd.DataFrame} values of the last read that failed to coerce
 LOCAL_DIR = os.path.abspath(os.path.dirname(__file__))
 
 # custom class objects from other modules
 engine = None
 gs_engine = None
+gs_async_engine = None
 con = None
+_schema_cache = weakref.WeakKeyDictionary()  # {Engine: MetaData} reflected tables per engine
+_schema_lock = threading.Lock()
 
 
 # -----------------------------------------------------
@@ -71,6 +109,7 @@ def load_client_secret(client_secret):
 def load_config(db_config={}):
     global CONFIG, GSHEET_CONFIG, DB_CONFIG
     GSHEET_CONFIG = json.load(open(PATH_GSHEET_CONFIG))
+    COERCION_PLANS.clear()
     if not db_config:
         db_config = json.load(open(PATH_DB_CONFIG))
     DB_CONFIG = db_config
@@ -103,6 +142,8 @@ def set_user_data(gsheet_config: Optional[str] = None,
 # -----------------------------------------------------
 def unload_sql():
     global engine, con, inspector, table_names
+    if is_sqlalchemy_con(con):
+        con.close()  # returns the connection to the engine pool
     table_names = []
     inspector = None
     engine = None
@@ -151,6 +192,7 @@ def is_sqlalchemy_con(con_obj):
     return is_class
 
 
+@instrument.timed('database.get_table', measure_result=True)
 def get_table(table_name, con=None):
     check_exists = True
     if not con:
@@ -166,12 +208,516 @@ def get_table(table_name, con=None):
     return tbl
 
 
+def iter_table(table_name, con=None, chunksize=DEFAULT_CHUNKSIZE, chunk_bytes=None,
+               columns=None, where=None):
+    ''' read a table as an iterator of DataFrame chunks, to process large tables in bounded memory
+
+    :param table_name: table to read
+    :param con: (optional) connection, defaults to the module engine
+    :param chunksize: (optional) number of rows per chunk
+    :param chunk_bytes: (optional) memory budget per chunk, overrides chunksize
+        after the first chunk using its memory usage per row
+    :param columns: (optional) list of columns to read, defaults to all columns
+    :param where: (optional) SQL predicate, ex. "last_modified >= '2023-01-01'"
+    :type table_name: str
+    :type chunksize: int
+    :type chunk_bytes: int
+    :type columns: list
+    :type where: str
+    :return: table chunks
+    :rtype: iterator of pd.DataFrame
+    '''
+    if not con:
+        con = engine
+    if is_sqlalchemy_con(con):
+        sql_table = get_sql_table(table_name, con, required=True)
+        if columns:
+            stmt = select(*[sql_table.c[c] for c in columns])
+        else:
+            stmt = select(sql_table)
+        if where:
+            stmt = stmt.where(text(where))
+        chunks = _iter_query(stmt, con, chunksize, chunk_bytes)
+    elif hasattr(con, 'iter_table'):
+        chunks = con.iter_table(table_name, chunksize, columns=columns, where=where)
+    else:
+        if where:
+            raise ValueError(f'where predicate not supported by {type(con).__name__}. Implement iter_table')
+        tbl = con.get_table(table_name)
+        if columns:
+            tbl = tbl[columns]
+        chunks = (tbl.iloc[i:i + chunksize] for i in range(0, len(tbl), chunksize))
+    for chunk in chunks:
+        yield chunk
+
+
+def _iter_query(stmt, con, chunksize=DEFAULT_CHUNKSIZE, chunk_bytes=None):
+    if isinstance(con, Engine):
+        with con.connect() as connection:
+            for chunk in _iter_query(stmt, connection, chunksize, chunk_bytes):
+                yield chunk
+    else:
+        result = con.execution_options(stream_results=True).execute(stmt)
+        fields = list(result.keys())
+        try:
+            while True:
+                rows = result.fetchmany(chunksize)
+                if not rows:
+                    break
+                chunk = pd.DataFrame.from_records(rows, columns=fields)
+                if chunk_bytes:
+                    row_bytes = max(1, chunk.memory_usage(deep=True).sum() // len(chunk))
+                    chunksize = max(1, int(chunk_bytes // row_bytes))
+                yield chunk
+        finally:
+            result.close()
+
+
+def export_table_csv(table_name, file_path, con=None, chunksize=DEFAULT_CHUNKSIZE,
+                     chunk_bytes=None, columns=None, where=None):
+    ''' export a table to a csv file one chunk at a time
+    '''
+    header = True
+    for chunk in iter_table(table_name, con=con, chunksize=chunksize, chunk_bytes=chunk_bytes,
+                            columns=columns, where=where):
+        chunk.to_csv(file_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+    if header:  # empty table
+        pd.DataFrame([], columns=columns).to_csv(file_path, index=False)
+
+
+@instrument.timed('database.get_table_columns', measure_result=True)
+def get_table_columns(table_name, columns, con=None):
+    """ returns only the selected columns of the table, ex. the key column for key-set comparisons
+    """
+    if not con:
+        con = engine
+    if is_sqlalchemy_con(con):
+        tbl = pd.read_sql_table(table_name, con=con, columns=columns)
+    elif hasattr(con, 'get_table_columns'):
+        tbl = con.get_table_columns(table_name, columns)
+    else:
+        tbl = con.get_table(table_name)[columns]
+    return tbl
+
+
+def get_table_since(table_name, field, value, con=None):
+    """ returns the rows of the table where field >= value, ex. rows modified since a watermark
+    """
+    if not con:
+        con = engine
+    if is_sqlalchemy_con(con):
+        sql_table = get_sql_table(table_name, con, required=True)
+        stmt = select(sql_table).where(sql_table.c[field] >= value)
+        tbl = pd.read_sql(stmt, con=con)
+    elif hasattr(con, 'get_table_since'):
+        tbl = con.get_table_since(table_name, field, value)
+    else:
+        tbl = con.get_table(table_name)
+        tbl = tbl[tbl[field] >= value]
+    return tbl
+
+
+def get_rows_by_keys(table_name, key, keys, con=None):
+    """ returns the rows of the table whose key is in keys
+    """
+    if not con:
+        con = engine
+    keys = list(keys)
+    if is_sqlalchemy_con(con):
+        sql_table = get_sql_table(table_name, con, required=True)
+        stmt = select(sql_table).where(sql_table.c[key].in_(keys))
+        tbl = pd.read_sql(stmt, con=con)
+    elif hasattr(con, 'get_rows_by_keys'):
+        tbl = con.get_rows_by_keys(table_name, key, keys)
+    else:
+        tbl = con.get_table(table_name)
+        tbl = tbl[tbl[key].isin(keys)]
+    return tbl
+
+
+@instrument.timed('database.get_table_fingerprints', measure_result=True)
+def get_table_fingerprints(table_name, key, fields, keep=None, con=None, in_sql=False,
+                           chunksize=DEFAULT_CHUNKSIZE, method=FINGERPRINT_METHOD):
+    ''' returns the key, the keep columns and a 64-bit digest of the fields of each row,
+    to find changed rows without reading them in full. see fingerprint_rows for the digest methods
+
+    :param table_name: table to read
+    :param key: key column
+    :param fields: columns included in the digest, in order
+    :param keep: (optional) columns returned with the digest, ex. last_modified
+    :param con: (optional) connection, defaults to the module engine
+    :param in_sql: (optional) compute the md5 digest in the database, for FINGERPRINT_SQL_DIALECTS.
+        otherwise the table is read in chunks and hashed with pandas
+    :param chunksize: (optional) number of rows per chunk hashed with pandas
+    :param method: (optional) digest method of FINGERPRINT_METHODS, md5 if in_sql
+    :return: table of key, keep columns and FINGERPRINT_FIELD as uint64
+    :rtype: pd.DataFrame
+    '''
+    if not con:
+        con = engine
+    keep = [c for c in (keep or []) if c != key]
+    if in_sql:
+        _check_digest_in_sql(con)
+        sql_table = get_sql_table(table_name, con, required=True)
+        stmt = select(*[sql_table.c[c] for c in [key] + keep],
+                      _sql_fingerprint([sql_table.c[f] for f in fields]).label(FINGERPRINT_FIELD))
+        tbl = pd.read_sql(stmt, con=con)
+        tbl[FINGERPRINT_FIELD] = _uint64(tbl[FINGERPRINT_FIELD])
+    else:
+        columns = list(dict.fromkeys([key] + keep + list(fields)))
+        chunks = [fingerprint_rows(chunk, key, fields, keep, method=method)
+                  for chunk in iter_table(table_name, con=con, chunksize=chunksize, columns=columns)]
+        if chunks:
+            tbl = pd.concat(chunks, ignore_index=True)
+        else:
+            tbl = pd.DataFrame({c: [] for c in [key] + keep})
+            tbl[FINGERPRINT_FIELD] = np.array([], dtype='uint64')
+    return tbl
+
+
+def digest_in_sql(con) -> bool:
+    """ True if the md5 row digests of get_table_fingerprints can be computed in the database of the connection
+    """
+    return is_sqlalchemy_con(con) and con.dialect.name in FINGERPRINT_SQL_DIALECTS
+
+
+def _check_digest_in_sql(con):
+    if not digest_in_sql(con):
+        dialect = con.dialect.name if is_sqlalchemy_con(con) else type(con).__name__
+        raise ValueError(f'sql fingerprints not supported for {dialect}. Allowed {FINGERPRINT_SQL_DIALECTS}')
+
+
+def fingerprint_rows(tbl, key, fields, keep=None, method=FINGERPRINT_METHOD) -> pd.DataFrame:
+    ''' returns the key, the keep columns and a 64-bit digest of the fields of each row of a table
+
+    :param method: (optional) digest method of FINGERPRINT_METHODS.
+        hash: the columns are hashed whole with pandas, each as the dtype of _hash_values, and combined.
+        md5: the first 64 bits of the md5 of the digest_text of the fields joined by FINGERPRINT_SEPARATOR,
+        the digest mysql computes in sql. it is hashed row by row, use it only to compare with a mysql table
+    '''
+    if method not in FINGERPRINT_METHODS:
+        raise ValueError(f'unrecognized fingerprint method:{method}. Allowed {FINGERPRINT_METHODS}')
+    keep = [c for c in (keep or []) if c != key]
+    fingerprints = tbl[[key] + keep].reset_index(drop=True)
+    if method == 'md5':
+        texts = [tbl[f].astype(object).map(digest_text) for f in fields]
+        if texts:
+            joined = texts[0].str.cat(texts[1:], sep=FINGERPRINT_SEPARATOR) if len(texts) > 1 else texts[0]
+        else:
+            joined = pd.Series('', index=tbl.index)
+        digests = np.array([_md5_digest(t) for t in joined], dtype='uint64')
+    else:
+        values = pd.DataFrame({i: _hash_values(tbl[f]).to_numpy() for i, f in enumerate(fields)},
+                              index=range(len(tbl)))
+        digests = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    fingerprints[FINGERPRINT_FIELD] = digests
+    return fingerprints
+
+
+def _hash_values(column: pd.Series) -> pd.Series:
+    # values of a column as hashed, so equal values read in different dtypes hash the same:
+    # numbers and booleans as float64, dates and datetimes as datetime64 to the second, other values as text
+    if pd.api.types.is_bool_dtype(column) or \
+            (pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_object_dtype(column)):
+        return column.astype('float64')
+    elif pd.api.types.is_datetime64_any_dtype(column):
+        return column.dt.floor('s')
+    inferred = pd.api.types.infer_dtype(column, skipna=True)
+    if inferred in ['boolean', 'integer', 'floating', 'mixed-integer-float', 'decimal']:
+        return pd.to_numeric(column.astype(object).where(column.notnull(), np.nan)).astype('float64')
+    elif inferred in ['datetime', 'datetime64', 'date']:
+        return pd.to_datetime(column).dt.floor('s')
+    return column.astype(str).where(column.notnull(), FINGERPRINT_NULL)
+
+
+def digest_text(value) -> str:
+    """ text of a value in an md5 row digest, written as mysql casts it:
+    nulls as FINGERPRINT_NULL, booleans as 1 or 0, integral floats as integers, other floats in their
+    shortest form, datetimes as YYYY-MM-DD at midnight and YYYY-MM-DD HH:MM:SS otherwise, without fractions
+    of seconds, and other values as str
+    """
+    if isinstance(value, str):
+        return value
+    elif value is None or value is pd.NaT or value is pd.NA:
+        return FINGERPRINT_NULL
+    elif isinstance(value, (bool, np.bool_)):
+        return '1' if value else '0'
+    elif isinstance(value, (int, np.integer)):
+        return str(int(value))
+    elif isinstance(value, (float, np.floating, decimal.Decimal)):
+        value = float(value)
+        if value != value:  # nan
+            return FINGERPRINT_NULL
+        elif value.is_integer() and abs(value) < FINGERPRINT_INT_FLOAT_MAX:
+            return str(int(value))
+        return repr(value)
+    elif isinstance(value, datetime.datetime):
+        if (value.hour, value.minute, value.second) == (0, 0, 0):
+            return value.strftime('%Y-%m-%d')
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+
+def _md5_digest(texts: str) -> int:
+    # first 64 bits of the md5 of the joined field texts
+    return int(hashlib.md5(texts.encode('utf-8')).hexdigest()[:16], 16)
+
+
+def _uint64(values) -> np.ndarray:
+    # mysql returns unsigned 64-bit integers above the int64 range as python ints
+    return np.array(list(values), dtype='uint64')
+
+
+def _sql_fingerprint(columns):
+    # the md5 digest of fingerprint_rows, in mysql
+    texts = [func.coalesce(_sql_digest_text(c), FINGERPRINT_NULL) for c in columns]
+    digest = func.left(func.md5(func.concat_ws(FINGERPRINT_SEPARATOR, *texts)), 16)
+    return cast(func.conv(digest, 16, 10), mysql_dialect.BIGINT(unsigned=True))
+
+
+def _sql_digest_text(column):
+    # mysql expression of the digest_text of a column
+    if isinstance(column.type, (sqltypes.Date, sqltypes.DateTime)):
+        return case((func.time(column) == '00:00:00', func.date_format(column, '%Y-%m-%d')),
+                    else_=func.date_format(column, '%Y-%m-%d %H:%i:%s'))
+    elif isinstance(column.type, sqltypes.Numeric) and not isinstance(column.type, sqltypes.Integer):
+        # decimals as doubles, which mysql casts to their shortest form
+        return cast(column + text('0e0'), mysql_dialect.CHAR)
+    return cast(column, mysql_dialect.CHAR)
+
+
+@instrument.timed('database.get_range_summaries', measure_result=True)
+def get_range_summaries(table_name, key, fields, ranges, last_modified, con=None, in_sql=False,
+                        method=FINGERPRINT_METHOD, parts=0):
+    ''' returns the row count, the xor of the row fingerprints and the max of last_modified of the rows
+    in each key range, to compare two tables range by range without reading the rows
+
+    :param table_name: table to read
+    :param key: key column
+    :param fields: columns included in the row fingerprints, see get_table_fingerprints
+    :param ranges: list of (lo, hi) key ranges as lo <= key < hi, None for an open end
+    :param last_modified: last modified column
+    :param con: (optional) connection, defaults to the module engine. generic connections
+        compute the summaries with their get_range_summaries method, and raise NotImplementedError without it
+    :param in_sql: (optional) compute the summaries of the md5 digests in the database, for FINGERPRINT_SQL_DIALECTS
+    :param method: (optional) digest method of FINGERPRINT_METHODS when not in_sql, see fingerprint_rows
+    :param parts: (optional) also return the splits of each range into this many ranges of equal row counts,
+        see range_splits
+    :return: one row per range with RANGE_SUMMARY_FIELDS, and RANGE_SPLITS_FIELD if parts > 1
+    :rtype: pd.DataFrame
+    '''
+    if not con:
+        con = engine
+    if in_sql or is_sqlalchemy_con(con):
+        batches = []
+        for i in range(0, len(ranges), RANGE_BATCHSIZE):
+            batch = ranges[i:i + RANGE_BATCHSIZE]
+            if in_sql:
+                summaries = _sql_range_summaries(table_name, key, fields, batch, last_modified, con)
+                if parts > 1:
+                    summaries[RANGE_SPLITS_FIELD] = _sql_range_splits(table_name, key, batch, parts, con)
+            else:
+                rows = get_rows_in_ranges(table_name, key, batch, con=con,
+                                          columns=list(dict.fromkeys([key, last_modified] + list(fields))))
+                summaries = summarize_ranges(rows, key, fields, batch, last_modified, method=method, parts=parts)
+            batches.append(summaries)
+        summaries = pd.concat(batches, ignore_index=True) if batches else summarize_ranges(
+            pd.DataFrame(), key, fields, [], last_modified, parts=parts)
+    elif hasattr(con, 'get_range_summaries'):
+        summaries = con.get_range_summaries(table_name, key, fields, ranges, last_modified,
+                                            method=method, parts=parts)
+    else:
+        raise NotImplementedError(f'{type(con).__name__} does not summarize key ranges. '
+                                  'Read the table once and use summarize_ranges')
+    return summaries
+
+
+def _sql_range_summaries(table_name, key, fields, ranges, last_modified, con) -> pd.DataFrame:
+    _check_digest_in_sql(con)
+    sql_table = get_sql_table(table_name, con, required=True)
+    fingerprint = _sql_fingerprint([sql_table.c[f] for f in fields])
+    stmt = union_all(*[
+        select(literal(i).label('range'),
+               func.count().label('count'),
+               func.bit_xor(fingerprint).label('digest'),
+               func.max(sql_table.c[last_modified]).label('last_modified')
+               ).where(_sql_range(sql_table.c[key], lo, hi))
+        for i, (lo, hi) in enumerate(ranges)])
+    summaries = pd.read_sql(stmt, con=con).sort_values('range', ignore_index=True)
+    summaries['digest'] = _uint64(summaries['digest'])
+    return summaries[RANGE_SUMMARY_FIELDS]
+
+
+def _sql_range_splits(table_name, key, ranges, parts, con) -> list:
+    # the first key of each ntile of each range but the first, as range_splits
+    sql_table = get_sql_table(table_name, con, required=True)
+    selects = []
+    for i, (lo, hi) in enumerate(ranges):
+        column = sql_table.c[key]
+        tiles = select(column.label('key'), func.ntile(parts).over(order_by=column).label('tile')
+                       ).where(_sql_range(column, lo, hi)).subquery()
+        selects.append(select(literal(i).label('range'), tiles.c.tile, func.min(tiles.c.key).label('split')
+                              ).group_by(tiles.c.tile))
+    tiles = pd.read_sql(union_all(*selects), con=con).sort_values(['range', 'tile'])
+    splits = [[] for _ in ranges]
+    for i, range_tiles in tiles.groupby('range'):
+        splits[i] = _distinct_splits(range_tiles['split'].tolist())
+    return splits
+
+
+def _sql_range(column, lo, hi):
+    conditions = [c for c in [None if lo is None else column >= lo,
+                              None if hi is None else column < hi] if c is not None]
+    return and_(*conditions) if conditions else true()
+
+
+def summarize_ranges(tbl, key, fields, ranges, last_modified, method=FINGERPRINT_METHOD, parts=0) -> pd.DataFrame:
+    ''' range summaries of get_range_summaries from the rows of a table, for generic connections
+    '''
+    fingerprints = fingerprint_rows(tbl, key, fields, [last_modified], method=method) if len(tbl) > 0 else None
+    return summarize_fingerprints(fingerprints, key, ranges, last_modified, parts=parts)
+
+
+def summarize_fingerprints(fingerprints, key, ranges, last_modified, parts=0) -> pd.DataFrame:
+    ''' range summaries of get_range_summaries from the row fingerprints of get_table_fingerprints
+    with last_modified kept, to summarize many ranges from one read of a table
+    '''
+    digests = np.array([], dtype='uint64')
+    keys = pd.Series([], dtype=object)
+    last_modified_values = pd.Series([], dtype=object)
+    if fingerprints is not None and len(fingerprints) > 0:
+        if not fingerprints[key].is_monotonic_increasing:
+            fingerprints = fingerprints.sort_values(key, ignore_index=True)
+        keys = fingerprints[key]
+        digests = fingerprints[FINGERPRINT_FIELD].to_numpy()
+        last_modified_values = fingerprints[last_modified]
+    summaries = []
+    for lo, hi in ranges:
+        first = 0 if lo is None else keys.searchsorted(lo, side='left')
+        last = len(keys) if hi is None else keys.searchsorted(hi, side='left')
+        summary = {
+            'count': int(max(last - first, 0)),
+            'digest': np.bitwise_xor.reduce(digests[first:last]) if last > first else np.uint64(0),
+            'last_modified': last_modified_values.iloc[first:last].max() if last > first else None
+        }
+        if parts > 1:
+            summary[RANGE_SPLITS_FIELD] = range_splits(keys.iloc[first:last].tolist(), parts)
+        summaries.append(summary)
+    columns = RANGE_SUMMARY_FIELDS + ([RANGE_SPLITS_FIELD] if parts > 1 else [])
+    summaries = pd.DataFrame(summaries, columns=columns)
+    summaries['digest'] = summaries['digest'].astype('uint64')
+    return summaries
+
+
+def range_splits(keys, parts) -> list:
+    ''' keys that split the sorted keys of a range into parts ranges of equal row counts, as sql ntile(parts):
+    the first key of each part but the first, without repeats or the first key of the range
+    '''
+    n = len(keys)
+    size, extra = divmod(n, parts)
+    starts = [p * size + min(p, extra) for p in range(parts)]
+    return _distinct_splits([keys[s] for s in starts if s < n])
+
+
+def _distinct_splits(firsts) -> list:
+    # the first keys of the parts of a range, without repeated keys, as split points
+    splits = []
+    for k in firsts[1:]:
+        if k != firsts[0] and (not splits or k != splits[-1]):
+            splits.append(k)
+    return splits
+
+
+@instrument.timed('database.get_rows_in_ranges', measure_result=True)
+def get_rows_in_ranges(table_name, key, ranges, con=None, columns=None):
+    ''' returns the rows of the table whose key is in any of the (lo, hi) ranges, as lo <= key < hi.
+    generic connections read them with their get_rows_in_ranges method, or read the full table without it
+    '''
+    if not con:
+        con = engine
+    if is_sqlalchemy_con(con):
+        sql_table = get_sql_table(table_name, con, required=True)
+        batches = []
+        for i in range(0, max(len(ranges), 1), RANGE_BATCHSIZE):
+            batch = ranges[i:i + RANGE_BATCHSIZE]
+            stmt = select(*[sql_table.c[c] for c in columns]) if columns else select(sql_table)
+            stmt = stmt.where(or_(false(), *[_sql_range(sql_table.c[key], lo, hi) for lo, hi in batch]))
+            batches.append(pd.read_sql(stmt, con=con))
+        tbl = pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+    elif hasattr(con, 'get_rows_in_ranges'):
+        tbl = con.get_rows_in_ranges(table_name, key, ranges)
+    else:
+        tbl = rows_in_ranges(con.get_table(table_name), key, ranges)
+    if columns and not is_sqlalchemy_con(con):
+        tbl = tbl[columns]
+    return tbl
+
+
+def rows_in_ranges(tbl, key, ranges) -> pd.DataFrame:
+    ''' the rows of a table whose key is in any of the (lo, hi) ranges, as lo <= key < hi
+    '''
+    in_ranges = pd.Series(False, index=tbl.index)
+    for lo, hi in ranges:
+        in_ranges |= (True if lo is None else tbl[key] >= lo) & (True if hi is None else tbl[key] < hi)
+    return tbl[in_ranges]
+
+
+def get_sql_table(table_name, eng=None, required=False):
+    ''' returns the reflected sqlalchemy Table, cached per engine.
+    only the requested table is reflected, on first use
+
+    :param table_name: table to reflect
+    :param eng: (optional) Engine or Connection, defaults to the module engine
+    :param required: (optional) raise NoSuchTableError if the table does not exist, otherwise return None
+    :rtype: sqlalchemy.Table
+    '''
+    if eng is None:
+        eng = engine
+    bind = eng.engine if isinstance(eng, Connection) else eng
+    with _schema_lock:
+        md = _schema_cache.get(bind)
+        if md is None:
+            md = MetaData()
+            _schema_cache[bind] = md
+        if table_name in md.tables:
+            sql_table = md.tables[table_name]
+        else:
+            try:
+                sql_table = Table(table_name, md, autoload_with=eng)
+            except NoSuchTableError:
+                sql_table = None
+    if sql_table is None and required:
+        raise NoSuchTableError(table_name)
+    return sql_table
+
+
+def invalidate_schema(table_name=None, eng=None):
+    ''' drops a table, or all tables if table_name is None, from the schema cache of the engine.
+    call after a table is created, altered or replaced outside of update_table
+    '''
+    if eng is None:
+        eng = engine
+    bind = eng.engine if isinstance(eng, Connection) else eng
+    with _schema_lock:
+        md = _schema_cache.get(bind)
+        if md is not None:
+            if table_name is None:
+                _schema_cache.pop(bind, None)
+            elif table_name in md.tables:
+                md.remove(md.tables[table_name])
+
+
+@instrument.timed('database.update_table', measure_arg='tbl')
 def update_table(tbl, tblname, append=True):
     if is_sqlalchemy_con(engine):
         if append:
             ifex = 'append'
         else:
             ifex = 'replace'
+            invalidate_schema(tblname, engine)
         tbl.to_sql(tblname, con=engine, if_exists=ifex, index=False)
     else:
         if not append:
@@ -194,127 +740,521 @@ def db_connection(db_type, con_obj=None, spec={}) -> dict:
     return connect
 
 
-def _sqlite_connection(database='') -> dict:
+def _sqlite_connection(database='', pool_options={}) -> dict:
     connect = {}
     try:
-        connect['engine'] = create_engine(database, echo=False)
+        connect['engine'] = pool.get_engine(database, pool_options=pool_options)
         connect['con'] = connect['engine'].connect()
     except Exception as e:
         print(f'ERROR: unable to connect to database {e}')
     return connect
 
 
+@instrument.timed('database.rows_insert', measure_arg='rows')
 def rows_insert(rows, table_name, con=None):
     if con is None:
-        con = con
+        con = engine
     if is_sqlalchemy_con(con):
         rows.to_sql(table_name, con=con, if_exists='append', index=False)
     else:
         con.rows_insert(rows, table_name)
 
 
+@instrument.timed('database.rows_delete', measure_arg='rows')
 def rows_delete(rows, table_name, key='index', eng=None):
     if eng is None:
         eng = engine
     if is_sqlalchemy_con(eng):
-        md = MetaData(bind=eng)
-        md.reflect()
-        if table_name in md.tables:
+        table = get_sql_table(table_name, eng)
+        if table is not None:
             if key == 'index':
                 keys = list(rows.index)
             else:
                 keys = list(rows[key])
 
-            table = md.tables[table_name]
             stmt = delete(table).\
                 where(table.c[key].in_(keys))
-            eng.connect().execute(stmt)
+            with _transaction(eng) as connection:
+                connection.execute(stmt)
     else:
         eng.rows_delete(rows, table_name, key)
 
 
-def rows_update(rows, table_name, key='index', eng=None):
+@instrument.timed('database.rows_update', measure_arg='rows')
+def rows_update(rows, table_name, key='index', eng=None, method='executemany'):
+    ''' updates rows by key. method 'executemany' runs one UPDATE per row,
+    'staging' loads the rows into a staging table and runs one set-based UPDATE, for large batches
+    '''
     if eng is None:
         eng = engine
     if is_sqlalchemy_con(eng):
         u_rows = rows.copy()
-        md = MetaData(bind=eng)
-        md.reflect()
-        if table_name in md.tables:
+        table = get_sql_table(table_name, eng)
+        if table is not None and method == 'staging' and eng.dialect.name in UPSERT_DIALECTS:
+            if key == 'index':
+                u_rows.reset_index(inplace=True)
+            _rows_upsert_staging(u_rows, table, key, eng, insert=False)
+        elif table is not None:
             if key == 'index':
                 u_rows.reset_index(inplace=True)
             u_rows.rename(columns={key: '_' + key}, inplace=True)
             row_values = u_rows.to_dict(orient='records')
 
-            table = md.tables[table_name]
             stmt = update(table).\
                 where(table.c[key] == bindparam('_' + key))
-            eng.connect().execute(stmt, row_values)
+            with _transaction(eng) as connection:
+                connection.execute(stmt, row_values)
     else:
         eng.rows_update(rows, table_name, key)
 
+
+@instrument.timed('database.rows_upsert', measure_arg='rows')
+def rows_upsert(rows, table_name, key='index', eng=None, method='auto'):
+    ''' inserts new rows and updates existing rows by key in one pass
+
+    :param rows: rows to insert or update
+    :param table_name: table name
+    :param key: key column, or 'index' to use the DataFrame index
+    :param eng: (optional) Engine, Connection or generic connection, defaults to the module engine
+    :param method: (optional) 'native' INSERT .. ON CONFLICT DO UPDATE (sqlite) or
+        ON DUPLICATE KEY UPDATE (mysql), requires a primary key or unique index on key.
+        'staging' loads the rows into a staging table, then runs one set-based UPDATE and INSERT.
+        'auto' uses native when the key is unique and the batch is below STAGING_THRESHOLD rows
+    :type rows: pd.DataFrame
+    :type method: str
+    '''
+    if method not in UPSERT_METHODS:
+        raise ValueError(f'unrecognized upsert method:{method}. Allowed {UPSERT_METHODS}')
+    if eng is None:
+        eng = engine
+    if len(rows) == 0:
+        return
+    u_rows = rows.reset_index() if key == 'index' else rows
+    if is_sqlalchemy_con(eng):
+        dialect = eng.dialect.name
+        table = get_sql_table(table_name, eng)
+        if table is None:
+            rows_insert(u_rows, table_name, con=eng)
+        elif dialect not in UPSERT_DIALECTS:
+            _rows_upsert_split(u_rows, table_name, key, eng)
+        else:
+            if method == 'auto':
+                if _is_unique_key(table, key) and len(u_rows) <= STAGING_THRESHOLD:
+                    method = 'native'
+                else:
+                    method = 'staging'
+            if method == 'native':
+                _rows_upsert_native(u_rows, table, key, eng)
+            else:
+                _rows_upsert_staging(u_rows, table, key, eng)
+    elif hasattr(eng, 'rows_upsert'):
+        eng.rows_upsert(u_rows, table_name, key)
+    else:
+        _rows_upsert_split(u_rows, table_name, key, eng)
+
+
+def _is_unique_key(table, key) -> bool:
+    pk_columns = [c.name for c in table.primary_key.columns]
+    unique_check = pk_columns == [key]
+    if not unique_check:
+        unique_check = any([idx.unique and [c.name for c in idx.columns] == [key]
+                            for idx in table.indexes])
+    return unique_check
+
+
+@contextmanager
+def _transaction(eng):
+    if isinstance(eng, Engine):
+        with eng.begin() as connection:
+            yield connection
+    elif eng.in_transaction():
+        yield eng
+    else:
+        with eng.begin():
+            yield eng
+
+
+def _rows_upsert_native(rows, table, key, eng):
+    if eng.dialect.name == 'sqlite':
+        stmt = sqlite_dialect.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key],
+            set_={c: stmt.excluded[c] for c in rows.columns if c != key})
+    else:
+        stmt = mysql_dialect.insert(table)
+        stmt = stmt.on_duplicate_key_update(
+            {c: stmt.inserted[c] for c in rows.columns if c != key})
+    row_values = rows.to_dict(orient='records')
+    with _transaction(eng) as connection:
+        for i in range(0, len(row_values), UPSERT_BATCHSIZE):
+            connection.execute(stmt, row_values[i:i + UPSERT_BATCHSIZE])
+
+
+def _rows_upsert_staging(rows, table, key, eng, insert=True):
+    staging_name = f'_staging_{table.name}_{uuid.uuid4().hex[:8]}'
+    quote = eng.dialect.identifier_preparer.quote
+    t, s, k = quote(table.name), quote(staging_name), quote(key)
+    fields = [quote(c) for c in rows.columns]
+    values = [quote(c) for c in rows.columns if c != key]
+    if eng.dialect.name == 'mysql':
+        update_sql = f'UPDATE {t} JOIN {s} ON {t}.{k} = {s}.{k} SET ' + \
+                     ', '.join([f'{t}.{c} = {s}.{c}' for c in values])
+    else:
+        update_sql = f'UPDATE {t} SET ' + \
+                     ', '.join([f'{c} = (SELECT {s}.{c} FROM {s} WHERE {s}.{k} = {t}.{k})' for c in values]) + \
+                     f' WHERE {t}.{k} IN (SELECT {k} FROM {s})'
+    insert_sql = f'INSERT INTO {t} (' + ', '.join(fields) + ') ' + \
+                 'SELECT ' + ', '.join([f'{s}.{c}' for c in fields]) + f' FROM {s} ' + \
+                 f'LEFT JOIN {t} ON {t}.{k} = {s}.{k} WHERE {t}.{k} IS NULL'
+    with _transaction(eng) as connection:
+        rows.to_sql(staging_name, con=connection, index=False)
+        try:
+            if values:
+                connection.execute(text(update_sql))
+            if insert:
+                connection.execute(text(insert_sql))
+        finally:
+            connection.execute(text(f'DROP TABLE {s}'))
+
+
+def _rows_upsert_split(rows, table_name, key, eng):
+    # backends without an upsert statement: update the existing keys, insert the rest
+    existing = get_rows_by_keys(table_name, key, rows[key], con=eng)[key]
+    is_existing = rows[key].isin(existing)
+    if is_existing.any():
+        rows_update(rows[is_existing], table_name, key=key, eng=eng)
+    if (~is_existing).any():
+        rows_insert(rows[~is_existing], table_name, con=eng)
+
 # -----------------------------------------------------
 # Google spreadsheet
 # -----------------------------------------------------
 
-def get_sheet(wkb_name, rng_code, include_values=True):
+def get_sheet(wkb_name, rng_code, include_values=True, refresh=False):
     ''' get a table from a range in a gsheet as a pandas DataFrame
 
     :param wkb_name: spreadsheet label
     :param rng_code: table range label
     :param include_values: (optional) set to False to return an empty table with just the header
+    :param refresh: (optional) read from the api even if the range is in the gs_engine cache
     :type wkb_name: str
     :type rng_code: str
     :type include_values: bool
+    :type refresh: bool
     :return: table with a header and values
     :rtype: pd.DataFrame
     '''
+    return get_sheets(wkb_name, [rng_code], include_values=include_values, refresh=refresh)[rng_code]
+
+
+@instrument.timed('database.get_sheets', measure_result=True)
+def get_sheets(wkb_name, rng_codes=None, include_values=True, refresh=False):
+    ''' get several tables from ranges in a gsheet as pandas DataFrames,
+    reading all headers and data ranges in a single request
+
+    :param wkb_name: spreadsheet label
+    :param rng_codes: (optional) table range labels, defaults to all ranges configured for the spreadsheet
+    :param include_values: (optional) set to False to return empty tables with just the header
+    :param refresh: (optional) read from the api even if the ranges are in the gs_engine cache
+    :type wkb_name: str
+    :type rng_codes: list
+    :type include_values: bool
+    :type refresh: bool
+    :return: tables by range label
+    :rtype: dict of pd.DataFrame
+    '''
+    wkbid, rng_codes, rng_ids = _sheet_ranges(wkb_name, rng_codes)
+    range_values = gs_engine.batch_get_rangevalues(wkbid, rng_ids, refresh=refresh)
+    return _sheet_tables(wkb_name, rng_codes, range_values, include_values)
+
+
+def _sheet_ranges(wkb_name, rng_codes=None):
+    # spreadsheet id, range labels and the header and data range ids of each label
     WKB_CONFIG = GSHEET_CONFIG[wkb_name]
     wkbid = WKB_CONFIG['wkbid']
-    rng_config = WKB_CONFIG['sheets'][rng_code]
-    rngid = rng_config['data']
-    hdrid = rng_config['header']
-    valueList = gs_engine.get_rangevalues(wkbid, rngid)
-    header = gs_engine.get_rangevalues(wkbid, hdrid)[0]
+    if rng_codes is None:
+        rng_codes = list(WKB_CONFIG['sheets'].keys())
+    rng_ids = []
+    for rng_code in rng_codes:
+        rng_config = WKB_CONFIG['sheets'][rng_code]
+        rng_ids = rng_ids + [rng_config['header'], rng_config['data']]
+    return wkbid, rng_codes, rng_ids
+
+
+def _sheet_tables(wkb_name, rng_codes, range_values, include_values=True):
+    WKB_CONFIG = GSHEET_CONFIG[wkb_name]
+    wkbid = WKB_CONFIG['wkbid']
+    tables = {}
+    for i, rng_code in enumerate(rng_codes):
+        rng_config = WKB_CONFIG['sheets'][rng_code]
+        header = range_values[2 * i][0]
+        valueList = range_values[2 * i + 1]
+        tables[rng_code] = _sheet_table(wkb_name, rng_code, header, valueList, include_values)
+        # the snapshot is kept as posted by post_delta_to_gsheet, from the coerced values
+        if include_values:
+            SHEET_SNAPSHOTS[(wkbid, rng_config['data'])] = _gsheet_values(tables[rng_code])
+        else:
+            SHEET_SNAPSHOTS.pop((wkbid, rng_config['data']), None)
+    return tables
+
+
+def _sheet_table(wkb_name, rng_code, header, valueList, include_values=True):
     if include_values:
         rng = pd.DataFrame(valueList, columns=header)
-        if 'data_types' in rng_config:
-            data_types = rng_config['data_types']
-            for field in data_types:
-                typeId = data_types[field]
-                if not typeId in ['str', 'date']:
-                    if typeId in NUMERIC_TYPES:
-                        # to deal with conversion from '' to nan
-                        if typeId in ['float']:  # nan compatible
-                            rng[field] = pd.to_numeric(rng[field]).astype(typeId)
-                        else:  # nan incompatible types
-                            rng[field] = pd.to_numeric(rng[field]).fillna(0).astype(typeId)
-                    else:
-                        rng[field] = rng[field].astype(typeId)
-                if typeId == 'date':
-                    if 'date_format' in rng_config:
-                        rng[field] = rng[field].apply(
-                            lambda x: dt.datetime.strptime(x, rng_config['date_format']))
+        rng = coerce_types(rng, wkb_name, rng_code)
     else:
         rng = pd.DataFrame([], columns=header)
 
     return rng
 
 
-def post_to_gsheet(df, wkb_name, rng_code, input_option='RAW'):
+def coerce_types(rng, wkb_name, rng_code):
+    ''' converts the fields of a table read from a gsheet range to the data_types of its GSHEET_CONFIG.
+    values that fail to convert are set to null and reported in COERCION_ERRORS[(wkb_name, rng_code)]
+    as a table of row, field, value, data_type
+
+    data types:
+        str: unchanged
+        int: nullable integer Int64
+        float: float, blanks as nan
+        date: datetime if the range has a date_format, otherwise unchanged
+        datetime: datetime, with the date_format of the range if any
+        category: categorical strings
+        other: pandas astype(data_type)
+    '''
+    errors = []
+    for field, typeId, converter in coercion_plan(wkb_name, rng_code):
+        if field in rng.columns and converter is not None:
+            values = rng[field]
+            missing = values.isna() | values.eq('')
+            try:
+                converted = converter(values)
+            except (ValueError, TypeError):
+                converted = values
+                failed = ~missing
+            else:
+                failed = converted.isna() & ~missing
+            rng[field] = converted
+            if failed.any():
+                errors.append(pd.DataFrame({
+                    'row': rng.index[failed],
+                    'field': field,
+                    'value': values[failed].values,
+                    'data_type': typeId
+                }))
+    if errors:
+        COERCION_ERRORS[(wkb_name, rng_code)] = pd.concat(errors, ignore_index=True)
+    else:
+        COERCION_ERRORS.pop((wkb_name, rng_code), None)
+    return rng
+
+
+def coercion_plan(wkb_name, rng_code):
+    ''' returns the [(field, data_type, converter)] of a range, compiled once from GSHEET_CONFIG
+    '''
+    key = (wkb_name, rng_code)
+    if key not in COERCION_PLANS:
+        rng_config = GSHEET_CONFIG[wkb_name]['sheets'][rng_code]
+        date_format = rng_config.get('date_format')
+        data_types = rng_config.get('data_types', {})
+        COERCION_PLANS[key] = [(field, data_types[field], _converter(data_types[field], date_format))
+                               for field in data_types]
+    return COERCION_PLANS[key]
+
+
+def _converter(typeId, date_format=None):
+    # vectorized conversion of a column of str values, invalid values to null
+    if typeId == 'str':
+        converter = None
+    elif typeId == 'float':
+        converter = lambda s: pd.to_numeric(s, errors='coerce').astype('float')
+    elif typeId == 'int':
+        def converter(s):
+            numbers = pd.to_numeric(s, errors='coerce')
+            return numbers.where(numbers % 1 == 0).astype('Int64')
+    elif typeId == 'date':
+        if date_format:
+            converter = lambda s: pd.to_datetime(s, format=date_format, errors='coerce')
+        else:
+            converter = None
+    elif typeId == 'datetime':
+        converter = lambda s: pd.to_datetime(s, format=date_format, errors='coerce')
+    elif typeId == 'category':
+        converter = lambda s: s.astype('category')
+    else:
+        converter = lambda s: s.astype(typeId)
+    return converter
+
+
+def post_to_gsheet(df, wkb_name, rng_code, input_option='RAW', mode='clear'):
     ''' post pandas DataFrame table to a range in a gsheet
 
     :param df: table composed of a header and values
     :param wkb_name: spreadsheet label
     :param rng_code: table range label
     :param input_option: post all fields as str or in the type passsed by the user
+    :param mode: (optional) 'clear' clears the range then writes the values,
+        'overwrite' writes the values and blanks the trailing rows in a single request, see post_to_gsheets
     :type df: pd.DataFrame
     :type wkb_name: str
     :type rng_code: str
     :type input_option: str
+    :type mode: str
 
     to specify datatype set input_option = 'USER_ENTERED'
     '''
+    post_to_gsheets([(wkb_name, rng_code, df)], input_option=input_option, mode=mode)
+
+
+@instrument.timed('database.post_to_gsheets')
+def post_to_gsheets(targets, input_option='RAW', mode='clear'):
+    ''' post several pandas DataFrame tables to ranges in gsheets,
+    with one write request per spreadsheet
+
+    :param targets: list of (wkb_name, rng_code, df)
+    :param input_option: post all fields as str or in the type passsed by the user
+    :param mode: (optional) 'clear' clears all the ranges of a spreadsheet in one request
+        then writes them in a second request.
+        'overwrite' writes the values and blanks only the rows left over from the previous
+        contents of the range, in a single request with no window where the range looks empty.
+        it needs the row count of the range from a previous read or post by this process,
+        ranges without one, or without columns such as a bare sheet name, are cleared first as in 'clear' mode
+    :type targets: list
+    :type input_option: str
+    :type mode: str
+    '''
+    workbooks = _post_workbooks(targets, mode)
+    for wkbid in workbooks:
+        clear_ranges, range_values = _post_requests(gs_engine, wkbid, workbooks[wkbid], input_option, mode)
+        if clear_ranges:
+            gs_engine.batch_clear_rangevalues(wkbid, clear_ranges)
+        if range_values:
+            gs_engine.batch_set_rangevalues(wkbid, range_values, input_option)
+        _posted(gs_engine, wkbid, workbooks[wkbid])
+
+
+def _post_workbooks(targets, mode):
+    # {wkbid: [(rngid, df)]} of the targets
+    if mode not in POST_MODES:
+        raise ValueError(f'unrecognized post mode:{mode}. Allowed {POST_MODES}')
+    workbooks = {}
+    for wkb_name, rng_code, df in targets:
+        wkbid, rngid, df = _post_range(wkb_name, rng_code, df)
+        workbooks.setdefault(wkbid, []).append((rngid, df))
+    return workbooks
+
+
+def _post_requests(engine, wkbid, ranges, input_option, mode):
+    # ranges to clear and (rngid, values) to write for the ranges of one spreadsheet
+    clear_ranges = []
+    range_values = []
+    for rngid, df in ranges:
+        values = _gsheet_values(df, input_option) if len(df) > 0 else []
+        row_count = engine.get_rowcount(wkbid, rngid) if mode == 'overwrite' else None
+        if row_count is not None and not _is_cell_range(rngid):
+            print(f'WARNING: overwrite mode needs the columns of the range {rngid}, clearing it instead')
+            row_count = None
+        if row_count is None:
+            clear_ranges.append(rngid)
+        else:
+            # blank the cells of the range not covered by the new values
+            width = max(range_width(rngid), len(df.columns))
+            if width > len(df.columns):
+                values = [row + [''] * (width - len(row)) for row in values]
+            values = values + [[''] * width] * max(row_count - len(values), 0)
+        if len(values) > 0:
+            range_values.append((rngid, values))
+    return clear_ranges, range_values
+
+
+def _posted(engine, wkbid, ranges):
+    for rngid, df in ranges:
+        engine.set_rowcount(wkbid, rngid, len(df))
+        SHEET_SNAPSHOTS[(wkbid, rngid)] = _gsheet_values(df)
+
+
+@instrument.timed('database.post_delta_to_gsheet', measure_arg='df')
+def post_delta_to_gsheet(df, wkb_name, rng_code, input_option='RAW',
+                         max_change_ratio=DELTA_MAX_CHANGE_RATIO):
+    ''' post only the cells of a pandas DataFrame table that changed since the range was
+    last read or posted by this process, as a minimal set of ranges in a single request
+
+    :param df: table composed of a header and values
+    :param wkb_name: spreadsheet label
+    :param rng_code: table range label
+    :param input_option: post all fields as str or in the type passsed by the user
+    :param max_change_ratio: (optional) share of changed cells above which the full range is rewritten
+    :type df: pd.DataFrame
+    :type wkb_name: str
+    :type rng_code: str
+    :type input_option: str
+    :type max_change_ratio: float
+    :return: number of cells written, including blanked cells
+    :rtype: int
+
+    changed cells of a row are written as one block from the first to the last changed column,
+    consecutive rows with the same changed columns are merged, appended rows are written as one block
+    and rows removed from the end of the table are blanked.
+    the snapshot holds the RAW strings of the table as read and coerced or as posted, so unchanged values
+    compare equal whatever their formatting in the sheet.
+    the snapshot does not see edits made in the sheet by other users since the last read
+    '''
+    wkbid, rngid, df = _post_range(wkb_name, rng_code, df)
+    snapshot = SHEET_SNAPSHOTS.get((wkbid, rngid))
+    width = len(df.columns)
+    if snapshot is None or not _is_cell_range(rngid) or any([len(row) > width for row in snapshot]):
+        row_count = gs_engine.get_rowcount(wkbid, rngid) or 0
+        post_to_gsheet(df, wkb_name, rng_code, input_option=input_option, mode='overwrite')
+        return max(len(df), row_count) * width
+
+    new_values = _gsheet_values(df, input_option) if len(df) > 0 else []
+    new_str = np.array(_gsheet_values(df), dtype=object).reshape(len(df), width)
+    old_str = np.full((len(snapshot), width), '', dtype=object)
+    for i, row in enumerate(snapshot):
+        old_str[i, :len(row)] = row
+    n_new, n_old = len(new_str), len(old_str)
+    n_common = min(n_new, n_old)
+
+    #01 changed cell blocks of the common rows
+    blocks = []  # [row_start, n_rows, col_start, n_cols]
+    changed = new_str[:n_common] != old_str[:n_common]
+    for i in np.flatnonzero(changed.any(axis=1)):
+        cols = np.flatnonzero(changed[i])
+        col_start, n_cols = int(cols[0]), int(cols[-1] - cols[0] + 1)
+        last = blocks[-1] if blocks else None
+        if last and last[0] + last[1] == i and last[2] == col_start and last[3] == n_cols:
+            last[1] = last[1] + 1
+        else:
+            blocks.append([int(i), 1, col_start, n_cols])
+
+    #02 appended and removed rows
+    if n_new > n_old:
+        blocks.append([n_old, n_new - n_old, 0, width])
+    elif n_old > n_new:
+        blocks.append([n_new, n_old - n_new, 0, width])
+
+    cells = sum([b[1] * b[3] for b in blocks])
+    if cells > max_change_ratio * max(n_new * width, 1):
+        post_to_gsheet(df, wkb_name, rng_code, input_option=input_option, mode='overwrite')
+        return max(n_new, n_old) * width
+
+    range_values = []
+    for row_start, n_rows, col_start, n_cols in blocks:
+        block_rngid = range_block(rngid, row_start, n_rows, col_start, n_cols)
+        if row_start >= n_new:
+            values = [[''] * n_cols] * n_rows
+        else:
+            values = [row[col_start:col_start + n_cols] for row in new_values[row_start:row_start + n_rows]]
+        range_values.append((block_rngid, values))
+    if range_values:
+        gs_engine.batch_set_rangevalues(wkbid, range_values, input_option)
+    gs_engine.set_rowcount(wkbid, rngid, n_new)
+    SHEET_SNAPSHOTS[(wkbid, rngid)] = new_str.tolist()
+    return cells
+
+
+def _post_range(wkb_name, rng_code, df):
+    # spreadsheet id, range and fields to post a table to
     WKB_CONFIG = GSHEET_CONFIG[wkb_name]
     wkbid = WKB_CONFIG['wkbid']
     rng_config = WKB_CONFIG['sheets'][rng_code]
@@ -325,18 +1265,222 @@ def post_to_gsheet(df, wkb_name, rng_code, input_option='RAW'):
         df = df[fields]
     else:
         rngid = rng_config['data']
+    return wkbid, rngid, df
 
-    # clear the range
-    gs_engine.clear_rangevalues(wkbid, rngid)
 
-    # post new values
+@instrument.timed('database.post_table_to_gsheet')
+def post_table_to_gsheet(table_name, wkb_name, rng_code, con=None, input_option='RAW',
+                         chunksize=DEFAULT_CHUNKSIZE, chunk_bytes=None, where=None):
+    ''' post a database table to a range in a gsheet one chunk at a time,
+    without loading the full table into memory
+
+    :param table_name: table to read
+    :param wkb_name: spreadsheet label
+    :param rng_code: table range label
+    :param con: (optional) connection, defaults to the module engine
+    :param input_option: post all fields as str or in the type passsed by the user
+    :param chunksize: (optional) number of rows per chunk and per request
+    :param chunk_bytes: (optional) memory budget per chunk, see iter_table
+    :param where: (optional) SQL predicate, see iter_table
+    '''
+    WKB_CONFIG = GSHEET_CONFIG[wkb_name]
+    wkbid = WKB_CONFIG['wkbid']
+    rng_config = WKB_CONFIG['sheets'][rng_code]
+    columns = None
+    if 'post' in rng_config:
+        post_config = rng_config['post']
+        rngid = post_config['data']
+        columns = post_config['fields']
+    else:
+        rngid = rng_config['data']
+    if not _is_cell_range(rngid):
+        raise ValueError(f'unrecognized range address:{rngid}, the chunks are posted at row offsets '
+                         'of the range, expected columns as in sheet!A2:C')
+
+    # the chunks overwrite the range from the top, then only the rows left below them are cleared,
+    # so the range is never empty while it is posted
+    row_offset = 0
+    for chunk in iter_table(table_name, con=con, chunksize=chunksize, chunk_bytes=chunk_bytes,
+                            columns=columns, where=where):
+        if len(chunk) > 0:
+            values = _gsheet_values(chunk, input_option)
+            chunk_rngid = range_offset(rngid, row_offset, len(chunk))
+            gs_engine.set_rangevalues(wkbid, chunk_rngid, values, input_option)
+            row_offset = row_offset + len(chunk)
+    row_count = gs_engine.get_rowcount(wkbid, rngid)
+    below_rngid = range_below(rngid, row_offset)
+    if below_rngid and (row_count is None or row_count > row_offset):
+        gs_engine.clear_rangevalues(wkbid, below_rngid)
+    gs_engine.set_rowcount(wkbid, rngid, row_offset)
+    SHEET_SNAPSHOTS.pop((wkbid, rngid), None)
+
+
+def _gsheet_values(df, input_option='RAW'):
     # DataFrame values must be converted to a 2D list [[]]
-    if len(df) > 0:
-        if input_option == 'RAW':  # write everything as a string
-            values = df.values.astype('str').tolist()
-        else:  # write as type passed by user
-            values = df.values.tolist()
-        gs_engine.set_rangevalues(wkbid, rngid, values, input_option)
+    if input_option == 'RAW':  # write everything as a string
+        values = df.values.astype('str').tolist()
+    else:  # write as type passed by user
+        values = df.values.tolist()
+    return values
+
+
+def range_offset(rngid, row_offset, n_rows):
+    ''' returns the A1 address of n_rows starting row_offset rows below the start of the range
+        ex. range_offset('records!A2:C', 100, 50) = 'records!A102:C151'
+    '''
+    sheet, first_col, first_row, last_col = _parse_range(rngid)
+    start = first_row + row_offset
+    end = start + n_rows - 1
+    return f'{sheet}{first_col}{start}:{last_col}{end}'
+
+
+def range_below(rngid, row_offset):
+    ''' returns the A1 address of the rows of the range from row_offset rows below its start,
+    '' if the range ends before them
+        ex. range_below('records!A2:C', 100) = 'records!A102:C'
+    '''
+    sheet, first_col, first_row, last_col = _parse_range(rngid)
+    start = first_row + row_offset
+    last_row = re.search(r':[A-Z]+(\d+)$', rngid)
+    if last_row is None:
+        return f'{sheet}{first_col}{start}:{last_col}'
+    elif start <= int(last_row.group(1)):
+        return f'{sheet}{first_col}{start}:{last_col}{last_row.group(1)}'
+    return ''
+
+
+def range_block(rngid, row_offset, n_rows, col_offset, n_cols):
+    ''' returns the A1 address of a block of cells within the range, offsets from its first cell
+        ex. range_block('records!A2:C', 10, 2, 1, 2) = 'records!B12:C13'
+    '''
+    sheet, first_col, first_row, last_col = _parse_range(rngid)
+    first = _column_number(first_col) + col_offset
+    start = first_row + row_offset
+    return f'{sheet}{_column_letter(first)}{start}:{_column_letter(first + n_cols - 1)}{start + n_rows - 1}'
+
+
+def range_width(rngid):
+    ''' returns the number of columns of the range, ex. range_width('records!A2:C') = 3
+    '''
+    sheet, first_col, first_row, last_col = _parse_range(rngid)
+    return _column_number(last_col) - _column_number(first_col) + 1
+
+
+def _parse_range(rngid):
+    # an open start row, as in 'records!A:C', starts at row 1
+    match = re.match(r'^(.*!)?([A-Z]+)(\d*)(?::([A-Z]+)\d*)?$', rngid)
+    if match is None:
+        raise ValueError(f'unrecognized range address:{rngid}, expected columns as in sheet!A2:C or sheet!A:C')
+    sheet, first_col, first_row, last_col = match.groups()
+    sheet = sheet if sheet else ''
+    last_col = last_col if last_col else first_col
+    return sheet, first_col, int(first_row) if first_row else 1, last_col
+
+
+def _is_cell_range(rngid) -> bool:
+    # False for a range without columns, such as a sheet name
+    try:
+        _parse_range(rngid)
+    except ValueError:
+        return False
+    return True
+
+
+def _column_number(col):
+    number = 0
+    for c in col:
+        number = number * 26 + ord(c) - ord('A') + 1
+    return number
+
+
+def _column_letter(number):
+    col = ''
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        col = chr(ord('A') + remainder) + col
+    return col
+
+
+# -----------------------------------------------------
+# async gsheet io
+# -----------------------------------------------------
+
+
+def async_engine(max_concurrency=gs.ASYNC_CONCURRENCY):
+    ''' returns the module gs.AsyncSheetsEngine, created on first use.
+    it shares the row counts and range cache of gs_engine when loaded
+
+    :param max_concurrency: (optional) requests in flight at once, applies when the engine is created
+    :type max_concurrency: int
+    :rtype: gs.AsyncSheetsEngine
+    '''
+    global gs_async_engine
+    if gs_async_engine is None:
+        if gs_engine is None:
+            gs_async_engine = gs.AsyncSheetsEngine(max_concurrency=max_concurrency)
+        else:
+            gs_async_engine = gs.AsyncSheetsEngine(max_concurrency=max_concurrency, range_cache=gs_engine.cache,
+                                                   scheduler=gs_engine.scheduler, rowCounts=gs_engine.rowCounts)
+    return gs_async_engine
+
+
+async def get_sheet_async(wkb_name, rng_code, include_values=True, refresh=False):
+    ''' coroutine of get_sheet, see get_sheets_async
+    '''
+    tables = await get_sheets_async(wkb_name, [rng_code], include_values=include_values, refresh=refresh)
+    return tables[rng_code]
+
+
+async def get_sheets_async(wkb_name, rng_codes=None, include_values=True, refresh=False):
+    ''' coroutine of get_sheets, to read several spreadsheets concurrently
+
+        tables = await asyncio.gather(*[db.get_sheets_async(wkb_name) for wkb_name in wkb_names])
+
+    :return: tables by range label
+    :rtype: dict of pd.DataFrame
+    '''
+    wkbid, rng_codes, rng_ids = _sheet_ranges(wkb_name, rng_codes)
+    range_values = await async_engine().batch_get_rangevalues(wkbid, rng_ids, refresh=refresh)
+    return _sheet_tables(wkb_name, rng_codes, range_values, include_values)
+
+
+async def get_workbooks_async(wkb_names=None, include_values=True, refresh=False):
+    ''' reads all the configured ranges of several spreadsheets concurrently
+
+    :param wkb_names: (optional) spreadsheet labels, defaults to all spreadsheets in GSHEET_CONFIG
+    :return: {wkb_name: {rng_code: table}}
+    :rtype: dict
+    '''
+    if wkb_names is None:
+        wkb_names = list(GSHEET_CONFIG.keys())
+    workbooks = await asyncio.gather(*[
+        get_sheets_async(wkb_name, include_values=include_values, refresh=refresh) for wkb_name in wkb_names])
+    return dict(zip(wkb_names, workbooks))
+
+
+async def post_to_gsheet_async(df, wkb_name, rng_code, input_option='RAW', mode='clear'):
+    ''' coroutine of post_to_gsheet, see post_to_gsheets_async
+    '''
+    await post_to_gsheets_async([(wkb_name, rng_code, df)], input_option=input_option, mode=mode)
+
+
+async def post_to_gsheets_async(targets, input_option='RAW', mode='clear'):
+    ''' coroutine of post_to_gsheets, posting to the spreadsheets of the targets concurrently
+
+    :param targets: list of (wkb_name, rng_code, df)
+    '''
+    engine = async_engine()
+    workbooks = _post_workbooks(targets, mode)
+
+    async def post_workbook(wkbid):
+        clear_ranges, range_values = _post_requests(engine, wkbid, workbooks[wkbid], input_option, mode)
+        if clear_ranges:
+            await engine.batch_clear_rangevalues(wkbid, clear_ranges)
+        if range_values:
+            await engine.batch_set_rangevalues(wkbid, range_values, input_option)
+        _posted(engine, wkbid, workbooks[wkbid])
+
+    await asyncio.gather(*[post_workbook(wkbid) for wkbid in workbooks])
 
 
 # -----------------------------------------------------
@@ -7,10 +7,16 @@
 # import dependencies
 #-----------------------------------------------------------------------------
 import io
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from httplib2 import Http
 from oauth2client.service_account import ServiceAccountCredentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
+from sqlgsheet import quota
+from sqlgsheet import cache
 
 #-----------------------------------------------------------------------------
 # module variables
@@ -20,8 +26,18 @@ CLIENT_SECRET_DEFAULT = 'client_secret.json'
 CLIENT_SECRET_FILE = ''
 LOADED = False
 ordRef = {'A': 65}
+PAGE_SIZE = 1000  # files per list request, the api maximum
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_CHUNKSIZE = 10 * 2 ** 20  # bytes per download request
+BATCH_SIZE = 100  # sub-requests per batch request, the api maximum
+BATCH_RETRIES = 3  # retries of the items of a batch that failed with a rate limit or server error
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+METADATA_CACHE_TTL = 3600  # seconds
 gdrive_engine = None
 service = None
+# folder ids and file parents already looked up, None looks up every time. see enable_cache
+metadata_cache = None
+_local = threading.local()  # service of each download worker thread, httplib2 is not thread safe
 
 def set_secret_file_path():
     global CLIENT_SECRET_FILE, LOADED
@@ -34,49 +50,112 @@ def set_secret_file_path():
 #-----------------------------------------------------------------------------
 
 
-def download_file(file_id):
-    #returns the file as a bytes type
-    payload = False
-    request = service.files().get_media(fileId=file_id)
-    file = io.BytesIO()
-    downloader = MediaIoBaseDownload(file, request)
+def download_file(file_id, destination=None, callback=None,
+                  chunksize=DOWNLOAD_CHUNKSIZE, drive_service=None):
+    #returns the file as a bytes type, or streams it chunk by chunk
+    #to destination, a file path or writable file object, or to callback(chunk)
+    #in which case it returns the number of bytes downloaded
+    drive_service = service if drive_service is None else drive_service
+    request = drive_service.files().get_media(fileId=file_id)
+    if isinstance(destination, str):
+        with open(destination, 'wb') as file:
+            return _download(request, file, chunksize)
+    elif destination is not None:
+        return _download(request, destination, chunksize)
+    elif callback is not None:
+        return _download(request, _CallbackWriter(callback), chunksize)
+    else:
+        file = io.BytesIO()
+        _download(request, file, chunksize)
+        payload = file.getvalue()
+        return payload
+
+
+def _download(request, file, chunksize):
+    downloader = MediaIoBaseDownload(file, request, chunksize=chunksize)
+    size = 0
     done = False
     while done is False:
-        status, done = downloader.next_chunk()
+        status, done = quota.call(downloader.next_chunk, 'drive')
         #print(F'Download {int(status.progress() * 100)}.')
+        size = status.resumable_progress if status is not None else size
+    return size
+
 
-    payload = file.getvalue()
-    return payload
+class _CallbackWriter(object):
+    def __init__(self, callback):
+        self.callback = callback
 
+    def write(self, chunk):
+        self.callback(chunk)
+        return len(chunk)
 
-def download_files_in_folder(folder_name, folder_id, mime_type=None):
-    payloads = []
-    names = []
+
+def download_files(file_references, destination_dir=None, callback=None,
+                   workers=DOWNLOAD_WORKERS, chunksize=DOWNLOAD_CHUNKSIZE):
+    #downloads files [{'id', 'name'}] concurrently, each worker thread with its own service
+    #returns {name: bytes}, or with destination_dir streams each file to disk and returns {name: path},
+    #or with callback(file_reference, chunk) streams the chunks and returns {name: bytes downloaded}
+    def download(f):
+        kwargs = {'chunksize': chunksize, 'drive_service': _thread_service()}
+        if destination_dir is not None:
+            path = os.path.join(destination_dir, f['name'])
+            download_file(f['id'], destination=path, **kwargs)
+            return path
+        elif callback is not None:
+            return download_file(f['id'], callback=lambda chunk: callback(f, chunk), **kwargs)
+        else:
+            return download_file(f['id'], **kwargs)
+
+    if destination_dir is not None:
+        os.makedirs(destination_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(download, file_references))
+    files = dict(zip([f['name'] for f in file_references], results))
+    return files
+
+
+def download_files_in_folder(folder_name, folder_id, mime_type=None, destination_dir=None,
+                             callback=None, workers=DOWNLOAD_WORKERS, chunksize=DOWNLOAD_CHUNKSIZE):
+    #see download_files for destination_dir, callback, workers and chunksize
     file_references = get_files_in_folder(
         folder_name, folder_id,
         include_subfolders=False,
         mime_type=mime_type)
-    if len(file_references) > 0:
-        for f in file_references:
-            payload = download_file(f['id'])
-            payloads.append(payload)
-            names.append(f['name'])
-
-    files = dict(zip(names, payloads))
+    files = download_files(file_references, destination_dir=destination_dir,
+                           callback=callback, workers=workers, chunksize=chunksize)
     return files
 
 
-def get_folder_id(folder_name):
+def get_folder_id(folder_name, parent_id=''):
+    #id of a folder by name, anywhere in the drive or in the parent folder, '' if not found
+    key = ('folder', parent_id, folder_name)
+    folder_id = _cache_get(key)
+    if folder_id is None:
+        folder_id = ''
+        qry = "name='"+_quote(folder_name)+"' and "
+        qry = qry + "mimeType='"+FOLDER_MIME_TYPE+"'"
+        if parent_id != '':
+            qry = qry + " and '"+parent_id+"' in parents"
+        response = quota.execute(service.files().list(
+            q=qry,
+            spaces='drive'
+        ), 'drive', key=('list', qry))
+        found_folder = len(response['files']) > 0
+        if found_folder:
+            folder_id = response['files'][0]['id']
+            _cache_put(key, folder_id)
+    return folder_id
+
+
+def get_folder_id_by_path(folder_path):
+    #id of a nested folder 'a/b/c', the first folder found by name anywhere in the drive
+    #and each next folder by name within the previous one. '' if any folder is not found
     folder_id = ''
-    qry = "name='"+folder_name+"' and "
-    qry = qry + "mimeType='application/vnd.google-apps.folder'"
-    response = service.files().list(
-        q=qry,
-        spaces='drive'
-    ).execute()
-    found_folder = len(response['files']) > 0
-    if found_folder:
-        folder_id = response['files'][0]['id']
+    for i, folder_name in enumerate([f for f in folder_path.split('/') if f]):
+        if i > 0 and folder_id == '':
+            break
+        folder_id = get_folder_id(folder_name, parent_id=folder_id)
     return folder_id
 
 
@@ -89,50 +168,166 @@ def get_files_in_folder(folder_name, folder_id='',
     if len(folder_id) > 0:
         qry = "'"+folder_id+"' in parents"
         if not include_subfolders:
-            qry = qry + " and mimeType!='application/vnd.google-apps.folder'"
+            qry = qry + " and mimeType!='"+FOLDER_MIME_TYPE+"'"
         if not mime_type is None:
             qry = qry + " and mimeType='"+mime_type+"'"
-        response = service.files().list(
-            q=qry,
-            spaces='drive'
-        ).execute()
-        files = response['files']
+        files = list(iter_files(qry))
     return files
 
 
+def iter_files(qry, fields='nextPageToken, files(id, name, mimeType)', page_size=PAGE_SIZE):
+    #yields the files matching the query, one list request per page
+    page_token = None
+    while True:
+        response = quota.execute(service.files().list(
+            q=qry,
+            spaces='drive',
+            fields=fields,
+            pageSize=page_size,
+            pageToken=page_token
+        ), 'drive', key=('list', qry, fields, page_size, page_token))
+        for f in response.get('files', []):
+            yield f
+        page_token = response.get('nextPageToken')
+        if page_token is None:
+            break
+
+
 def move_file_to_folder(file_id,
                         destination_id, source_id=''):
+    _invalidate_moved([file_id], destination_id, source_id)
     if source_id != '':
-        response = service.files().update(
+        response = quota.execute(service.files().update(
         fileId=file_id,
         addParents=destination_id,
         removeParents=source_id,
         fields='id, parents'
-        ).execute()
+        ), 'drive')
     else:
-        response = service.files().update(
+        response = quota.execute(service.files().update(
         fileId=file_id,
         addParents=destination_id,
         fields='id, parents'
-        ).execute()
+        ), 'drive')
+
+
+def move_files_to_folder(file_ids, destination_id, source_id='', batch=True):
+    #moves the files with batch requests of up to BATCH_SIZE files
+    #returns {file_id: {'response': .., 'error': ..}}, error None if the move succeeded
+    _invalidate_moved(file_ids, destination_id, source_id)
+    if not batch:
+        for f in file_ids:
+            move_file_to_folder(f, destination_id, source_id)
+        return {f: {'response': None, 'error': None} for f in file_ids}
 
+    def move_request(file_id):
+        kwargs = {'removeParents': source_id} if source_id != '' else {}
+        return service.files().update(
+            fileId=file_id,
+            addParents=destination_id,
+            fields='id, parents',
+            **kwargs)
 
-def move_files_to_folder(file_ids, destination_id, source_id=''):
-    for f in file_ids:
-        move_file_to_folder(f, destination_id, source_id)
+    return batch_execute(file_ids, move_request)
 
 
 def get_file_parent_folder_ids(file_id):
-    parent_ids = []
-    response = service.files().get(
-        fileId=file_id,
-        fields='parents'
-    ).execute()
-    if 'parents' in response:
-        parent_ids = response['parents']
+    parent_ids = _cache_get(('parents', file_id))
+    if parent_ids is None:
+        parent_ids = []
+        response = quota.execute(service.files().get(
+            fileId=file_id,
+            fields='parents'
+        ), 'drive', key=('get', file_id, 'parents'))
+        if 'parents' in response:
+            parent_ids = response['parents']
+        _cache_put(('parents', file_id), parent_ids)
     return parent_ids
 
 
+def get_files_parent_folder_ids(file_ids):
+    #parent folder ids of several files with batch requests
+    #returns {file_id: parent_ids}, or the error of the lookup for files that failed
+    parent_ids = {file_id: _cache_get(('parents', file_id)) for file_id in file_ids}
+    results = batch_execute([f for f in file_ids if parent_ids[f] is None],
+                            lambda file_id: service.files().get(
+                                fileId=file_id,
+                                fields='parents'))
+    for file_id, result in results.items():
+        if result['error'] is None:
+            parent_ids[file_id] = result['response'].get('parents', [])
+            _cache_put(('parents', file_id), parent_ids[file_id])
+        else:
+            parent_ids[file_id] = result['error']
+    return parent_ids
+
+
+def batch_execute(items, build_request, batch_size=BATCH_SIZE, retries=BATCH_RETRIES):
+    #executes build_request(item) for each item in batch requests of up to batch_size
+    #items that fail with a rate limit or server error are retried in a new batch after a backoff
+    #returns {item: {'response': .., 'error': ..}} in the order of items
+    results = {item: {'response': None, 'error': None} for item in items}
+    pending = list(results)
+    attempt = 0
+    while pending:
+        for i in range(0, len(pending), batch_size):
+            _execute_batch(pending[i:i + batch_size], build_request, results)
+        pending = [item for item in pending if quota.is_retryable(results[item]['error'])]
+        if not pending or attempt >= retries:
+            break
+        time.sleep(quota.scheduler.backoff(attempt))
+        attempt += 1
+    return results
+
+
+def _execute_batch(items, build_request, results):
+    def callback(request_id, response, exception):
+        item = items[int(request_id)]
+        results[item] = {'response': response, 'error': exception}
+
+    batch = service.new_batch_http_request(callback=callback)
+    for i, item in enumerate(items):
+        batch.add(build_request(item), request_id=str(i))
+    quota.execute(batch, 'drive', cost=len(items))
+
+
+#-----------------------------------------------------------------------------
+# metadata cache
+#-----------------------------------------------------------------------------
+def enable_cache(ttl=METADATA_CACHE_TTL, max_entries=cache.CACHE_MAX_ENTRIES, path=None):
+    #cache folder ids and file parents for ttl seconds, shared between runs through a local sqlite file if path
+    global metadata_cache
+    metadata_cache = cache.DriveCache(ttl=ttl, max_entries=max_entries, path=path)
+    return metadata_cache
+
+
+def disable_cache():
+    global metadata_cache
+    metadata_cache = None
+
+
+def _cache_get(key):
+    return None if metadata_cache is None else metadata_cache.get(key)
+
+
+def _cache_put(key, value):
+    if metadata_cache is not None:
+        metadata_cache.put(key, value)
+
+
+def _invalidate_moved(file_ids, destination_id, source_id=''):
+    #the moved files have new parents, and a moved folder is no longer found within its old parent
+    if metadata_cache is not None:
+        moved = set(file_ids)
+        folders = {destination_id, source_id} - {''}
+        metadata_cache.invalidate(lambda key: (key[0] == 'parents' and key[1] in moved) or
+                                  (key[0] == 'folder' and key[1] != '' and (not source_id or key[1] in folders)))
+
+
+def _quote(name):
+    return name.replace('\\', '\\\\').replace("'", "\\'")
+
+
 #-----------------------------------------------------------------------------
 # setup
 #-----------------------------------------------------------------------------
@@ -151,9 +346,21 @@ def get_credentials():
 def login():
     global service
     set_secret_file_path()
+    service = build_service()
+
+
+def build_service():
     credentials = get_credentials()
     http = credentials.authorize(Http())
-    service = build('drive', 'v3', http=http, cache_discovery=False)
+    return build('drive', 'v3', http=http, cache_discovery=False)
+
+
+def _thread_service():
+    drive_service = getattr(_local, 'service', None)
+    if drive_service is None:
+        drive_service = build_service()
+        _local.service = drive_service
+    return drive_service
 
 
 #-----------------------------------------------------------------------------
@@ -1,16 +1,22 @@
 '''This module interfaces with the Google Spreadsheets API
 @author: Taylor W Hickem
 '''
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from httplib2 import Http
 from oauth2client.service_account import ServiceAccountCredentials
 from googleapiclient.discovery import build
 import pandas as pd
 import numpy as np
+from sqlgsheet import cache
+from sqlgsheet import quota
 
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 CLIENT_SECRET_DEFAULT = 'client_secret.json'
 CLIENT_SECRET_FILE = ''
 LOADED = False
+ASYNC_CONCURRENCY = 8  # requests in flight at once for an AsyncSheetsEngine
 ordRef = {'A': 65}
 
 
@@ -35,8 +41,15 @@ def set_secret_file_path():
 class SheetsEngine():
     service = None
     sheetIds = {}
-
-    def __init__(self):
+    rowCounts = {}
+
+    def __init__(self, range_cache=None, scheduler=None):
+        # number of rows last read from or written to each (spreadsheetId, rangeName)
+        self.rowCounts = {}
+        # optional cache.RangeCache of range values, None reads every range from the api
+        self.cache = range_cache
+        # quota.RequestScheduler that rate limits and retries the api requests, shared with gdrive by default
+        self.scheduler = quota.scheduler if scheduler is None else scheduler
         self.login()
 
     def login(self):
@@ -51,22 +64,109 @@ class SheetsEngine():
         for key in keyIdPairs:
             self.add_sheet(key, keyIdPairs[key])
 
-    def get_rangevalues(self, spreadsheetId, rangeName):
+    def enable_cache(self, ttl=cache.CACHE_TTL, max_entries=cache.CACHE_MAX_ENTRIES,
+                     max_bytes=cache.CACHE_MAX_BYTES, path=None):
+        # cache range values read for ttl seconds, shared through a local sqlite file if path is set
+        self.cache = cache.RangeCache(ttl=ttl, max_entries=max_entries, max_bytes=max_bytes, path=path)
+        return self.cache
+
+    def disable_cache(self):
+        self.cache = None
+
+    def get_rangevalues(self, spreadsheetId, rangeName, refresh=False):
         # when calling the query -- it is acceptable to specify range with ambiguous end row --
         #    ex : sheet!A2:V
         # the service automatically finds the end row just as the google query method
-        result = self.service.spreadsheets().values().get(
-            spreadsheetId=spreadsheetId, range=rangeName).execute()
-        return result.get('values', [])
+        # refresh reads from the api even if the range is cached
+        values = None
+        if self.cache is not None and not refresh:
+            values = self.cache.get_range(spreadsheetId, rangeName)
+        if values is None:
+            result = self.scheduler.execute(self.service.spreadsheets().values().get(
+                spreadsheetId=spreadsheetId, range=rangeName),
+                'sheets_read', key=('get', spreadsheetId, rangeName))
+            values = result.get('values', [])
+            self._cache_put(spreadsheetId, rangeName, values)
+        self.rowCounts[(spreadsheetId, rangeName)] = len(values)
+        return values
+
+    def batch_get_rangevalues(self, spreadsheetId, rangeNames, refresh=False):
+        # values of several ranges of one spreadsheet in a single request, in the order of rangeNames
+        # cached ranges are not requested again unless refresh
+        cached = {}
+        if self.cache is not None and not refresh:
+            for rangeName in rangeNames:
+                values = self.cache.get_range(spreadsheetId, rangeName)
+                if values is not None:
+                    cached[rangeName] = values
+        missing = [rangeName for rangeName in rangeNames if rangeName not in cached]
+        if missing:
+            result = self.scheduler.execute(self.service.spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheetId, ranges=missing),
+                'sheets_read', key=('batchGet', spreadsheetId, tuple(missing)))
+            for rangeName, r in zip(missing, result.get('valueRanges', [])):
+                cached[rangeName] = r.get('values', [])
+                self._cache_put(spreadsheetId, rangeName, cached[rangeName])
+        range_values = [cached[rangeName] for rangeName in rangeNames]
+        for rangeName, values in zip(rangeNames, range_values):
+            self.rowCounts[(spreadsheetId, rangeName)] = len(values)
+        return range_values
 
     def set_rangevalues(self, spreadsheetId, rangeName, values, input_option='RAW'):
         body = {'range': rangeName, 'values': values}
-        self.service.spreadsheets().values().update(
-            spreadsheetId=spreadsheetId, valueInputOption=input_option, range=rangeName, body=body).execute()
+        self.scheduler.execute(self.service.spreadsheets().values().update(
+            spreadsheetId=spreadsheetId, valueInputOption=input_option, range=rangeName, body=body),
+            'sheets_write')
+        self._written_rowcount(spreadsheetId, rangeName, len(values))
+        self._cache_invalidate(spreadsheetId, [rangeName])
+
+    def batch_set_rangevalues(self, spreadsheetId, rangeValues, input_option='RAW'):
+        # writes several ranges of one spreadsheet in a single request. rangeValues: [(rangeName, values)]
+        body = {
+            'valueInputOption': input_option,
+            'data': [{'range': rangeName, 'values': values} for rangeName, values in rangeValues]
+        }
+        self.scheduler.execute(self.service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheetId, body=body), 'sheets_write')
+        for rangeName, values in rangeValues:
+            self._written_rowcount(spreadsheetId, rangeName, len(values))
+        self._cache_invalidate(spreadsheetId, [rangeName for rangeName, values in rangeValues])
 
     def clear_rangevalues(self, spreadsheetId, rangeName):
-        self.service.spreadsheets().values().clear(
-            spreadsheetId=spreadsheetId, range=rangeName).execute()
+        self.scheduler.execute(self.service.spreadsheets().values().clear(
+            spreadsheetId=spreadsheetId, range=rangeName), 'sheets_write')
+        self.rowCounts[(spreadsheetId, rangeName)] = 0
+        self._cache_invalidate(spreadsheetId, [rangeName])
+
+    def batch_clear_rangevalues(self, spreadsheetId, rangeNames):
+        self.scheduler.execute(self.service.spreadsheets().values().batchClear(
+            spreadsheetId=spreadsheetId, body={'ranges': rangeNames}), 'sheets_write')
+        for rangeName in rangeNames:
+            self.rowCounts[(spreadsheetId, rangeName)] = 0
+        self._cache_invalidate(spreadsheetId, rangeNames)
+
+    def get_rowcount(self, spreadsheetId, rangeName):
+        # rows last read from or written to the range, None if unknown
+        return self.rowCounts.get((spreadsheetId, rangeName))
+
+    def set_rowcount(self, spreadsheetId, rangeName, rowCount):
+        self.rowCounts[(spreadsheetId, rangeName)] = rowCount
+
+    def _written_rowcount(self, spreadsheetId, rangeName, rowCount):
+        # a write leaves any rows below it in place, so the count is only known if it was known before
+        key = (spreadsheetId, rangeName)
+        if key in self.rowCounts:
+            self.rowCounts[key] = max(self.rowCounts[key], rowCount)
+
+    def _cache_put(self, spreadsheetId, rangeName, values):
+        if self.cache is not None:
+            self.cache.put_range(spreadsheetId, rangeName, values)
+
+    def _cache_invalidate(self, spreadsheetId, rangeNames):
+        # a write changes every cached range it overlaps, not only the same rangeName
+        if self.cache is not None:
+            for rangeName in rangeNames:
+                self.cache.invalidate_range(spreadsheetId, rangeName)
 
     def get_tabledata(self, wkbkey, sheetStr, Col=None, fixedRef=None):
         df = None
@@ -77,12 +177,75 @@ class SheetsEngine():
             elif not fixedRef is None:
                 rangeHeader = sheetStr + '!' + fixedRef[0]
                 rangeData = sheetStr + '!' + fixedRef[1]
-            fields = self.get_rangevalues(self.sheetIds[wkbkey], rangeHeader)[0]
-            data = self.get_rangevalues(self.sheetIds[wkbkey], rangeData)
+            header_values, data = self.batch_get_rangevalues(self.sheetIds[wkbkey], [rangeHeader, rangeData])
+            fields = header_values[0]
             df = pd.DataFrame(data, columns=fields)
         return df
 
 
+class AsyncSheetsEngine():
+    """ coroutine counterpart of SheetsEngine, to overlap the network waits of requests to many spreadsheets.
+    httplib2 is not thread safe, so each worker thread runs its own SheetsEngine, sharing the
+    row counts, range cache and quota scheduler. at most max_concurrency requests are in flight at once
+
+        engine = AsyncSheetsEngine()
+        values = await asyncio.gather(*[engine.get_rangevalues(wkbid, rngid) for wkbid in wkbids])
+    """
+    def __init__(self, max_concurrency=ASYNC_CONCURRENCY, range_cache=None, scheduler=None, rowCounts=None):
+        self.max_concurrency = max_concurrency
+        self.rowCounts = {} if rowCounts is None else rowCounts
+        self.cache = range_cache
+        self.scheduler = quota.scheduler if scheduler is None else scheduler
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def get_rangevalues(self, spreadsheetId, rangeName, refresh=False):
+        return await self._run('get_rangevalues', spreadsheetId, rangeName, refresh=refresh)
+
+    async def batch_get_rangevalues(self, spreadsheetId, rangeNames, refresh=False):
+        return await self._run('batch_get_rangevalues', spreadsheetId, rangeNames, refresh=refresh)
+
+    async def set_rangevalues(self, spreadsheetId, rangeName, values, input_option='RAW'):
+        await self._run('set_rangevalues', spreadsheetId, rangeName, values, input_option=input_option)
+
+    async def batch_set_rangevalues(self, spreadsheetId, rangeValues, input_option='RAW'):
+        await self._run('batch_set_rangevalues', spreadsheetId, rangeValues, input_option=input_option)
+
+    async def clear_rangevalues(self, spreadsheetId, rangeName):
+        await self._run('clear_rangevalues', spreadsheetId, rangeName)
+
+    async def batch_clear_rangevalues(self, spreadsheetId, rangeNames):
+        await self._run('batch_clear_rangevalues', spreadsheetId, rangeNames)
+
+    def get_rowcount(self, spreadsheetId, rangeName):
+        return self.rowCounts.get((spreadsheetId, rangeName))
+
+    def set_rowcount(self, spreadsheetId, rangeName, rowCount):
+        self.rowCounts[(spreadsheetId, rangeName)] = rowCount
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: getattr(self._thread_engine(), method)(*args, **kwargs))
+
+    def _thread_engine(self) -> SheetsEngine:
+        engine = getattr(self._local, 'engine', None)
+        if engine is None:
+            engine = SheetsEngine(range_cache=self.cache, scheduler=self.scheduler)
+            engine.rowCounts = self.rowCounts
+            self._local.engine = engine
+        return engine
+
+
 def load():
     global shtEng
     set_secret_file_path()
@@ -95,7 +258,16 @@ def autorun():
 
 
 class ParameterTable():
-    tblData = None
+    """ table of parameters in a gsheet, one row per parameter label in the first column.
+    values are held in an object array with a label to row position index, so reads and writes
+    of single values are O(1). the setters mark the rows they change, and commit() writes only the rows
+    changed since the last refresh or commit.
+    tblData is a DataFrame copy of the values. edit a copy and assign it back to write the edits,
+    only the rows that differ are marked changed:
+        df = pt.tblData
+        df.loc[p_id, field] = value
+        pt.tblData = df
+    """
     parameterLabels = []
     parameterKeys = {}
     fields = []
@@ -116,6 +288,8 @@ class ParameterTable():
         self.valueCol = valueCol
         self.countCol = countCol
         self.col = ['B', chr(ordRef['A'] + countCol - 1)]
+        self._data = np.empty((0, 0), dtype=object)  # rows x fields
+        self._dirty = set()  # positions of the rows changed since the last refresh or commit
         shtEng.add_sheet(self.wkbKey, self.sheetId)
         self.refresh_parameterKeys()
 
@@ -126,23 +300,66 @@ class ParameterTable():
         return self.tblData.head(*arg, **kwarg)
 
     def __len__(self):
-        return len(self.tblData)
+        return len(self._data)
+
+    @property
+    def tblData(self) -> pd.DataFrame:
+        return pd.DataFrame(self._data.copy(), columns=self.fields)
+
+    @tblData.setter
+    def tblData(self, df):
+        # a frame of the same fields and rows marks the rows that differ, nulls compare equal.
+        # any other frame replaces all the values
+        frame = pd.DataFrame(df)
+        data = frame.to_numpy(dtype=object)
+        if list(frame.columns) == list(self.fields) and data.shape == self._data.shape:
+            changed = (data != self._data) & ~(pd.isna(data) & pd.isna(self._data))
+            p_ids = np.flatnonzero(changed.any(axis=1)) if changed.size else []
+        else:
+            self.fields = frame.columns
+            p_ids = range(len(data))
+        self._data = data
+        self._changed(p_ids)
 
-    def refresh_tblData(self):
-        self.tblData = shtEng.get_tabledata(self.wkbKey, self.pageId, self.col)
-        self.parField = self.tblData.columns[0]
-        self.valField = self.tblData.columns[self.valueCol - 1]
+    @property
+    def dirty_rows(self) -> list:
+        return sorted(self._dirty)
 
-    def commit(self):
-        values = self.gsheet_compatible()
-        rangeName = self.range_address()
-        shtEng.set_rangevalues(self.sheetId, rangeName, values)
+    def refresh_tblData(self):
+        df = shtEng.get_tabledata(self.wkbKey, self.pageId, self.col)
+        self.fields = df.columns
+        self._data = df.to_numpy(dtype=object)
+        self._dirty = set()
+        self.parField = self.fields[0]
+        self.valField = self.fields[self.valueCol - 1]
+
+    @property
+    def dirty_blocks(self) -> list:
+        # [(first, last)] row positions of the runs of contiguous changed rows
+        blocks = []
+        for p_id in self.dirty_rows:
+            if blocks and p_id == blocks[-1][1] + 1:
+                blocks[-1] = (blocks[-1][0], p_id)
+            else:
+                blocks.append((p_id, p_id))
+        return blocks
+
+    def commit(self, full=False):
+        # writes the changed rows in a single request, one range per run of contiguous rows,
+        # or the whole table if full
+        blocks = self.dirty_blocks
+        if full:
+            shtEng.set_rangevalues(self.sheetId, self.range_address(), self.gsheet_compatible())
+        elif blocks:
+            shtEng.batch_set_rangevalues(
+                self.sheetId, [(self.block_address(first, last), self._data[first:last + 1].tolist())
+                               for first, last in blocks])
+        self._dirty = set()
 
     def refresh_parameterKeys(self):
         self.refresh_tblData()
-        self.fields = self.tblData.columns
-        self.parameterLabels = list(self.tblData[self.parField])
-        self.parameterKeys = dict(zip(self.parameterLabels, list(self.tblData.index)))
+        self.parameterLabels = list(self._data[:, 0]) if len(self.fields) > 0 else []
+        self.parameterKeys = dict(zip(self.parameterLabels, range(len(self.parameterLabels))))
 
     def get_parameterId(self, key):
         return self.parameterKeys[key]
@@ -162,15 +379,19 @@ class ParameterTable():
                 localAddress = chr(ordRef['A'] + self.valueCol - 1) + str(p_id + 2)
         return self.pageId + '!' + localAddress
 
+    def block_address(self, first, last):
+        # address of the full rows from position first to last
+        return self.pageId + '!' + self.col[0] + str(first + 2) + ':' + self.col[-1] + str(last + 2)
+
     def getInfo(self, key=None, p_id=None):
         if p_id is None:
             p_id = self.get_parameterId(key)
-        return dict(self.tblData.iloc[p_id])
+        return dict(zip(self.fields, self._data[p_id]))
 
     def getInfos(self, keys=None, p_ids=None):
         if p_ids is None:
             p_ids = [self.parameterKeys[key] for key in keys]
-        df = self.tblData.iloc[p_ids].copy()
+        df = pd.DataFrame(self._data[p_ids], columns=self.fields, index=p_ids)
         return df
 
     def p_ids_from_infoData(self, infoData):
@@ -186,29 +407,27 @@ class ParameterTable():
         type_infoRow = type(infoRow)
         if type_infoRow in [pd.DataFrame, pd.Series]:
             if type_infoRow == pd.DataFrame:
-                infoRow['p_id'] = p_id
-                infoRow.set_index('p_id', inplace=True)
-                infoRow.index.name = None
+                infoRow = infoRow.set_axis([p_id] * len(infoRow))
             elif type_infoRow == pd.Series:
                 infoRow = pd.DataFrame.from_records([infoRow], index=[p_id])
         else:
-            raise ValueError('infoRow datatype :' + type_infoRow + '. Supported types are DataFrame and Series')
-        self.tblData.update(infoRow)
+            raise ValueError('infoRow datatype :' + str(type_infoRow) + '. Supported types are DataFrame and Series')
+        self._update(infoRow)
 
     def setInfos(self, infoData, keys=None, p_ids=None):
-        # reset index to match the local tblData index p_ids
+        # reset index to match the local row positions p_ids
         if p_ids is None:
             if keys is None:
                 p_ids = self.p_ids_from_infoData(infoData)
             else:
                 p_ids = self.get_parameterIds(keys)
-        infoData = pd.DataFrame(infoData, index=p_ids)
-        self.tblData.update(infoData)
+        infoData = pd.DataFrame(infoData).set_axis(p_ids)
+        self._update(infoData)
 
     def getValue(self, key=None, p_id=None, dataType=float):
         if p_id is None:
             p_id = self.get_parameterId(key)
-        value = self.tblData.iloc[p_id][self.valField]
+        value = self._data[p_id, self.valueCol - 1]
         if dataType in [int, float]:
             if dataType == int:
                 returnValue = int(value)
@@ -221,14 +440,9 @@ class ParameterTable():
     def getValues(self, keys=None, p_ids=None, dataType=float, as_dict=False):
         if p_ids is None:
             p_ids = self.get_parameterIds(keys)
-        df = self.tblData[[self.parField, self.valField]].iloc[p_ids].copy()
-        df.columns = ['parameter', 'value']
+        df = pd.DataFrame({'parameter': self._data[p_ids, 0], 'value': self._data[p_ids, self.valueCol - 1]})
         if dataType in [int, float]:
             df['value'] = pd.to_numeric(df['value'])
-            # if dataType == int:
-            #    df['value'] = df.apply(lambda x:int(x.value),axis=1)
-            # elif dataType == float:
-            #    df['value'] = df.apply(lambda x:float(x.value),axis=1)
         if as_dict:
             values = dict(df.to_records(index=False))
         else:
@@ -238,7 +452,8 @@ class ParameterTable():
     def setValue(self, value, key=None, p_id=None):
         if p_id is None:
             p_id = self.get_parameterId(key)
-        self.tblData[self.valField][p_id] = value
+        self._data[p_id, self.valueCol - 1] = value.item() if isinstance(value, np.generic) else value
+        self._changed([p_id])
 
     def setValues(self, values, keys=None, p_ids=None):
         if p_ids is None:
@@ -249,24 +464,33 @@ class ParameterTable():
                 df = pd.DataFrame({self.valField: values}, index=p_ids)
             else:
                 if len(values.columns) == 1:
-                    values.columns = [self.valField]
-                    df = pd.DataFrame(values, index=p_ids)
+                    df = pd.DataFrame({self.valField: values.iloc[:, 0].values}, index=p_ids)
                 else:
-                    raise ValueError('# of columns passed =' + len(values.columns) + '.  Only allowed 1 column')
+                    raise ValueError('# of columns passed =' + str(len(values.columns)) + '.  Only allowed 1 column')
         else:
-            raise ValueError('value datatype:' + type_values + '. Supported types are DataFrame and list')
-        self.tblData.update(df)
+            raise ValueError('value datatype:' + str(type_values) + '. Supported types are DataFrame and list')
+        self._update(df)
 
     def gsheet_compatible(self, data=None):
+        # rows of python values, numpy scalars such as np.int64 are not json serializable
         if data is None:
-            data = self.tblData
-        rows = [list(x) for x in data.to_records(index=False)]
-        for i in range(len(rows)):
-            for j in range(len(rows[0])):
-                if type(rows[i][j]) == np.int64:
-                    rows[i][j] = int(rows[i][j])
+            return self._data.tolist()
+        rows = data.astype(object).to_numpy().tolist()
         return rows
 
+    def _update(self, data):
+        # writes the non null values of the data, indexed by row position, into the matching fields
+        positions = {field: i for i, field in enumerate(self.fields)}
+        for field in data.columns:
+            if field in positions:
+                column = data[field].astype(object)
+                column = column[column.notna()]
+                self._data[column.index.to_numpy(dtype=int), positions[field]] = column.to_numpy()
+                self._changed(column.index)
+
+    def _changed(self, p_ids):
+        self._dirty.update(int(p_id) for p_id in p_ids)
+
 
 if __name__ == '__main__':
     autorun()
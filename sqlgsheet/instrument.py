@@ -0,0 +1,237 @@
+""" this module times the hot paths of database, sync, gsheet and gdrive as spans
+that record the duration, rows and bytes of each call, and passes them to pluggable hooks.
+with no hooks added, an instrumented call costs one check of the hook list.
+
+    stats = instrument.Aggregator()
+    instrument.add_hook(stats)
+    syncer.sync()
+    stats.summary()
+
+hooks are callables of a Span. this module provides
+    JSONLogHook: one json line per span to a file or stream
+    Aggregator: in-process count, total and max duration, rows, bytes and errors per span name
+    PrometheusExporter: Aggregator with the totals in prometheus text exposition format
+"""
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+_hooks = []
+_local = threading.local()  # stack of open span names of the thread
+
+
+class Span(object):
+    __slots__ = ['name', 'parent', 'attrs', 'start', 'duration', 'rows', 'bytes', 'error']
+
+    def __init__(self, name, parent=None, attrs=None):
+        self.name = name
+        self.parent = parent
+        self.attrs = {} if attrs is None else attrs
+        self.start = time.time()
+        self.duration = None
+        self.rows = None
+        self.bytes = None
+        self.error = None
+
+    def measure(self, obj):
+        # sets rows and bytes from a table, list of rows or api response
+        self.rows, self.bytes = measure(obj)
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def add_hook(hook):
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def clear_hooks():
+    del _hooks[:]
+
+
+def enabled() -> bool:
+    return len(_hooks) > 0
+
+
+@contextmanager
+def span(name, **attrs):
+    """ times the block as a span passed to the hooks on exit. yields the Span, None when disabled
+
+        with instrument.span('load', table='records') as s:
+            df = ...
+            if s: s.measure(df)
+    """
+    if not _hooks:
+        yield None
+        return
+    stack = _span_stack()
+    s = Span(name, parent=stack[-1] if stack else None, attrs=attrs)
+    stack.append(name)
+    started = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.error = type(e).__name__
+        raise
+    finally:
+        s.duration = time.perf_counter() - started
+        stack.pop()
+        _emit(s)
+
+
+def timed(name, measure_arg=None, measure_result=False):
+    """ decorator timing each call of the function as a span
+
+    :param name: span name
+    :param measure_arg: (optional) name of the argument whose rows and bytes are recorded
+    :param measure_result: (optional) record the rows and bytes of the return value
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return fn(*args, **kwargs)
+            with span(name) as s:
+                if measure_arg is not None:
+                    arguments = signature.bind_partial(*args, **kwargs).arguments
+                    s.measure(arguments.get(measure_arg))
+                result = fn(*args, **kwargs)
+                if measure_result:
+                    s.measure(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def measure(obj) -> tuple:
+    """ returns (rows, bytes) of a DataFrame, list of rows, dict of tables or api response, None if unknown
+    """
+    if isinstance(obj, pd.DataFrame):
+        return len(obj), int(obj.memory_usage(index=False).sum())
+    elif isinstance(obj, list):
+        return len(obj), None
+    elif isinstance(obj, dict):
+        if 'values' in obj:
+            return len(obj['values']), None
+        elif 'valueRanges' in obj:
+            return sum(len(r.get('values', [])) for r in obj['valueRanges']), None
+        elif 'files' in obj:
+            return len(obj['files']), None
+        elif obj and all(isinstance(v, pd.DataFrame) for v in obj.values()):
+            sizes = [measure(v) for v in obj.values()]
+            return sum(r for r, b in sizes), sum(b for r, b in sizes)
+    return None, None
+
+
+def _span_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _emit(s):
+    for hook in list(_hooks):
+        try:
+            hook(s)
+        except Exception as e:
+            print(f'instrumentation hook {hook} failed: {e}', file=sys.stderr)
+
+
+# -----------------------------------------------------
+# hooks
+# -----------------------------------------------------
+
+
+class JSONLogHook(object):
+    """ writes each span as a json line to a file path, or to a stream such as sys.stderr
+    """
+    def __init__(self, target=sys.stderr):
+        self.target = target
+        self._lock = threading.Lock()
+
+    def __call__(self, s):
+        line = json.dumps(s.to_dict(), default=str) + '\n'
+        with self._lock:
+            if isinstance(self.target, str):
+                with open(self.target, 'a') as f:
+                    f.write(line)
+            else:
+                self.target.write(line)
+
+
+class Aggregator(object):
+    """ count, total and max duration, rows, bytes and errors of the spans by name
+    """
+    FIELDS = ['count', 'errors', 'total_seconds', 'max_seconds', 'rows', 'bytes']
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, s):
+        with self._lock:
+            stats = self._stats.get(s.name)
+            if stats is None:
+                stats = self._stats[s.name] = dict.fromkeys(self.FIELDS, 0)
+            stats['count'] += 1
+            stats['errors'] += s.error is not None
+            stats['total_seconds'] += s.duration
+            stats['max_seconds'] = max(stats['max_seconds'], s.duration)
+            stats['rows'] += s.rows or 0
+            stats['bytes'] += s.bytes or 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def summary(self) -> pd.DataFrame:
+        """ table of the stats by span name, slowest total first
+        """
+        summary = pd.DataFrame.from_dict(self.stats(), orient='index', columns=self.FIELDS)
+        summary.index.name = 'span'
+        return summary.sort_values('total_seconds', ascending=False)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+class PrometheusExporter(Aggregator):
+    """ Aggregator exported in prometheus text exposition format, for a textfile collector or an http handler
+    """
+    METRICS = [
+        ('count', 'sqlgsheet_span_count_total', 'counter', 'spans completed'),
+        ('errors', 'sqlgsheet_span_errors_total', 'counter', 'spans that raised an exception'),
+        ('total_seconds', 'sqlgsheet_span_seconds_total', 'counter', 'total duration of the spans in seconds'),
+        ('max_seconds', 'sqlgsheet_span_max_seconds', 'gauge', 'longest duration of a span in seconds'),
+        ('rows', 'sqlgsheet_span_rows_total', 'counter', 'rows read or written by the spans'),
+        ('bytes', 'sqlgsheet_span_bytes_total', 'counter', 'bytes of the tables read or written by the spans'),
+    ]
+
+    def exposition(self) -> str:
+        stats = self.stats()
+        lines = []
+        for field, metric, metric_type, description in self.METRICS:
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} {metric_type}')
+            for name, values in sorted(stats.items()):
+                lines.append(f'{metric}{{span="{name}"}} {values[field]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(self.exposition())
@@ -6,7 +6,7 @@
 import json
 import pymysql
 import urllib.parse
-from sqlalchemy import create_engine
+from sqlgsheet import pool
 
 ##-----------------------------------------------------
 # Module variables
@@ -46,14 +46,14 @@ def load_sql():
 
 
 def get_connection(database='',
-                   login='', username='', password='') -> dict:
+                   login='', username='', password='', pool_options={}) -> dict:
     connect = {}
     login_request_url = login.format(
         user=username,
         pw=urllib.parse.quote_plus(password),
         db=database)
     try:
-        connect['engine'] = create_engine(login_request_url)
+        connect['engine'] = pool.get_engine(login_request_url, pool_options=pool_options)
         connect['con'] = connect['engine'].connect()
     except Exception as e:
         print(f'ERROR: unable to connect to database {e}')
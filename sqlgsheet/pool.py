@@ -0,0 +1,87 @@
+""" this module keeps a registry of sqlalchemy engines, one per database url and pool options,
+so that repeated connections, syncs and warm AWS lambda invocations reuse pooled connections
+instead of creating a new engine and paying the connection setup each time.
+sqlite database files are not pooled: each connection opens the file, so a file replaced
+on disk between syncs, as by a warm invocation downloading it again, is read and written anew.
+
+engines are disposed explicitly with dispose(), or on exit of the registry as a context manager
+
+    with pool.EngineRegistry() as engines:
+        eng = engines.get_engine('sqlite:///myapp.db')
+"""
+import json
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+# defaults for pooled engines, override per call with pool_options
+POOL_CONFIG = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 3600
+}
+QUEUE_POOL_OPTIONS = ['pool_size', 'max_overflow', 'pool_timeout']
+
+
+class EngineRegistry(object):
+    def __init__(self, pool_config=None):
+        self.pool_config = pool_config
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.dispose()
+
+    def __len__(self):
+        return len(self._engines)
+
+    def engine_options(self, url, pool_options={}) -> dict:
+        options = (POOL_CONFIG if self.pool_config is None else self.pool_config).copy()
+        options.update(pool_options)
+        if url.startswith('sqlite'):
+            # in-memory databases are per connection, keep the sqlalchemy default pool.
+            # a pooled connection to a file keeps the file open after it is replaced on disk
+            options = {k: v for k, v in options.items() if k not in QUEUE_POOL_OPTIONS}
+            if not _is_sqlite_memory(url):
+                options['poolclass'] = NullPool
+        return options
+
+    def get_engine(self, url, pool_options={}):
+        """ returns the shared engine for the url and pool options, created on first use
+        """
+        options = self.engine_options(url, pool_options)
+        key = (url, json.dumps({k: str(v) for k, v in options.items()}, sort_keys=True))
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = create_engine(url, **options)
+                self._engines[key] = engine
+        return engine
+
+    def dispose(self, url=''):
+        """ closes the pooled connections of the url, or of all engines, and drops them from the registry
+        """
+        with self._lock:
+            keys = [k for k in self._engines if not url or k[0] == url]
+            engines = [self._engines.pop(k) for k in keys]
+        for engine in engines:
+            engine.dispose()
+
+
+def _is_sqlite_memory(url):
+    return url.rstrip('/') in ['sqlite:', 'sqlite:/'] or ':memory:' in url
+
+
+registry = EngineRegistry()
+
+
+def get_engine(url, pool_options={}):
+    return registry.get_engine(url, pool_options=pool_options)
+
+
+def dispose(url=''):
+    registry.dispose(url=url)
@@ -0,0 +1,180 @@
+""" this module schedules google api requests within the per-user quotas of the Sheets and Drive apis.
+each request waits for a token of its quota bucket, rate limit (429) and server (5xx) errors are retried
+with jittered exponential backoff, and identical reads in flight at the same time share one request.
+
+the module scheduler is shared by gsheet and gdrive
+
+    response = quota.execute(service.files().get(fileId=file_id), 'drive', key=('get', file_id))
+    quota.scheduler.metrics()
+"""
+import random
+import threading
+import time
+from googleapiclient.errors import HttpError
+from sqlgsheet import instrument
+
+# requests per period in seconds of each bucket, as the default per-user quotas of the apis
+QUOTAS = {
+    'sheets_read': {'requests': 60, 'period': 60},
+    'sheets_write': {'requests': 60, 'period': 60},
+    'drive': {'requests': 12000, 'period': 60},
+}
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_MAX = 64.0  # seconds
+
+
+class TokenBucket(object):
+    """ allows bursts of up to capacity requests, refilled at rate requests per second
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1) -> float:
+        """ takes tokens, waiting for the refill when the bucket is empty. returns the seconds waited
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # reserve the tokens now so that waiting requests are served in order
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RequestScheduler(object):
+    def __init__(self, quotas=None, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.quotas = QUOTAS if quotas is None else quotas
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._buckets = {}
+        self._inflight = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def execute(self, request, bucket, key=None, cost=1):
+        """ executes a googleapiclient request within the quota of the bucket
+
+        :param request: request with an execute() method
+        :param bucket: quota bucket name, one of QUOTAS
+        :param key: (optional) hashable key of a read, concurrent requests with the same key share one response
+        :param cost: (optional) quota requests used, the number of sub-requests of a batch request
+        :return: response of the request
+        """
+        return self.call(request.execute, bucket, key=key, cost=cost)
+
+    def call(self, fn, bucket, key=None, cost=1):
+        """ calls fn() within the quota of the bucket, retrying rate limit and server errors
+        """
+        if key is None:
+            return self._call(fn, bucket, cost)
+        with self._lock:
+            inflight = self._inflight.get(key)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[key] = _InflightCall()
+        if not leader:
+            self._count(bucket, 'coalesced')
+            inflight.done.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.result
+        try:
+            inflight.result = self._call(fn, bucket, cost)
+        except Exception as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            inflight.done.set()
+        return inflight.result
+
+    def metrics(self) -> dict:
+        """ returns {bucket: {requests, retries, failures, coalesced, wait_time, max_wait}}, wait times in seconds
+        """
+        with self._lock:
+            return {bucket: dict(m) for bucket, m in self._metrics.items()}
+
+    def reset_metrics(self):
+        with self._lock:
+            self._metrics = {}
+
+    def backoff(self, attempt, error=None) -> float:
+        """ seconds to wait before retry number attempt + 1 of a failed request
+        """
+        resp = getattr(error, 'resp', None)
+        retry_after = resp.get('retry-after') if resp is not None else None
+        if retry_after is not None and str(retry_after).isdigit():
+            return min(float(retry_after), self.backoff_max)
+        # full jitter, spreads the retries of concurrent requests over the backoff window
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _call(self, fn, bucket, cost=1):
+        limiter = self._bucket(bucket)
+        attempt = 0
+        while True:
+            wait = limiter.acquire(cost)
+            self._count(bucket, 'requests', wait=wait)
+            try:
+                with instrument.span('api.' + bucket, attempt=attempt) as s:
+                    result = fn()
+                    if s:
+                        s.measure(result)
+                return result
+            except HttpError as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._count(bucket, 'failures')
+                    raise
+                self._count(bucket, 'retries')
+                time.sleep(self.backoff(attempt, e))
+                attempt += 1
+
+    def _bucket(self, bucket) -> TokenBucket:
+        with self._lock:
+            limiter = self._buckets.get(bucket)
+            if limiter is None:
+                quota = self.quotas[bucket]
+                limiter = TokenBucket(quota['requests'] / quota['period'], quota['requests'])
+                self._buckets[bucket] = limiter
+        return limiter
+
+    def _count(self, bucket, counter, wait=None):
+        with self._lock:
+            m = self._metrics.setdefault(bucket, {
+                'requests': 0, 'retries': 0, 'failures': 0, 'coalesced': 0, 'wait_time': 0.0, 'max_wait': 0.0})
+            m[counter] += 1
+            if wait is not None:
+                m['wait_time'] += wait
+                m['max_wait'] = max(m['max_wait'], wait)
+
+
+class _InflightCall(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+scheduler = RequestScheduler()
+
+
+def execute(request, bucket, key=None, cost=1):
+    return scheduler.execute(request, bucket, key=key, cost=cost)
+
+
+def call(fn, bucket, key=None, cost=1):
+    return scheduler.call(fn, bucket, key=key, cost=cost)
+
+
+def is_retryable(error) -> bool:
+    return isinstance(error, HttpError) and error.resp is not None and error.resp.status in RETRY_STATUSES
@@ -19,12 +19,33 @@ with the conditions that
 import os
 import sys
 import json
+import hashlib
+import pickle
+import shutil
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from sqlalchemy.engine import Engine
+from sqlalchemy import text
 from sqlgsheet import database as db
+from sqlgsheet import instrument
 
 DB_ROLES = ['master', 'slave']
 NULL_CONNECT = {'engine': None, 'con': None}
 DEFAULT_CONFIG_PATH = 'dbsync_config.json'
+DEFAULT_WATERMARKS_PATH = 'dbsync_watermarks.json'
+WATERMARK_DATETIME_TYPE = 'datetime'
+SYNC_MODES = ['full', 'incremental', 'partitioned', 'pushdown', 'fingerprint', 'merkle']
+DEFAULT_PARTITIONS = 16
+MERKLE_FANOUT = 16
+MERKLE_LEAF_ROWS = 1000
+PUSHDOWN_DIALECTS = ['sqlite', 'mysql']
+PUSHDOWN_SCHEMA = 'dbsync_slave'  # schema of the slave database attached to a sqlite master connection
+APPLY_MODES = ['rows', 'upsert']
+SYNC_POOLS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+PARALLEL_DB_TYPES = ['sqlite', 'mysql']  # db types each worker connects to on its own
 SYNC_STATUS_CODES = {
     0: 'disconnected',
     1: 'synced',
@@ -56,6 +77,8 @@ MERGE_RULES = {
     'destination': ['master', 'slave', 'slave', 'slave', 'master', 'slave'],
     'edit': ['insert', 'delete', 'insert', 'insert', 'update', 'update']
 }
+MERGE_MODES = ['columnar', 'reference']
+MERGE_MODE = 'columnar'
 
 
 class DBSyncer(object):
@@ -67,6 +90,10 @@ class DBSyncer(object):
     _status_code = 0
     errors = ''
     edits = {}
+    edit_counts = {}
+    watermarks = {}
+    table_status = {}
+    _sync_state = {}
 
     def __repr__(self):
         status_dict = {'status': self.sync_status()}
@@ -85,6 +112,12 @@ class DBSyncer(object):
             raise e
 
     def __init__(self, sync_config={}, config_path=DEFAULT_CONFIG_PATH):
+        self.master = NULL_CONNECT.copy()
+        self.slave = NULL_CONNECT.copy()
+        self._connected = {r: False for r in DB_ROLES}
+        self.edits = {}
+        self.edit_counts = {}
+        self.table_status = {}
         if sync_config:
             self.sync_config = sync_config.copy()
         elif config_path:
@@ -92,11 +125,32 @@ class DBSyncer(object):
         else:
             self.sync_config = SYNC_SPEC.copy()
         self._set_table_scope()
+        self._load_watermarks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
 
     def _set_table_scope(self):
         if 'tables' in self.sync_config:
             self.tables = self.sync_config['tables']
 
+    def _watermarks_path(self):
+        return self.sync_config.get('watermarks', DEFAULT_WATERMARKS_PATH)
+
+    def _load_watermarks(self):
+        self.watermarks = {}
+        self._sync_state = {}
+        if any([self._sync_mode(t) == 'incremental' for t in self.tables]):
+            self.watermarks = _sync_config_from_file(self._watermarks_path())
+
+    def _save_watermarks(self):
+        with open(self._watermarks_path(), 'w') as f:
+            json.dump(self.watermarks, f, indent=4)
+            f.close()
+
     def connected(self, db_role=''):
         if db_role:
             is_connected = self._connected[db_role]
@@ -108,6 +162,10 @@ class DBSyncer(object):
         null_connect = NULL_CONNECT.copy()
         if db_role:
             if self.connected(db_role=db_role):
+                connect = self.__getattribute__(db_role)
+                if db.is_sqlalchemy_con(connect['con']):
+                    # return the connection to the shared engine pool
+                    connect['con'].close()
                 self.__setattr__(db_role, null_connect)
                 self._connected[db_role] = False
         else:
@@ -152,6 +210,46 @@ class DBSyncer(object):
             tbl = db.get_table(table_name, con=self.con(db_role=db_role))
         return tbl
 
+    def get_table_keys(self, db_role, table_name):
+        keys = []
+        if self.connected(db_role=db_role):
+            key = self._key_field(table_name)
+            keys = db.get_table_columns(table_name, [key], con=self.con(db_role=db_role))[key]
+        return keys
+
+    def get_table_since(self, db_role, table_name, value):
+        tbl = []
+        if self.connected(db_role=db_role):
+            last_modified = self._last_modified_field(table_name)
+            tbl = db.get_table_since(table_name, last_modified, value, con=self.con(db_role=db_role))
+        return tbl
+
+    def get_table_fingerprints(self, db_role, table_name, fields, in_sql=False, method=db.FINGERPRINT_METHOD):
+        tbl = []
+        if self.connected(db_role=db_role):
+            key = self._key_field(table_name)
+            last_modified = self._last_modified_field(table_name)
+            tbl = db.get_table_fingerprints(table_name, key, fields, keep=[last_modified],
+                                            con=self.con(db_role=db_role), in_sql=in_sql, method=method)
+        return tbl
+
+    def get_table_fields(self, db_role, table_name):
+        fields = []
+        if self.connected(db_role=db_role):
+            con_obj = self.con(db_role=db_role)
+            if db.is_sqlalchemy_con(con_obj):
+                fields = [c.name for c in db.get_sql_table(table_name, con_obj, required=True).columns]
+            else:
+                fields = list(next(db.iter_table(table_name, con=con_obj, chunksize=1), pd.DataFrame()).columns)
+        return fields
+
+    def get_rows_by_keys(self, db_role, table_name, keys):
+        tbl = []
+        if self.connected(db_role=db_role):
+            key = self._key_field(table_name)
+            tbl = db.get_rows_by_keys(table_name, key, keys, con=self.con(db_role=db_role))
+        return tbl
+
     def sync_status(self):
         return SYNC_STATUS_CODES[self._status_code]
 
@@ -164,6 +262,19 @@ class DBSyncer(object):
     def _last_modified_field(self, table_name):
         return self._table_field(table_name, 'last_modified')
 
+    def _table_option(self, table_name, option, default=None):
+        # table level setting, else the top level setting of the sync config
+        value = self.sync_config.get(option, default)
+        if isinstance(self.tables[table_name], dict):
+            value = self.tables[table_name].get(option, value)
+        return value
+
+    def _sync_mode(self, table_name):
+        return self._table_option(table_name, 'sync_mode', SYNC_MODES[0])
+
+    def _apply_mode(self, table_name):
+        return self._table_option(table_name, 'apply_mode', APPLY_MODES[0])
+
     def _rows_insert(self, db_role, table_name, rows):
         db.rows_insert(rows, table_name, con=self.con(db_role))
 
@@ -175,6 +286,22 @@ class DBSyncer(object):
         key = self._key_field(table_name)
         db.rows_update(rows, table_name, key=key, eng=self.engine(db_role))
 
+    def _rows_upsert(self, db_role, table_name, rows):
+        key = self._key_field(table_name)
+        db.rows_upsert(rows, table_name, key=key, eng=self.engine(db_role))
+
+    def _edit_batches(self, table_name, db_edits) -> list:
+        # (action, rows) in the order to apply. in upsert mode the update and insert
+        # edits are applied together in one pass after the deletes
+        actions = list(EDITS_TEMPLATE[DB_ROLES[0]].keys())
+        batches = [(a, db_edits[a]) for a in actions if len(db_edits[a]) > 0]
+        if self._apply_mode(table_name) == 'upsert':
+            upsert_rows = [rows for a, rows in batches if a in ['update', 'insert']]
+            batches = [(a, rows) for a, rows in batches if a == 'delete']
+            if upsert_rows:
+                batches.append(('upsert', pd.concat(upsert_rows)))
+        return batches
+
     def _merge_edits_update(self, table_name):
         key = self._key_field(table_name)
         last_modified = self._last_modified_field(table_name)
@@ -189,6 +316,174 @@ class DBSyncer(object):
         else:
             if table_edits:
                 self.edits[table_name] = table_edits
+            if self._sync_mode(table_name) == 'incremental':
+                last_modified_max = _max_value([master[last_modified].max(), slave[last_modified].max()])
+                self._sync_state[table_name] = {
+                    'master_keys': master[key],
+                    'slave_keys': slave[key],
+                    'last_modified': last_modified_max
+                }
+
+    def _merge_edits_update_incremental(self, table_name):
+        watermarks = self.watermarks.get(table_name, {})
+        if not all([r in watermarks for r in DB_ROLES]):
+            # no watermark from a previous sync, compare the full tables
+            self._merge_edits_update(table_name)
+        else:
+            key = self._key_field(table_name)
+            last_modified = self._last_modified_field(table_name)
+            high_water = {r: _watermark_value(watermarks[r]) for r in DB_ROLES}
+            try:
+                keys = {r: self.get_table_keys(r, table_name) for r in DB_ROLES}
+                rows = {r: self.get_table_since(r, table_name, high_water[r]) for r in DB_ROLES}
+                keys_unchanged = all([key_digest(keys[r]) == watermarks[r]['key_digest'] for r in DB_ROLES])
+                if not keys_unchanged:
+                    # master-only rows unchanged since the watermark are still inserted to the slave
+                    master_only = keys['master'][~keys['master'].isin(keys['slave'])]
+                    missing = master_only[~master_only.isin(rows['master'][key])]
+                    if len(missing) > 0:
+                        missing_rows = self.get_rows_by_keys('master', table_name, missing)
+                        rows['master'] = pd.concat([rows['master'], missing_rows], ignore_index=True)
+                table_edits = merge_edits_incremental(rows['master'], rows['slave'],
+                                                      keys['master'], keys['slave'],
+                                                      high_water, key, last_modified)
+            except Exception as e:
+                error_message = f'DB FATAL SYNC ERROR for table:{table_name}. '
+                error_message = error_message + 'Error comparing databases. Unable to determine sync edits to apply.'
+                self._exception_handle(e=e, error_message=error_message)
+            else:
+                self.edits[table_name] = table_edits
+                last_modified_max = _max_value([high_water['master'], high_water['slave']] +
+                                               [rows[r][last_modified].max() for r in DB_ROLES])
+                self._sync_state[table_name] = {
+                    'master_keys': keys['master'],
+                    'slave_keys': keys['slave'],
+                    'last_modified': last_modified_max
+                }
+
+    def _merge_edits_update_fingerprint(self, table_name):
+        # compares row fingerprints, then reads only the rows to insert or update from their source
+        key = self._key_field(table_name)
+        last_modified = self._last_modified_field(table_name)
+        fields = self._fingerprint_fields(table_name)
+        method = self._fingerprint_method()
+        try:
+            fingerprints = {r: self.get_table_fingerprints(r, table_name, fields, in_sql=self._digest_in_sql(r),
+                                                           method=method)
+                            for r in DB_ROLES}
+            table_edits = merge_edits_fingerprint(fingerprints['master'], fingerprints['slave'], key, last_modified)
+            for r in DB_ROLES:
+                for a in ['insert', 'update']:
+                    if len(table_edits[r][a]) > 0:
+                        source = 'slave' if r == 'master' else 'master'
+                        table_edits[r][a] = self._get_rows_by_key_batches(source, table_name, table_edits[r][a][key])
+        except Exception as e:
+            error_message = f'DB FATAL SYNC ERROR for table:{table_name}. '
+            error_message = error_message + 'Error comparing databases. Unable to determine sync edits to apply.'
+            self._exception_handle(e=e, error_message=error_message)
+        else:
+            self.edits[table_name] = table_edits
+
+    def _fingerprint_fields(self, table_name) -> list:
+        fields = self._table_option(table_name, 'fingerprint_fields')
+        if not fields:
+            key = self._key_field(table_name)
+            slave_fields = self.get_table_fields('slave', table_name)
+            fields = [f for f in self.get_table_fields('master', table_name) if f in slave_fields and f != key]
+        return fields
+
+    def _digest_in_sql(self, db_role) -> bool:
+        return self.connected(db_role) and db.digest_in_sql(self.con(db_role))
+
+    def _fingerprint_method(self) -> str:
+        # a side that computes its md5 digests in sql is compared with md5 digests of the other side,
+        # other pairs hash their columns with pandas
+        return 'md5' if any(self._digest_in_sql(r) for r in DB_ROLES) else db.FINGERPRINT_METHOD
+
+    def _merge_edits_update_merkle(self, table_name):
+        # compares range summaries from the top down, then reads only the rows of the ranges that differ
+        key = self._key_field(table_name)
+        last_modified = self._last_modified_field(table_name)
+        fields = self._fingerprint_fields(table_name)
+        fanout = self._table_option(table_name, 'merkle_fanout', MERKLE_FANOUT)
+        leaf_rows = self._table_option(table_name, 'merkle_leaf_rows', MERKLE_LEAF_ROWS)
+        method = self._fingerprint_method()
+
+        def read_once(db_role):
+            # sides without sql digests or backend summaries are read once, instead of the rows of every level
+            if db.is_sqlalchemy_con(self.con(db_role)):
+                fingerprints[db_role] = self.get_table_fingerprints(db_role, table_name, fields, method=method)
+            else:
+                tables[db_role] = self.get_table(db_role, table_name)
+                fingerprints[db_role] = db.fingerprint_rows(tables[db_role], key, fields, [last_modified],
+                                                            method=method)
+            fingerprints[db_role] = fingerprints[db_role].sort_values(key, ignore_index=True)
+
+        def summarize(db_role, ranges, parts):
+            if db_role not in fingerprints:
+                try:
+                    return db.get_range_summaries(table_name, key, fields, ranges, last_modified,
+                                                  con=self.con(db_role), in_sql=self._digest_in_sql(db_role),
+                                                  method=method, parts=parts)
+                except NotImplementedError:
+                    read_once(db_role)
+            return db.summarize_fingerprints(fingerprints[db_role], key, ranges, last_modified, parts=parts)
+
+        def rows_in_ranges(db_role, ranges):
+            if db_role not in tables:
+                try:
+                    return db.get_rows_in_ranges(table_name, key, ranges, con=self.con(db_role))
+                except NotImplementedError:
+                    tables[db_role] = self.get_table(db_role, table_name)
+            return db.rows_in_ranges(tables[db_role], key, ranges)
+
+        try:
+            fingerprints = {}
+            tables = {}
+            for r in DB_ROLES:
+                if db.is_sqlalchemy_con(self.con(r)) and not self._digest_in_sql(r):
+                    read_once(r)
+            ranges, totals = merkle_diff_ranges(summarize, fanout=fanout, leaf_rows=leaf_rows)
+            table_edits = _edits_template()
+            if ranges:
+                rows = {r: rows_in_ranges(r, ranges) for r in DB_ROLES}
+                if totals['master']['count'] == 0 or totals['slave']['count'] == 0:
+                    table_edits = merge_edits(rows['master'], rows['slave'], key, last_modified)
+                elif len(rows['master']) > 0 or len(rows['slave']) > 0:
+                    global_lm = {r: totals[r]['last_modified'] for r in DB_ROLES}
+                    _merge_edits_columnar(table_edits, rows['master'], rows['slave'], key, last_modified, global_lm)
+        except Exception as e:
+            error_message = f'DB FATAL SYNC ERROR for table:{table_name}. '
+            error_message = error_message + 'Error comparing databases. Unable to determine sync edits to apply.'
+            self._exception_handle(e=e, error_message=error_message)
+        else:
+            self.edits[table_name] = table_edits
+
+    def _get_rows_by_key_batches(self, db_role, table_name, keys) -> pd.DataFrame:
+        # keeps the IN lists of the queries within the bound parameter limits of the databases
+        keys = list(keys)
+        batches = [self.get_rows_by_keys(db_role, table_name, keys[i:i + db.DEFAULT_CHUNKSIZE])
+                   for i in range(0, len(keys), db.DEFAULT_CHUNKSIZE)]
+        return pd.concat(batches, ignore_index=True)
+
+    def _watermark_update(self, table_name):
+        # after the edits are applied both tables hold the same key set and high-water mark
+        if table_name in self._sync_state:
+            state = self._sync_state.pop(table_name)
+            key = self._key_field(table_name)
+            edits = self.edits.get(table_name, _edits_template())
+            edit_keys = {(r, a): (edits[r][a][key] if len(edits[r][a]) > 0 else pd.Series([], dtype=object))
+                         for r in DB_ROLES for a in ['delete', 'insert']}
+            master_keys = _concat_keys(state['master_keys'], edit_keys[('master', 'insert')])
+            slave_keys = state['slave_keys'][~state['slave_keys'].isin(edit_keys[('slave', 'delete')])]
+            slave_keys = _concat_keys(slave_keys, edit_keys[('slave', 'insert')])
+            if state['last_modified'] is None:
+                self.watermarks.pop(table_name, None)
+            else:
+                self.watermarks[table_name] = {
+                    'master': _watermark(state['last_modified'], master_keys),
+                    'slave': _watermark(state['last_modified'], slave_keys)
+                }
 
     def _merge_edits_apply(self, table_name, db_role='', action='', rows=[]):
         edits = {}
@@ -201,20 +496,17 @@ class DBSyncer(object):
                     self.__getattribute__('_rows_' + action)(db_role, table_name, rows)
                 elif db_role in edits:
                     db_edits = edits[db_role]
-                    actions = list(EDITS_TEMPLATE[DB_ROLES[0]].keys())
-                    for a in actions:
-                        if len(db_edits[a]) > 0:
-                            rows = db_edits[a]
-                            try:
-                                self._merge_edits_apply(table_name,
-                                    db_role=db_role,
-                                    action=a,
-                                    rows=rows
-                                )
-                            except Exception as e:
-                                error_message = f'DB SYNC FATAL ERROR for {table_name} {db_role} rows {a}. '
-                                error_message = error_message + 'Manual repair may be required.'
-                                self._exception_handle(e=e, error_message=error_message, re_raise=True)
+                    for a, rows in self._edit_batches(table_name, db_edits):
+                        try:
+                            self._merge_edits_apply(table_name,
+                                db_role=db_role,
+                                action=a,
+                                rows=rows
+                            )
+                        except Exception as e:
+                            error_message = f'DB SYNC FATAL ERROR for {table_name} {db_role} rows {a}. '
+                            error_message = error_message + 'Manual repair may be required.'
+                            self._exception_handle(e=e, error_message=error_message, re_raise=True)
             else:
                 for r in DB_ROLES:
                     self._merge_edits_apply(table_name, db_role=r)
@@ -237,18 +529,161 @@ class DBSyncer(object):
 
     def _table_sync(self, table_name, edits_apply=True):
         if (not self._status_code == 4) and (table_name in self.tables):
-            self._merge_edits_update(table_name)
+            sync_mode = self._sync_mode(table_name)
+            if sync_mode == 'pushdown' and not pushdown_supported(self.engine('master'), self.engine('slave')):
+                print(f'push-down sync not available for table:{table_name}, comparing the tables in memory.')
+                sync_mode = SYNC_MODES[0]
+            if sync_mode == 'pushdown':
+                self._table_sync_pushdown(table_name, edits_apply)
+            elif sync_mode == 'partitioned':
+                self._table_sync_partitioned(table_name, edits_apply)
+            elif sync_mode == 'merkle':
+                self._merge_edits_update_merkle(table_name)
+            elif sync_mode == 'fingerprint':
+                self._merge_edits_update_fingerprint(table_name)
+            elif sync_mode == 'incremental':
+                self._merge_edits_update_incremental(table_name)
+            else:
+                self._merge_edits_update(table_name)
             if self.has_edits(table_name=table_name) and not self._status_code == 4:
                 self._status_code = 3
             if edits_apply and self._status_code == 3:
                 self._merge_edits_apply(table_name)
+            if edits_apply and not self._status_code == 4:
+                self._watermark_update(table_name)
+
+    def _table_sync_partitioned(self, table_name, edits_apply=True):
+        # compares the tables one hash partition of the key at a time, out of memory.
+        # the edits of each partition are applied before the next, or collected if not edits_apply
+        key = self._key_field(table_name)
+        last_modified = self._last_modified_field(table_name)
+        partitions = self._table_option(table_name, 'partitions', DEFAULT_PARTITIONS)
+        chunksize = self._table_option(table_name, 'chunksize', db.DEFAULT_CHUNKSIZE)
+        pending = []
+        try:
+            chunks = {r: db.iter_table(table_name, con=self.con(r), chunksize=chunksize) for r in DB_ROLES}
+            partition_edits = merge_edits_partitioned(chunks['master'], chunks['slave'], key, last_modified,
+                                                      partitions=partitions,
+                                                      spill_dir=self.sync_config.get('spill_dir'))
+            for table_edits in partition_edits:
+                self.edits[table_name] = table_edits
+                if self.has_edits(table_name=table_name):
+                    self._status_code = 3
+                    if edits_apply:
+                        self._merge_edits_apply(table_name)
+                    else:
+                        pending.append(table_edits)
+        except Exception as e:
+            error_message = f'DB FATAL SYNC ERROR for table:{table_name}. '
+            error_message = error_message + 'Error comparing databases. Unable to determine sync edits to apply.'
+            self._exception_handle(e=e, error_message=error_message)
+        self.edits[table_name] = _concat_edits(pending)
+
+    def _table_sync_pushdown(self, table_name, edits_apply=True):
+        # compares and applies the edits in sql on a master connection, no rows are read.
+        # if not edits_apply the edits hold the keys of the rows to edit
+        key = self._key_field(table_name)
+        last_modified = self._last_modified_field(table_name)
+        try:
+            table_edits, counts = merge_pushdown(self.engine('master'), self.engine('slave'), table_name,
+                                                 key, last_modified, edits_apply=edits_apply)
+        except Exception as e:
+            error_message = f'DB SYNC FATAL ERROR for table:{table_name}. '
+            error_message = error_message + 'Push-down sync failed, no edits were applied.'
+            self._exception_handle(e=e, error_message=error_message)
+        else:
+            self.edits[table_name] = table_edits
+            self.edit_counts[table_name] = counts
+
+    def _table_status_update(self, table_name, edits_apply=True):
+        if self._status_code == 4:
+            status = SYNC_STATUS_CODES[4]
+            errors = self.errors
+        else:
+            errors = ''
+            if self.has_edits(table_name=table_name) and not edits_apply:
+                status = SYNC_STATUS_CODES[3]
+            else:
+                status = SYNC_STATUS_CODES[1]
+        self.table_status[table_name] = {'status': status, 'errors': errors}
+
+    def report(self) -> dict:
+        """ sync status and per-table status and errors, in the configured table order
+        """
+        report = {
+            'status': self.sync_status(),
+            'tables': {t: self.table_status[t] for t in self.tables if t in self.table_status},
+            'errors': self.errors
+        }
+        return report
+
+    def _sync_parallel(self, edits_apply=True, workers=2, pool='thread'):
+        # each table syncs in its own DBSyncer with its own connections,
+        # results are merged in the configured table order
+        self.table_status = {}
+        tables = [t for t in self.tables if isinstance(self.tables[t], dict)]
+        executor_class = SYNC_POOLS[pool]
+        with executor_class(max_workers=workers) as executor:
+            futures = {t: executor.submit(_table_sync_task, self.sync_config, t, edits_apply)
+                       for t in tables}
+        errors = []
+        for t in tables:
+            try:
+                result = futures[t].result()
+            except Exception as e:
+                result = {'status': SYNC_STATUS_CODES[4], 'errors': f'DB SYNC FATAL ERROR for {t}. details:{e}',
+                          'edits': None, 'watermarks': None}
+            self.table_status[t] = {'status': result['status'], 'errors': result['errors']}
+            if result['edits']:
+                self.edits[t] = result['edits']
+            if result['watermarks']:
+                self.watermarks[t] = result['watermarks']
+            if result['errors']:
+                errors.append(result['errors'])
+        statuses = [self.table_status[t]['status'] for t in tables]
+        if SYNC_STATUS_CODES[4] in statuses:
+            self._status_code = 4
+        elif SYNC_STATUS_CODES[3] in statuses:
+            self._status_code = 3
+        else:
+            self._status_code = 1
+        self.errors = '\n'.join(errors)
+        if edits_apply and self.watermarks:
+            self._save_watermarks()
 
-    def sync(self, edits_apply=True, keep_connection=False):
+    def sync(self, edits_apply=True, keep_connection=False, workers=None, pool=None):
+        """ syncs all tables. with workers > 1 the tables are synced concurrently
+            in a thread or process pool, each worker with its own sqlite or mysql connections,
+            closed when its table is synced. generic connections and keep_connection
+            are not supported with workers > 1
+        """
+        if workers is None:
+            workers = self.sync_config.get('workers', 1)
+        if pool is None:
+            pool = self.sync_config.get('pool', 'thread')
+        if pool not in SYNC_POOLS:
+            raise ValueError(f'unrecognized pool:{pool}. Allowed {list(SYNC_POOLS)}')
+        if workers > 1:
+            generic = [r for r in DB_ROLES if self.sync_config.get(r, {}).get('db_type') not in PARALLEL_DB_TYPES]
+            if generic:
+                raise ValueError(f'parallel sync not supported for the {generic} db_type. '
+                                 f'Allowed {PARALLEL_DB_TYPES}, or workers=1')
+            if keep_connection:
+                raise ValueError('keep_connection not supported with workers > 1, '
+                                 'each worker closes its own connections')
+            self._sync_parallel(edits_apply=edits_apply, workers=workers, pool=pool)
+            return
         self.db_connect()
         if self.connected():
             self._status_code = 1
+            self.table_status = {}
             for t in self.tables:
-                self._table_sync(t, edits_apply=edits_apply)
+                if not self._status_code == 4:
+                    self._table_sync(t, edits_apply=edits_apply)
+                    if isinstance(self.tables[t], dict):
+                        self._table_status_update(t, edits_apply=edits_apply)
+            if edits_apply and self.watermarks:
+                self._save_watermarks()
             if self._status_code not in [1, 4]:
                 if edits_apply:
                     self._status_code = 1
@@ -258,6 +693,30 @@ class DBSyncer(object):
                 self.disconnect()
 
 
+def _table_sync_task(sync_config: dict, table_name: str, edits_apply=True) -> dict:
+    """ syncs one table in a new DBSyncer, run by the sync worker pool
+    """
+    syncer = DBSyncer(sync_config=sync_config)
+    syncer.tables = {table_name: syncer.tables[table_name]}
+    syncer.db_connect()
+    if syncer.connected():
+        syncer._status_code = 1
+        try:
+            syncer._table_sync(table_name, edits_apply=edits_apply)
+        except Exception as e:
+            if not syncer._status_code == 4:
+                syncer._exception_handle(e=e, error_message=f'DB SYNC FATAL ERROR for {table_name}.')
+        finally:
+            syncer.disconnect()
+    elif not syncer._status_code == 4:
+        syncer._exception_handle(error_message=f'db connect failed for table:{table_name}.')
+    syncer._table_status_update(table_name, edits_apply=edits_apply)
+    result = syncer.table_status[table_name].copy()
+    result['edits'] = syncer.edits.get(table_name)
+    result['watermarks'] = syncer.watermarks.get(table_name) if edits_apply else None
+    return result
+
+
 def _sync_config_from_file(config_path: str) -> dict:
     spec = {}
     file_exists = os.path.isfile(config_path)
@@ -271,6 +730,45 @@ def _sync_config_from_file(config_path: str) -> dict:
     return spec
 
 
+def _concat_keys(*keys) -> pd.Series:
+    return pd.concat([k for k in keys if len(k) > 0] or [pd.Series([], dtype=object)], ignore_index=True)
+
+
+def _max_value(values: list):
+    """ max of the non-null values, None if all are null. numbers and text are compared as they are,
+        other values as pd.Timestamp, to full precision
+    """
+    values = [v.item() if isinstance(v, np.generic) else v for v in values if not pd.isnull(v)]
+    max_value = None
+    if values:
+        if all([isinstance(v, (int, float)) for v in values]) or all([isinstance(v, str) for v in values]):
+            max_value = max(values)
+        else:
+            max_value = max([pd.Timestamp(v) for v in values])
+    return max_value
+
+
+def _watermark(last_modified, keys: pd.Series) -> dict:
+    """ json watermark of a table: the last_modified high-water mark, a timestamp as a full precision
+        ISO-8601 string with its last_modified_type, and the key_digest of its key set
+    """
+    watermark = {'last_modified': last_modified, 'key_digest': key_digest(keys)}
+    if isinstance(last_modified, pd.Timestamp):
+        watermark['last_modified'] = last_modified.isoformat()
+        watermark['last_modified_type'] = WATERMARK_DATETIME_TYPE
+    return watermark
+
+
+def _watermark_value(watermark: dict):
+    """ the last_modified high-water mark of a watermark, a timestamp as pd.Timestamp so it is bound
+        to queries as a datetime parameter
+    """
+    value = watermark['last_modified']
+    if watermark.get('last_modified_type') == WATERMARK_DATETIME_TYPE:
+        value = pd.Timestamp(value)
+    return value
+
+
 def config(config_path=DEFAULT_CONFIG_PATH):
     global SYNC_SPEC
     file_spec = _sync_config_from_file(config_path)
@@ -284,9 +782,18 @@ def update(config_path=DEFAULT_CONFIG_PATH):
     syncer.sync()
 
 
+@instrument.timed('sync.merge_edits', measure_arg='master')
 def merge_edits(master: pd.DataFrame, slave: pd.DataFrame,
-                key='index', last_modified='last_modified') -> dict:
-    edits = EDITS_TEMPLATE.copy()
+                key='index', last_modified='last_modified', mode='') -> dict:
+    """ compares master and slave and returns the edits to apply to each as EDITS_TEMPLATE
+        mode: 'columnar' (default) resolves conflicts with boolean masks,
+              'reference' uses the row-wise merge rules, kept for equivalence checks
+    """
+    if not mode:
+        mode = MERGE_MODE
+    if mode not in MERGE_MODES:
+        raise ValueError(f'unrecognized merge mode:{mode}. Allowed {MERGE_MODES}')
+    edits = _edits_template()
     #01 check trivial conditions
     if len(master) > 0 and len(slave) == 0:
         edits['slave']['insert'] = master.copy()
@@ -295,76 +802,506 @@ def merge_edits(master: pd.DataFrame, slave: pd.DataFrame,
         edits['master']['insert'] = slave.copy()
 
     elif len(master) > 0 and len(slave) > 0:
-        #02 create diff table
-        def reduced(tbl: pd.DataFrame) -> pd.DataFrame:
-            selected = tbl[[key, last_modified]].reset_index()
-            return selected
-
-        red_master = reduced(master)
-        red_slave = reduced(slave)
-        diff = pd.merge(red_master, red_slave, how='outer', on=key,
-                        suffixes=('_master', '_slave'))
-
-        #03 map the two index fields to two "exists" fields
-        for d in ['_master', '_slave']:
-            diff['exists' + d] = diff['index' + d].notnull()
-            diff['index' + d].fillna(0, inplace=True)
-            diff[last_modified + d].fillna(0, inplace=True)
-
-        #04 determine most_recent from last_modified
+        if mode == 'columnar':
+            _merge_edits_columnar(edits, master, slave, key, last_modified)
+        else:
+            _merge_edits_reference(edits, master, slave, key, last_modified)
+
+    return edits
+
+
+def _edits_template() -> dict:
+    return {r: {a: [] for a in EDITS_TEMPLATE[r]} for r in EDITS_TEMPLATE}
+
+
+def _merge_diff(master: pd.DataFrame, slave: pd.DataFrame,
+                key, last_modified) -> pd.DataFrame:
+    #02 create diff table
+    def reduced(tbl: pd.DataFrame) -> pd.DataFrame:
+        selected = tbl[[key, last_modified]].reset_index()
+        return selected
+
+    red_master = reduced(master)
+    red_slave = reduced(slave)
+    diff = pd.merge(red_master, red_slave, how='outer', on=key,
+                    suffixes=('_master', '_slave'))
+    return diff
+
+
+def _edit_source_rows(master: pd.DataFrame, slave: pd.DataFrame,
+                      destination, edit, diff_rows: pd.DataFrame) -> pd.DataFrame:
+    # rows inserted or updated in one db are read from the other,
+    # rows deleted from the slave are read from the slave itself
+    if destination == 'master' or edit == 'delete':
+        rows = slave.loc[diff_rows['index_slave']].copy()
+    else:
+        rows = master.loc[diff_rows['index_master']].copy()
+    return rows
+
+
+def _edit_masks(ex_master, ex_slave, master_recent, slave_recent) -> dict:
+    both = ex_master & ex_slave
+    master_only = ex_master & ~ex_slave
+    slave_only = ex_slave & ~ex_master
+    edit_masks = {
+        ('master', 'insert'): slave_only & slave_recent,
+        ('slave', 'delete'): slave_only & master_recent,
+        ('slave', 'insert'): master_only,
+        ('master', 'update'): both & slave_recent,
+        ('slave', 'update'): both & master_recent
+    }
+    return edit_masks
+
+
+def _merge_edits_columnar(edits, master, slave, key, last_modified, global_lm=None):
+    # global_lm: last_modified max of each full table, when master and slave are partitions of the tables
+    diff = _merge_diff(master, slave, key, last_modified)
+
+    #03 existence masks from the two index fields
+    ex_master = diff['index_master'].notnull().to_numpy()
+    ex_slave = diff['index_slave'].notnull().to_numpy()
+    lm_master = diff[last_modified + '_master'].fillna(0)
+    lm_slave = diff[last_modified + '_slave'].fillna(0)
+    both = ex_master & ex_slave
+    master_only = ex_master & ~ex_slave
+    slave_only = ex_slave & ~ex_master
+
+    #04 recency masks from last_modified
+    if global_lm is None:
         global_lm = {
             'master': master[last_modified].max(),
             'slave': slave[last_modified].max()
         }
+    master_recent = np.zeros(len(diff), dtype=bool)
+    slave_recent = np.zeros(len(diff), dtype=bool)
+    if both.any():
+        lm_m = lm_master[both]
+        lm_s = lm_slave[both]
+        master_recent[both] = (lm_m > lm_s).to_numpy(dtype=bool)
+        slave_recent[both] = (lm_s > lm_m).to_numpy(dtype=bool)
+    if master_only.any():
+        recent = (lm_master[master_only] >= global_lm['slave']).to_numpy(dtype=bool)
+        master_recent[master_only] = recent
+        slave_recent[master_only] = ~recent
+    if slave_only.any():
+        recent = (lm_slave[slave_only] >= global_lm['master']).to_numpy(dtype=bool)
+        slave_recent[slave_only] = recent
+        master_recent[slave_only] = ~recent
 
-        def most_recent(ex_master, ex_slave, lm_master, lm_slave):
-            recent = None
-            if ex_master and ex_slave:
-                if lm_master > lm_slave:
-                    recent = 'master'
-                elif lm_slave > lm_master:
-                    recent = 'slave'
-
-            elif ex_master:
-                if lm_master >= global_lm['slave']:
-                    recent = 'master'
-                else:
-                    recent = 'slave'
+    #05 destination and edit masks equivalent to MERGE_RULES
+    edit_masks = _edit_masks(ex_master, ex_slave, master_recent, slave_recent)
 
-            else: #must be slave only
-                if lm_slave >= global_lm['master']:
-                    recent = 'slave'
-                else:
-                    recent = 'master'
-
-            return recent
-
-        diff['most_recent'] = diff.apply(lambda x: most_recent(
-            x['exists_master'], x['exists_slave'],
-            x[last_modified + '_master'], x[last_modified + '_slave']), axis=1)
-        del diff[last_modified + '_master']
-        del diff[last_modified + '_slave']
-        diff.dropna(subset=['most_recent'], inplace=True)
-
-        #05 use merge rules to assign edit action
-        merge_rules = pd.DataFrame(MERGE_RULES)
-        join_fields = ['exists_master', 'exists_slave', 'most_recent']
-        diff = pd.merge(diff, merge_rules, how='left', on=join_fields)
-
-        #06 group by destination and edits
-        actions = list(edits['master'].keys())
-        edit_groups = diff.groupby(['destination', 'edit']).groups
-        for d in ['master', 'slave']:
-            for e in actions:
-                if (d, e) in edit_groups:
-                    diff_rows = diff.loc[edit_groups[(d, e)]].copy()
-                    if d == 'master':
-                        edits[d][e] = slave.loc[diff_rows['index_slave']].copy()
-                    else:
-                        edits[d][e] = master.loc[diff_rows['index_master']].copy()
+    #06 select edit rows
+    for (d, e), mask in edit_masks.items():
+        if mask.any():
+            edits[d][e] = _edit_source_rows(master, slave, d, e, diff[mask])
+
+
+@instrument.timed('sync.merge_edits_incremental', measure_arg='master')
+def merge_edits_incremental(master: pd.DataFrame, slave: pd.DataFrame,
+                            master_keys: pd.Series, slave_keys: pd.Series, watermarks: dict,
+                            key='index', last_modified='last_modified') -> dict:
+    """ returns the same edits as merge_edits from only the rows changed since the last sync
+        master, slave: rows with last_modified >= watermark, plus any master-only rows to insert
+        master_keys, slave_keys: the full key set of each table, to detect inserts and deletes
+        watermarks: last_modified high-water mark of each table at the last sync {db_role: value}
+    """
+    edits = _edits_template()
+    frames = {'master': master, 'slave': slave}
+    keys = {'master': master_keys, 'slave': slave_keys}
+    red = {}
+    for r in DB_ROLES:
+        rows = frames[r][[key, last_modified]].reset_index()
+        rows['changed'] = rows[last_modified] >= watermarks[r]
+        key_set = pd.DataFrame({key: pd.unique(keys[r]), 'exists': True})
+        red[r] = pd.merge(key_set, rows, how='left', on=key)
+    diff = pd.merge(red['master'], red['slave'], how='outer', on=key,
+                    suffixes=('_master', '_slave'))
+
+    #01 existence from the key sets, changes from the watermarks
+    ex_master = diff['exists_master'].notnull().to_numpy()
+    ex_slave = diff['exists_slave'].notnull().to_numpy()
+    ch_master = diff['changed_master'].eq(True).to_numpy()
+    ch_slave = diff['changed_slave'].eq(True).to_numpy()
+    lm_master = diff[last_modified + '_master']
+    lm_slave = diff[last_modified + '_slave']
+
+    #02 recency: a row changed on one side only is the most recent,
+    # a slave-only row is inserted to the master only if changed since the master's last edit
+    changed_master = master[last_modified][master[last_modified] >= watermarks['master']]
+    global_lm_master = changed_master.max() if len(changed_master) > 0 else watermarks['master']
+    both_changed = ex_master & ex_slave & ch_master & ch_slave
+    master_recent = ex_master & ex_slave & ch_master & ~ch_slave
+    slave_recent = ex_master & ex_slave & ch_slave & ~ch_master
+    if both_changed.any():
+        lm_m = lm_master[both_changed]
+        lm_s = lm_slave[both_changed]
+        master_recent[both_changed] = (lm_m > lm_s).to_numpy(dtype=bool)
+        slave_recent[both_changed] = (lm_s > lm_m).to_numpy(dtype=bool)
+    slave_only = ex_slave & ~ex_master
+    slave_only_recent = slave_only & ch_slave
+    if slave_only_recent.any():
+        recent = (lm_slave[slave_only_recent] >= global_lm_master).to_numpy(dtype=bool)
+        slave_recent[slave_only_recent] = recent
+    master_recent[slave_only] = ~slave_recent[slave_only]
+
+    #03 select edit rows, unchanged slave-only rows are deleted by key
+    edit_masks = _edit_masks(ex_master, ex_slave, master_recent, slave_recent)
+    for (d, e), mask in edit_masks.items():
+        if mask.any():
+            if (d, e) == ('slave', 'delete'):
+                edits[d][e] = diff.loc[mask, [key]].reset_index(drop=True)
+            else:
+                edits[d][e] = _edit_source_rows(master, slave, d, e, diff[mask])
+    return edits
+
+
+def merge_edits_partitioned(master_chunks, slave_chunks, key='index', last_modified='last_modified',
+                            partitions=DEFAULT_PARTITIONS, spill_dir=None):
+    """ yields the edits of merge_edits one hash partition of the key at a time, for tables larger than memory
+        master_chunks, slave_chunks: iterables of DataFrame chunks of each table, ex. db.iter_table
+        the chunks are spilled to temporary files by partition, then each pair of partitions is
+        compared with the last_modified max of the full tables, so the edits match merge_edits
+        spill_dir: (optional) directory of the temporary files, the system temp directory by default
+    """
+    # spans are closed before each yield, a span left open across a yield would time the caller
+    with _PartitionSpill(partitions, spill_dir) as spill:
+        counts = {}
+        global_lm = {}
+        with instrument.span('sync.merge_edits_partitioned.spill', partitions=partitions) as s:
+            for r, chunks in zip(DB_ROLES, [master_chunks, slave_chunks]):
+                counts[r], global_lm[r] = spill.write(r, chunks, key, last_modified)
+            if s:
+                s.rows = counts['master'] + counts['slave']
+        for p in range(partitions):
+            with instrument.span('sync.merge_edits_partitioned.merge', partition=p) as s:
+                master = spill.read('master', p)
+                slave = spill.read('slave', p)
+                edits = _edits_template()
+                if counts['master'] == 0 or counts['slave'] == 0:
+                    edits = merge_edits(master, slave, key, last_modified)
+                elif len(master) > 0 or len(slave) > 0:
+                    _merge_edits_columnar(edits, master, slave, key, last_modified, global_lm)
+                if s:
+                    s.rows = len(master) + len(slave)
+            yield edits
+
+
+class _PartitionSpill(object):
+    # rows of each db role hash partitioned on the key into files of pickled DataFrame batches
+    def __init__(self, partitions, spill_dir=None):
+        self.partitions = partitions
+        self.spill_dir = spill_dir
+        self.path = ''
+        self.frames = {}
 
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='dbsync_spill_', dir=self.spill_dir)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _file(self, db_role, partition):
+        return os.path.join(self.path, f'{db_role}_{partition}.pkl')
+
+    def write(self, db_role, chunks, key, last_modified) -> tuple:
+        # returns the row count and last_modified max of the table
+        count = 0
+        last_modified_max = None
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            count += len(chunk)
+            chunk_max = chunk[last_modified].max()
+            if last_modified_max is None or pd.isnull(last_modified_max) or chunk_max > last_modified_max:
+                last_modified_max = chunk_max
+            self.frames.setdefault(db_role, chunk.iloc[0:0])
+            partition = pd.util.hash_pandas_object(_partition_key(chunk[key]), index=False).to_numpy() \
+                % self.partitions
+            for p, rows in chunk.groupby(partition):
+                with open(self._file(db_role, p), 'ab') as f:
+                    pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return count, last_modified_max
+
+    def read(self, db_role, partition) -> pd.DataFrame:
+        batches = [self.frames.get(db_role, pd.DataFrame())]
+        path = self._file(db_role, partition)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                while True:
+                    try:
+                        batches.append(pickle.load(f))
+                    except EOFError:
+                        break
+        return pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+
+
+def _partition_key(keys: pd.Series) -> pd.Series:
+    # hash_pandas_object hashes by dtype, so numeric keys are hashed as float64 to put
+    # the same key of an int64 and a float64 table in the same partition
+    if pd.api.types.is_numeric_dtype(keys) and not pd.api.types.is_bool_dtype(keys):
+        return keys.astype('float64')
+    return keys
+
+
+def _concat_edits(edits_list: list) -> dict:
+    edits = _edits_template()
+    for r in DB_ROLES:
+        for a in edits[r]:
+            rows = [e[r][a] for e in edits_list if len(e[r][a]) > 0]
+            if rows:
+                edits[r][a] = pd.concat(rows, ignore_index=True)
+    return edits
+
+
+@instrument.timed('sync.merge_edits_fingerprint', measure_arg='master')
+def merge_edits_fingerprint(master: pd.DataFrame, slave: pd.DataFrame,
+                            key='index', last_modified='last_modified') -> dict:
+    """ returns the edits of merge_edits from the row fingerprints of each table, see db.get_table_fingerprints
+        master, slave: key, last_modified and db.FINGERPRINT_FIELD of each row
+        a row in both tables is updated only if the fingerprints differ, from the side with the more recent
+        last_modified, or from the master if neither is more recent, so changes without a last_modified
+        update are also synced. the edits hold the fingerprint rows, the full rows are read by key from the source
+    """
+    edits = merge_edits(master, slave, key, last_modified)
+    if len(master) > 0 and len(slave) > 0:
+        for r in DB_ROLES:
+            edits[r]['update'] = []
+        fields = [key, last_modified, db.FINGERPRINT_FIELD]
+        both = pd.merge(master[fields], slave[fields], how='inner', on=key, suffixes=('_master', '_slave'))
+        changed = both[both[db.FINGERPRINT_FIELD + '_master'] != both[db.FINGERPRINT_FIELD + '_slave']]
+        slave_recent = (changed[last_modified + '_slave'] > changed[last_modified + '_master']).to_numpy(dtype=bool)
+        if slave_recent.any():
+            edits['master']['update'] = slave[slave[key].isin(changed.loc[slave_recent, key])].copy()
+        if (~slave_recent).any():
+            edits['slave']['update'] = master[master[key].isin(changed.loc[~slave_recent, key])].copy()
     return edits
 
+
+@instrument.timed('sync.merkle_diff_ranges')
+def merkle_diff_ranges(summarize, fanout=MERKLE_FANOUT, leaf_rows=MERKLE_LEAF_ROWS) -> tuple:
+    """ finds the key ranges where the master and slave differ by comparing range summaries from the top down.
+        a range whose row count or digest differ is split at the quantiles of its master keys into up to fanout
+        ranges, until it holds at most leaf_rows master rows, so the summaries compared grow with
+        the number of differences and the log of the table size, and no keys are read
+        summarize: function(db_role, ranges, parts) returning the db.RANGE_SUMMARY_FIELDS of each (lo, hi)
+            key range, and the db.RANGE_SPLITS_FIELD into parts ranges if parts > 1, ex. db.get_range_summaries
+        returns (ranges, totals): the leaf ranges that differ, and the count and last_modified max of each table
+    """
+    ranges = [(None, None)]
+    leaves = []
+    totals = {}
+    while ranges:
+        summaries = {r: summarize(r, ranges, fanout if r == 'master' else 0) for r in DB_ROLES}
+        if not totals:
+            totals = {r: summaries[r].iloc[0][db.RANGE_SUMMARY_FIELDS].to_dict() for r in DB_ROLES}
+        master = summaries['master']
+        differ = ((master['count'].to_numpy() != summaries['slave']['count'].to_numpy()) |
+                  (master['digest'].to_numpy() != summaries['slave']['digest'].to_numpy()))
+        split = []
+        for i in np.flatnonzero(differ):
+            lo, hi = ranges[i]
+            splits = master[db.RANGE_SPLITS_FIELD].iloc[i] if fanout > 1 else []
+            if master['count'].iloc[i] > leaf_rows and len(splits) > 0:
+                bounds = [lo] + list(splits) + [hi]
+                split.extend(zip(bounds[:-1], bounds[1:]))
+            else:
+                leaves.append((lo, hi))
+        ranges = split
+    return leaves, totals
+
+
+def pushdown_supported(master_eng, slave_eng) -> bool:
+    """ True if the slave table can be read and written from a master connection:
+        two sqlite database files, or two databases on the same mysql server and login
+    """
+    supported = False
+    if isinstance(master_eng, Engine) and isinstance(slave_eng, Engine):
+        dialect = master_eng.dialect.name
+        master_url = master_eng.url
+        slave_url = slave_eng.url
+        if dialect in PUSHDOWN_DIALECTS and slave_eng.dialect.name == dialect:
+            if dialect == 'sqlite':
+                supported = all([u.database not in [None, '', ':memory:'] for u in [master_url, slave_url]])
+            else:
+                supported = bool(master_url.database) and bool(slave_url.database) and (
+                    (master_url.host, master_url.port, master_url.username) ==
+                    (slave_url.host, slave_url.port, slave_url.username))
+    return supported
+
+
+@instrument.timed('sync.merge_pushdown')
+def merge_pushdown(master_eng, slave_eng, table_name, key='index', last_modified='last_modified',
+                   edits_apply=True) -> tuple:
+    """ compares and syncs a table in the database with the edits of merge_edits, see pushdown_supported.
+        the edits are classified by one query over the two tables and applied with set-based
+        INSERT .. SELECT, UPDATE and DELETE statements in one transaction, so no rows are read into memory
+        edits_apply: if False, only classify the edits
+        returns (edits, counts): edits as EDITS_TEMPLATE with the keys of the rows to edit if not edits_apply,
+        and the number of rows of each edit {db_role: {action: count}}
+    """
+    master_table = db.get_sql_table(table_name, eng=master_eng, required=True)
+    slave_table = db.get_sql_table(table_name, eng=slave_eng, required=True)
+    columns = [c.name for c in master_table.columns if c.name in slave_table.columns]
+    missing = [f for f in [key, last_modified] if f not in columns]
+    if missing:
+        raise ValueError(f'fields {missing} not found in both {table_name} tables')
+    edits = _edits_template()
+    counts = {r: {a: 0 for a in edits[r]} for r in DB_ROLES}
+    with _pushdown_connection(master_eng, slave_eng) as (con, refs):
+        quote = master_eng.dialect.identifier_preparer.quote
+        refs = {r: f'{quote(refs[r])}.{quote(table_name)}' for r in DB_ROLES}
+        with con.begin():
+            master_count, global_lm = con.execute(text(
+                f'SELECT COUNT(*), MAX({quote(last_modified)}) FROM {refs["master"]}')).fetchone()
+            statements = _pushdown_statements(master_eng.dialect.name, quote, refs, columns, key,
+                                              last_modified, master_empty=master_count == 0)
+            params = {'global_lm': global_lm}
+            if edits_apply:
+                for (r, a), (select_keys, apply_edit) in statements.items():
+                    counts[r][a] = max(con.execute(text(apply_edit), params).rowcount, 0)
+            else:
+                classify = ' UNION ALL '.join([
+                    f"SELECT '{r}' AS db_role, '{a}' AS edit, keys.* FROM ({select_keys}) AS keys"
+                    for (r, a), (select_keys, apply_edit) in statements.items()])
+                keys = pd.read_sql(text(classify), con, params=params)
+                for (r, a), rows in keys.groupby(['db_role', 'edit']):
+                    edits[r][a] = rows[[key]].reset_index(drop=True)
+                    counts[r][a] = len(rows)
+    return edits, counts
+
+
+@contextmanager
+def _pushdown_connection(master_eng, slave_eng):
+    # yields a master connection and the schema of each table on it
+    with master_eng.connect() as con:
+        if master_eng.dialect.name == 'sqlite':
+            con.exec_driver_sql(f'ATTACH DATABASE ? AS {PUSHDOWN_SCHEMA}', (slave_eng.url.database,))
+            try:
+                yield con, {'master': 'main', 'slave': PUSHDOWN_SCHEMA}
+            finally:
+                con.exec_driver_sql(f'DETACH DATABASE {PUSHDOWN_SCHEMA}')
+        else:
+            yield con, {'master': master_eng.url.database, 'slave': slave_eng.url.database}
+
+
+def _pushdown_statements(dialect, quote, refs, columns, key, last_modified, master_empty=False) -> dict:
+    # {(db_role, action): (select_keys, apply_edit)} in the order to apply, equivalent to MERGE_RULES.
+    # the rows to edit are aliased t, their source s. :global_lm is the last_modified max of the master
+    k = quote(key)
+    lm = quote(last_modified)
+    field_list = ', '.join([quote(c) for c in columns])
+    values = ', '.join([f't.{quote(c)}' for c in columns])
+    other = {'master': 'slave', 'slave': 'master'}
+
+    def only(r):
+        return f'NOT EXISTS (SELECT 1 FROM {refs[other[r]]} AS s WHERE s.{k} = t.{k})'
+
+    def update(r):
+        # rows of r with a more recent row in the other db
+        source = refs[other[r]]
+        select_keys = (f'SELECT t.{k} FROM {refs[r]} AS t JOIN {source} AS s ON s.{k} = t.{k} '
+                       f'WHERE s.{lm} > t.{lm}')
+        fields = [quote(c) for c in columns if c != key]
+        if dialect == 'mysql':
+            assignments = ', '.join([f't.{f} = s.{f}' for f in fields])
+            apply_edit = (f'UPDATE {refs[r]} AS t JOIN {source} AS s ON s.{k} = t.{k} '
+                          f'SET {assignments} WHERE s.{lm} > t.{lm}')
+        else:
+            source_fields = ', '.join([f's.{f}' for f in fields])
+            apply_edit = (f'UPDATE {refs[r]} AS t SET ({", ".join(fields)}) = '
+                          f'(SELECT {source_fields} FROM {source} AS s WHERE s.{k} = t.{k}) '
+                          f'WHERE EXISTS (SELECT 1 FROM {source} AS s WHERE s.{k} = t.{k} AND s.{lm} > t.{lm})')
+        return select_keys, apply_edit
+
+    def insert(r, condition):
+        # rows of the other db missing from r
+        rows = f'FROM {refs[other[r]]} AS t WHERE NOT EXISTS (SELECT 1 FROM {refs[r]} AS s WHERE s.{k} = t.{k})'
+        rows = rows + f' AND {condition}'
+        return f'SELECT t.{k} {rows}', f'INSERT INTO {refs[r]} ({field_list}) SELECT {values} {rows}'
+
+    # a slave-only row is inserted to the master if at least as recent as the master, else deleted
+    recent = '1 = 1' if master_empty else f't.{lm} >= :global_lm'
+    stale = '1 = 0' if master_empty else f'(t.{lm} IS NULL OR NOT t.{lm} >= :global_lm)'
+    delete_rows = f'FROM {refs["slave"]} AS t WHERE {only("slave")} AND {stale}'
+    delete_target = 't ' if dialect == 'mysql' else ''
+    statements = {
+        ('slave', 'update'): update('slave'),
+        ('master', 'update'): update('master'),
+        ('master', 'insert'): insert('master', recent),
+        ('slave', 'delete'): (f'SELECT t.{k} {delete_rows}', f'DELETE {delete_target}{delete_rows}'),
+        ('slave', 'insert'): insert('slave', '1 = 1')
+    }
+    return statements
+
+
+def key_digest(keys: pd.Series) -> str:
+    """ order-independent digest of a key set, to check if a table's keys changed since the last sync
+    """
+    sorted_keys = pd.Series(pd.unique(keys)).sort_values(ignore_index=True)
+    hashed = pd.util.hash_pandas_object(sorted_keys, index=False)
+    return hashlib.sha1(hashed.to_numpy().tobytes()).hexdigest()
+
+
+def _merge_edits_reference(edits, master, slave, key, last_modified):
+    diff = _merge_diff(master, slave, key, last_modified)
+
+    #03 map the two index fields to two "exists" fields
+    for d in ['_master', '_slave']:
+        diff['exists' + d] = diff['index' + d].notnull()
+        diff['index' + d].fillna(0, inplace=True)
+        diff[last_modified + d].fillna(0, inplace=True)
+
+    #04 determine most_recent from last_modified
+    global_lm = {
+        'master': master[last_modified].max(),
+        'slave': slave[last_modified].max()
+    }
+
+    def most_recent(ex_master, ex_slave, lm_master, lm_slave):
+        recent = None
+        if ex_master and ex_slave:
+            if lm_master > lm_slave:
+                recent = 'master'
+            elif lm_slave > lm_master:
+                recent = 'slave'
+
+        elif ex_master:
+            if lm_master >= global_lm['slave']:
+                recent = 'master'
+            else:
+                recent = 'slave'
+
+        else: #must be slave only
+            if lm_slave >= global_lm['master']:
+                recent = 'slave'
+            else:
+                recent = 'master'
+
+        return recent
+
+    diff['most_recent'] = diff.apply(lambda x: most_recent(
+        x['exists_master'], x['exists_slave'],
+        x[last_modified + '_master'], x[last_modified + '_slave']), axis=1)
+    del diff[last_modified + '_master']
+    del diff[last_modified + '_slave']
+    diff.dropna(subset=['most_recent'], inplace=True)
+
+    #05 use merge rules to assign edit action
+    merge_rules = pd.DataFrame(MERGE_RULES)
+    join_fields = ['exists_master', 'exists_slave', 'most_recent']
+    diff = pd.merge(diff, merge_rules, how='left', on=join_fields)
+
+    #06 group by destination and edits
+    actions = list(edits['master'].keys())
+    edit_groups = diff.groupby(['destination', 'edit']).groups
+    for d in ['master', 'slave']:
+        for e in actions:
+            if (d, e) in edit_groups:
+                diff_rows = diff.loc[edit_groups[(d, e)]].copy()
+                edits[d][e] = _edit_source_rows(master, slave, d, e, diff_rows)
+
 #***** Command line interface *******************************
 
 if __name__ == '__main__':
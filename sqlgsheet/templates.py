@@ -61,6 +61,57 @@ class DBConnection(object):
         df = DataFrame([])
         return df
 
+    def iter_table(self, table_name: str, chunksize: int, columns=None, where=None):
+        """ READ (optional): returns the table as an iterator of DataFrame chunks of chunksize rows.
+        equivalent to SQL: SELECT columns FROM table_name WHERE where;
+        implement this to stream large tables. where is a backend-specific predicate
+        """
+        if where:
+            raise ValueError('where predicate not supported. Override iter_table')
+        df = self.get_table(table_name)
+        if columns:
+            df = df[columns]
+        return (df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize))
+
+    def get_table_columns(self, table_name: str, columns: list) -> DataFrame:
+        """ READ (optional): returns only the selected columns of the table.
+        equivalent to SQL: SELECT columns FROM table_name;
+        """
+        return self.get_table(table_name)[columns]
+
+    def get_table_since(self, table_name: str, field: str, value) -> DataFrame:
+        """ READ (optional): returns the rows modified since a watermark.
+        equivalent to SQL: SELECT * FROM table_name WHERE field >= value;
+        """
+        df = self.get_table(table_name)
+        return df[df[field] >= value]
+
+    def get_rows_by_keys(self, table_name: str, key: str, keys: list) -> DataFrame:
+        """ READ (optional): returns the rows whose key is in keys.
+        equivalent to SQL: SELECT * FROM table_name WHERE key IN keys;
+        """
+        df = self.get_table(table_name)
+        return df[df[key].isin(keys)]
+
+    def get_range_summaries(self, table_name: str, key: str, fields: list, ranges: list,
+                            last_modified: str, method='hash', parts=0) -> DataFrame:
+        """ READ (optional): returns the row count, the xor of the row fingerprints and the max of
+        last_modified of the rows in each (lo, hi) key range, as lo <= key < hi with None for an open end.
+        one row per range with the columns: count, digest, last_modified, and with parts > 1 the column
+        splits: the keys splitting the range into parts ranges of equal row counts.
+        implement this to summarize the ranges in the backend, ex. with
+        sqlgsheet.database.summarize_ranges over the rows of the ranges and the fingerprint method given,
+        so only the summaries are transferred. merkle sync reads the table once when it is not implemented
+        """
+        raise NotImplementedError
+
+    def get_rows_in_ranges(self, table_name: str, key: str, ranges: list) -> DataFrame:
+        """ READ (optional): returns the rows whose key is in any of the (lo, hi) key ranges.
+        equivalent to SQL: SELECT * FROM table_name WHERE (key >= lo AND key < hi) OR ...;
+        merkle sync reads the table once when it is not implemented
+        """
+        raise NotImplementedError
+
     def rows_update(rows: DataFrame, table_name: str, key: str):
         """ UPDATE: takes input pandas DataFrame rows and updates the rows from the database
              by the primary key specified
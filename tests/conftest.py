@@ -0,0 +1,72 @@
+import threading
+import pytest
+from sqlgsheet import gsheet as gs
+from sqlgsheet import database as db
+from sqlgsheet import gdrive as gd
+from sqlgsheet import quota
+from tests.fakes import FakeSheetsService, FakeDriveService, FakeMediaDownload
+
+WKBID = 'wkb-myapp'
+GSHEET_CONFIG = {
+    'myapp': {
+        'wkbid': WKBID,
+        'sheets': {
+            'config': {'data': 'config!A2:D', 'header': 'config!A1:D1'},
+            'records': {'data': 'records!A2:C', 'header': 'records!A1:C1',
+                        'data_types': {'date': 'date', 'parameter': 'str', 'value': 'float'}},
+            'form': {'data': 'form!A3:C', 'header': 'form!A2:C2',
+                     'data_types': {'date': 'date', 'parameter': 'str', 'value': 'float'}}
+        }
+    }
+}
+
+
+@pytest.fixture
+def sheets_service():
+    return FakeSheetsService(sheets={WKBID: ['config', 'records', 'form']})
+
+
+@pytest.fixture
+def sheets_engine(sheets_service, monkeypatch):
+    """ SheetsEngine on the fake service, with its own unlimited request scheduler
+    """
+    monkeypatch.setattr(gs.SheetsEngine, 'login', lambda self: setattr(self, 'service', sheets_service))
+    quotas = {bucket: {'requests': 10 ** 6, 'period': 1} for bucket in quota.QUOTAS}
+    return gs.SheetsEngine(scheduler=quota.RequestScheduler(quotas=quotas, max_retries=0))
+
+
+@pytest.fixture
+def gsheet_db(sheets_engine, monkeypatch):
+    """ database module configured with the myapp workbook on the fake service
+    """
+    monkeypatch.setattr(db, 'gs_engine', sheets_engine)
+    monkeypatch.setattr(db, 'GSHEET_CONFIG', GSHEET_CONFIG)
+    monkeypatch.setattr(db, 'SHEET_SNAPSHOTS', {})
+    monkeypatch.setattr(db, 'COERCION_PLANS', {})
+    monkeypatch.setattr(db, 'COERCION_ERRORS', {})
+    return db
+
+
+@pytest.fixture
+def drive_service(monkeypatch):
+    """ gdrive module on a fake drive with the folders reports/2024 and a folder named 'a/b',
+    with its own unlimited request scheduler and the metadata cache off.
+    the download worker threads build the same service
+    """
+    folder = 'application/vnd.google-apps.folder'
+    service = FakeDriveService(files={
+        'reports': {'name': 'reports', 'mimeType': folder, 'parents': ['root']},
+        'y2024': {'name': '2024', 'mimeType': folder, 'parents': ['reports']},
+        'slash': {'name': 'a/b', 'mimeType': folder, 'parents': ['root']},
+        'jan': {'name': 'jan.csv', 'mimeType': 'text/csv', 'parents': ['y2024'], 'content': b'day,steps\n1,10\n'},
+        'feb': {'name': 'feb.csv', 'mimeType': 'text/csv', 'parents': ['y2024'], 'content': b'day,steps\n1,12\n'},
+        'note': {'name': 'note.txt', 'mimeType': 'text/plain', 'parents': ['slash']}
+    })
+    quotas = {bucket: {'requests': 10 ** 6, 'period': 1} for bucket in quota.QUOTAS}
+    monkeypatch.setattr(gd, 'service', service)
+    monkeypatch.setattr(gd, 'metadata_cache', None)
+    monkeypatch.setattr(gd, 'build_service', lambda: service)
+    monkeypatch.setattr(gd, '_local', threading.local())
+    monkeypatch.setattr(gd, 'MediaIoBaseDownload', FakeMediaDownload)
+    monkeypatch.setattr(quota, 'scheduler', quota.RequestScheduler(quotas=quotas, max_retries=0))
+    return service
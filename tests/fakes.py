@@ -0,0 +1,351 @@
+""" in-memory fakes of the google api services and of generic database connections,
+for tests without network access or credentials
+"""
+import re
+from sqlgsheet import templates
+from sqlgsheet import database as db
+
+CELL_PATTERN = re.compile(r'^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$')
+
+
+class FakeRequest(object):
+    def __init__(self, service, method, params, fn):
+        self.service = service
+        self.method = method
+        self.params = params
+        self.fn = fn
+
+    def execute(self, **kwargs):
+        self.service.requests.append((self.method, self.params))
+        return self.fn()
+
+
+class FakeSheetsService(object):
+    """ fake of the Sheets v4 service returned by googleapiclient.discovery.build('sheets', 'v4')
+
+    cells are kept per (spreadsheetId, sheet title) and read back as formatted strings, like the api's
+    default FORMATTED_VALUE rendering. trailing blank cells and rows are left out of the values read.
+    every executed request is recorded in requests as (method, params)
+    """
+    def __init__(self, sheets=None):
+        self.sheets = sheets or {}  # {spreadsheetId: [sheet title]}
+        self.cells = {}  # {(spreadsheetId, sheet): {(row, col): value}}, zero-based
+        self.requests = []
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+    def methods(self) -> list:
+        return [method for method, params in self.requests]
+
+    def reset_requests(self):
+        self.requests = []
+
+    def set_values(self, spreadsheetId, rangeName, values, input_option='USER_ENTERED'):
+        # writes values without recording a request, to set up the sheet contents of a test
+        self._write(spreadsheetId, rangeName, values, input_option)
+
+    def get_values(self, spreadsheetId, rangeName) -> list:
+        return self._read(spreadsheetId, rangeName)
+
+    def _grid(self, spreadsheetId, sheet):
+        return self.cells.setdefault((spreadsheetId, sheet), {})
+
+    def _parse(self, spreadsheetId, rangeName):
+        # (sheet, first_row, first_col, last_row, last_col), None for an open end
+        sheet, _, cells = rangeName.rpartition('!')
+        if not sheet:
+            if CELL_PATTERN.match(rangeName) and rangeName:
+                sheet, cells = self.sheets.get(spreadsheetId, ['Sheet1'])[0], rangeName
+            else:
+                sheet, cells = rangeName, ''
+        sheet = sheet.strip("'")
+        match = CELL_PATTERN.match(cells)
+        if match is None:
+            raise ValueError(f'Unable to parse range: {rangeName}')
+        first_col, first_row, last_col, last_row = match.groups()
+        if ':' not in cells:
+            last_col, last_row = first_col, first_row
+        return (sheet,
+                int(first_row) - 1 if first_row else 0,
+                _column_index(first_col) if first_col else 0,
+                int(last_row) - 1 if last_row else None,
+                _column_index(last_col) if last_col else None)
+
+    def _read(self, spreadsheetId, rangeName) -> list:
+        sheet, first_row, first_col, last_row, last_col = self._parse(spreadsheetId, rangeName)
+        grid = self._grid(spreadsheetId, sheet)
+        cells = {(r, c): v for (r, c), v in grid.items()
+                 if r >= first_row and c >= first_col
+                 and (last_row is None or r <= last_row) and (last_col is None or c <= last_col)}
+        if not cells:
+            return []
+        n_rows = max([r for r, c in cells]) - first_row + 1
+        values = []
+        for i in range(n_rows):
+            row_cols = [c for r, c in cells if r == first_row + i]
+            width = max(row_cols) - first_col + 1 if row_cols else 0
+            values.append([_formatted(cells.get((first_row + i, first_col + j), '')) for j in range(width)])
+        return values
+
+    def _write(self, spreadsheetId, rangeName, values, input_option='RAW'):
+        sheet, first_row, first_col, last_row, last_col = self._parse(spreadsheetId, rangeName)
+        n_rows = len(values)
+        n_cols = max([len(row) for row in values] + [0])
+        if (last_row is not None and n_rows > last_row - first_row + 1) or \
+                (last_col is not None and n_cols > last_col - first_col + 1):
+            raise ValueError(f'Requested writing within range [{rangeName}], but tried writing '
+                             f'{n_rows} rows and {n_cols} columns')
+        grid = self._grid(spreadsheetId, sheet)
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                if value is None:
+                    continue
+                cell = _stored(value, input_option)
+                if cell == '':
+                    grid.pop((first_row + i, first_col + j), None)
+                else:
+                    grid[(first_row + i, first_col + j)] = cell
+        return {'updatedRange': rangeName, 'updatedRows': n_rows}
+
+    def _clear(self, spreadsheetId, rangeName):
+        sheet, first_row, first_col, last_row, last_col = self._parse(spreadsheetId, rangeName)
+        grid = self._grid(spreadsheetId, sheet)
+        for r, c in list(grid):
+            if r >= first_row and c >= first_col and \
+                    (last_row is None or r <= last_row) and (last_col is None or c <= last_col):
+                del grid[(r, c)]
+        return {'clearedRange': rangeName}
+
+
+class _Spreadsheets(object):
+    def __init__(self, service):
+        self.service = service
+
+    def values(self):
+        return _Values(self.service)
+
+    def get(self, spreadsheetId, **kwargs):
+        titles = self.service.sheets.get(spreadsheetId, [])
+        return FakeRequest(self.service, 'get', {'spreadsheetId': spreadsheetId},
+                           lambda: {'sheets': [{'properties': {'sheetId': i, 'title': t}}
+                                               for i, t in enumerate(titles)]})
+
+
+class _Values(object):
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return FakeRequest(self.service, 'values.get', {'spreadsheetId': spreadsheetId, 'range': range},
+                           lambda: {'range': range, 'values': self.service._read(spreadsheetId, range)})
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return FakeRequest(self.service, 'values.batchGet', {'spreadsheetId': spreadsheetId, 'ranges': list(ranges)},
+                           lambda: {'valueRanges': [{'range': r, 'values': self.service._read(spreadsheetId, r)}
+                                                    for r in ranges]})
+
+    def update(self, spreadsheetId, range, body, valueInputOption='RAW', **kwargs):
+        params = {'spreadsheetId': spreadsheetId, 'range': range, 'valueInputOption': valueInputOption,
+                  'body': body}
+        return FakeRequest(self.service, 'values.update', params,
+                           lambda: self.service._write(spreadsheetId, range, body['values'], valueInputOption))
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def fn():
+            return {'responses': [self.service._write(spreadsheetId, d['range'], d['values'],
+                                                      body.get('valueInputOption', 'RAW'))
+                                  for d in body['data']]}
+        return FakeRequest(self.service, 'values.batchUpdate', {'spreadsheetId': spreadsheetId, 'body': body}, fn)
+
+    def clear(self, spreadsheetId, range, **kwargs):
+        return FakeRequest(self.service, 'values.clear', {'spreadsheetId': spreadsheetId, 'range': range},
+                           lambda: self.service._clear(spreadsheetId, range))
+
+    def batchClear(self, spreadsheetId, body, **kwargs):
+        return FakeRequest(self.service, 'values.batchClear', {'spreadsheetId': spreadsheetId, 'body': body},
+                           lambda: {'clearedRanges': [self.service._clear(spreadsheetId, r)['clearedRange']
+                                                      for r in body['ranges']]})
+
+
+def _column_index(col) -> int:
+    number = 0
+    for c in col:
+        number = number * 26 + ord(c) - ord('A') + 1
+    return number - 1
+
+
+def _stored(value, input_option):
+    # RAW keeps strings as text, USER_ENTERED parses numbers as the sheets ui does
+    if isinstance(value, bool) or isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    if input_option == 'USER_ENTERED':
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _formatted(cell) -> str:
+    if isinstance(cell, bool):
+        return 'TRUE' if cell else 'FALSE'
+    if isinstance(cell, float):
+        return str(int(cell)) if cell.is_integer() else repr(cell)
+    return str(cell)
+
+
+
+class FakeDriveService(object):
+    """ fake of the Drive v3 service returned by googleapiclient.discovery.build('drive', 'v3'), for the
+    list queries of gdrive: name='..', mimeType='..' or !='..' and '<id>' in parents, joined by and.
+    every executed request is recorded in requests as (method, params), each downloaded chunk as a get_media
+    and a batch request once as ('batch', {'size': n}). errors[file_id] are raised, one per attempt,
+    by the sub-requests of a batch for that file
+    """
+    def __init__(self, files=None):
+        self.files_by_id = files or {}  # {id: {'name', 'mimeType', 'parents', 'content' (optional bytes)}}
+        self.requests = []
+        self.errors = {}  # {file_id: [exception]}
+
+    def files(self):
+        return _Files(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self, callback)
+
+    def methods(self) -> list:
+        return [method for method, params in self.requests]
+
+    def _move(self, fileId, addParents, removeParents):
+        file = self.files_by_id[fileId]
+        file['parents'] = [p for p in file['parents'] if p != removeParents] + [addParents]
+        return {'id': fileId, 'parents': file['parents']}
+
+    def _list(self, q, pageSize=1000, pageToken=None):
+        matches = [{'id': i, 'name': f['name'], 'mimeType': f['mimeType']}
+                   for i, f in self.files_by_id.items() if all(_matches(f, c) for c in q.split(' and '))]
+        start = int(pageToken or 0)
+        response = {'files': matches[start:start + pageSize]}
+        if start + pageSize < len(matches):
+            response['nextPageToken'] = str(start + pageSize)
+        return response
+
+
+class _Files(object):
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, q, spaces='drive', fields=None, pageSize=1000, pageToken=None):
+        return FakeRequest(self.service, 'files.list', {'q': q, 'pageToken': pageToken},
+                           lambda: self.service._list(q, pageSize, pageToken))
+
+    def get(self, fileId, fields=None):
+        return FakeRequest(self.service, 'files.get', {'fileId': fileId},
+                           lambda: {'parents': self.service.files_by_id[fileId]['parents']})
+
+    def update(self, fileId, addParents='', removeParents='', fields=None):
+        return FakeRequest(self.service, 'files.update', {'fileId': fileId},
+                           lambda: self.service._move(fileId, addParents, removeParents))
+
+    def get_media(self, fileId):
+        return FakeRequest(self.service, 'files.get_media', {'fileId': fileId},
+                           lambda: self.service.files_by_id[fileId].get('content', b''))
+
+
+class FakeBatchRequest(object):
+    """ fake of googleapiclient.http.BatchHttpRequest, calling callback(request_id, response, exception)
+    for each sub-request in the order they were added
+    """
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.sub_requests = []
+
+    def add(self, request, request_id=None):
+        self.sub_requests.append((request_id, request))
+
+    def execute(self, **kwargs):
+        self.service.requests.append(('batch', {'size': len(self.sub_requests)}))
+        for request_id, request in self.sub_requests:
+            errors = self.service.errors.get(request.params.get('fileId'))
+            if errors:
+                self.callback(request_id, None, errors.pop(0))
+            else:
+                self.callback(request_id, request.fn(), None)
+
+
+class FakeMediaDownload(object):
+    """ fake of googleapiclient.http.MediaIoBaseDownload over a get_media FakeRequest,
+    writing the content to fd one chunk per next_chunk call
+    """
+    def __init__(self, fd, request, chunksize=100 * 2 ** 20):
+        self.fd = fd
+        self.request = request
+        self.chunksize = chunksize
+        self.progress = 0
+
+    def next_chunk(self):
+        content = self.request.execute()
+        chunk = content[self.progress:self.progress + self.chunksize]
+        self.fd.write(chunk)
+        self.progress += len(chunk)
+        return _DownloadStatus(self.progress, len(content)), self.progress >= len(content)
+
+
+class _DownloadStatus(object):
+    def __init__(self, resumable_progress, total_size):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self):
+        return self.resumable_progress / self.total_size if self.total_size else 1.0
+
+
+def _matches(file, condition) -> bool:
+    parents = re.match(r"^'(.*)' in parents$", condition)
+    if parents:
+        return parents.group(1) in file['parents']
+    field, operator, value = re.match(r"^(\w+)(!?=)'(.*)'$", condition).groups()
+    return (file[field] == value.replace("\\'", "'")) == (operator == '=')
+
+
+class FakeTableConnection(templates.DBConnection):
+    """ generic connection over DataFrames, without the optional range methods.
+    rows_read counts the rows it returns, as a remote backend would transfer them
+    """
+    def __init__(self, tables):
+        super().__init__()
+        self.tables = tables
+        self.rows_read = 0
+
+    def _read(self, tbl):
+        self.rows_read += len(tbl)
+        return tbl.copy()
+
+    def table_exists(self, table_name: str) -> bool:
+        return table_name in self.tables
+
+    def get_table_names(self) -> list:
+        return list(self.tables)
+
+    def get_table(self, table_name: str):
+        return self._read(self.tables[table_name])
+
+    def get_rows_by_keys(self, table_name: str, key: str, keys: list):
+        tbl = self.tables[table_name]
+        return self._read(tbl[tbl[key].isin(keys)])
+
+
+class FakeSummaryConnection(FakeTableConnection):
+    """ generic connection that summarizes key ranges in the backend, so only the summaries
+    and the rows of the ranges read are transferred
+    """
+    def get_range_summaries(self, table_name, key, fields, ranges, last_modified, method='hash', parts=0):
+        return db.summarize_ranges(self.tables[table_name], key, fields, ranges, last_modified,
+                                   method=method, parts=parts)
+
+    def get_rows_in_ranges(self, table_name, key, ranges):
+        return self._read(db.rows_in_ranges(self.tables[table_name], key, ranges))
@@ -0,0 +1,50 @@
+import pandas as pd
+from sqlgsheet import benchmark
+
+CASE = {'rows': 200, 'overlap': 0.9, 'update_ratio': 0.1, 'insert_ratio': 0.05, 'delete_ratio': 0.05}
+
+
+def test_make_tables_is_seeded():
+    master, slave = benchmark.make_tables(200, 0.9, 0.1, 0.05, 0.05, skew=0, seed=1)
+    again = benchmark.make_tables(200, 0.9, 0.1, 0.05, 0.05, skew=0, seed=1)
+
+    pd.testing.assert_frame_equal(master, again[0])
+    pd.testing.assert_frame_equal(slave, again[1])
+    assert master[benchmark.KEY].tolist() == list(range(200))
+    # deleted rows are only in the slave, inserted rows newer than any master row
+    slave_only = slave[~slave[benchmark.KEY].isin(master[benchmark.KEY])]
+    assert slave_only[benchmark.KEY].tolist() == list(range(200, 220))
+    inserted = slave_only[slave_only[benchmark.KEY] >= 210]
+    assert inserted[benchmark.LAST_MODIFIED].min() > master[benchmark.LAST_MODIFIED].max()
+
+
+def test_write_database_round_trip(tmp_path):
+    master, slave = benchmark.make_tables(50, 1.0, 0, 0, 0, skew=0)
+    path = str(tmp_path / 'master.db')
+    benchmark.write_database(master, path)
+
+    written = pd.read_sql_table(benchmark.TABLE_NAME, f'sqlite:///{path}')
+    assert written[benchmark.KEY].tolist() == master[benchmark.KEY].tolist()
+    assert written['value'].tolist() == master['value'].tolist()
+
+
+def test_run_case_reports_phases_and_edits(tmp_path):
+    result = benchmark.run_case(CASE, work_dir=str(tmp_path))
+
+    assert result['case']['sync_mode'] == benchmark.BENCHMARK_CASE['sync_mode']
+    assert set(result['seconds']) == {'generate', 'write', 'merge_edits', 'sync'}
+    assert 'sync.merge_edits' in result['sync_seconds']
+    assert result['status'] == 'synced'
+    # the rows inserted in the slave are copied to the master, the rows deleted from the master removed
+    assert result['edits']['master']['insert'] == 10
+    assert result['edits']['slave']['delete'] == 10
+    assert result['rows_per_second']['sync'] > 0
+    # the generated databases are removed
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_run_in_process(tmp_path):
+    report = benchmark.run([CASE, {**CASE, 'sync_mode': 'incremental'}], work_dir=str(tmp_path), isolate=False)
+
+    assert [r['case']['sync_mode'] for r in report['results']] == ['full', 'incremental']
+    assert report['platform']['pandas'] == pd.__version__
@@ -0,0 +1,61 @@
+import pytest
+from sqlgsheet import cache
+
+SHEET = 'wkb-test'
+
+
+def test_range_cache_evicts_least_recently_used():
+    range_cache = cache.RangeCache(max_entries=2)
+    range_cache.put_range(SHEET, 'a!A1:B', [['1']])
+    range_cache.put_range(SHEET, 'b!A1:B', [['2']])
+    range_cache.get_range(SHEET, 'a!A1:B')
+    range_cache.put_range(SHEET, 'c!A1:B', [['3']])
+
+    assert range_cache.get_range(SHEET, 'b!A1:B') is None
+    assert range_cache.get_range(SHEET, 'a!A1:B') == [['1']]
+    assert len(range_cache) == 2
+
+
+def test_range_cache_size_bound():
+    range_cache = cache.RangeCache(max_bytes=30)  # 16 bytes per entry
+    range_cache.put_range(SHEET, 'a!A1:B', [['x' * 10]])
+    range_cache.put_range(SHEET, 'b!A1:B', [['y' * 10]])
+    range_cache.put_range(SHEET, 'c!A1:B', [['z' * 100]])  # larger than the cache, not stored
+
+    assert range_cache.get_range(SHEET, 'a!A1:B') is None
+    assert range_cache.get_range(SHEET, 'b!A1:B') == [['y' * 10]]
+    assert range_cache.get_range(SHEET, 'c!A1:B') is None
+
+
+def test_range_cache_expires_and_persists(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    path = str(tmp_path / 'gsheet_cache.db')
+    cache.RangeCache(ttl=60, path=path).put_range(SHEET, 'a!A1:B', [['1']])
+
+    assert cache.RangeCache(ttl=60, path=path).get_range(SHEET, 'a!A1:B') == [['1']]
+    now[0] += 61
+    assert cache.RangeCache(ttl=60, path=path).get_range(SHEET, 'a!A1:B') is None
+
+
+def test_range_cache_invalidates_overlapping_ranges(tmp_path):
+    range_cache = cache.RangeCache(path=str(tmp_path / 'gsheet_cache.db'))
+    for rangeName in ['records!A2:C', 'records!E1:F9', 'form!A2:C', 'records']:
+        range_cache.put_range(SHEET, rangeName, [['1']])
+    range_cache.put_range('other', 'records!A2:C', [['1']])
+    range_cache.invalidate_range(SHEET, 'records!B5:B5')
+
+    kept = [rangeName for rangeName in ['records!A2:C', 'records!E1:F9', 'form!A2:C', 'records']
+            if range_cache.get_range(SHEET, rangeName) is not None]
+    assert kept == ['records!E1:F9', 'form!A2:C']
+    assert range_cache.get_range('other', 'records!A2:C') == [['1']]
+
+
+@pytest.mark.parametrize('rangeName, expected', [
+    ('records!A2:C', ('records', 1, 2, 3, None)),
+    ("'My Sheet'!B5", ('my sheet', 2, 5, 2, 5)),
+    ('records', ('records', None, None, None, None)),
+    ('A1:B2', ('', 1, 1, 2, 2)),
+])
+def test_range_bounds(rangeName, expected):
+    assert cache.range_bounds(rangeName) == expected
@@ -0,0 +1,399 @@
+import asyncio
+import datetime
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlgsheet import database as db
+from sqlgsheet import templates
+from tests.conftest import WKBID
+
+
+def records(n, value=1.5):
+    return pd.DataFrame({'date': [f'2024-01-{i + 1:02d}' for i in range(n)],
+                         'parameter': ['steps'] * n,
+                         'value': [value + i for i in range(n)]})
+
+
+@pytest.mark.parametrize('rngid, expected', [
+    ('records!A2:C', ('records!', 'A', 2, 'C')),
+    ('records!A:C', ('records!', 'A', 1, 'C')),
+    ('records!B5', ('records!', 'B', 5, 'B')),
+])
+def test_parse_range(gsheet_db, rngid, expected):
+    assert gsheet_db._parse_range(rngid) == expected
+
+
+def test_overwrite_open_row_range(gsheet_db, sheets_service, monkeypatch):
+    config = {'wkbid': WKBID, 'sheets': {'records': {'data': 'records!A:C', 'header': 'records!A1:C1'}}}
+    monkeypatch.setitem(gsheet_db.GSHEET_CONFIG, 'open', config)
+    gsheet_db.post_to_gsheet(records(3), 'open', 'records')
+    sheets_service.reset_requests()
+
+    gsheet_db.post_to_gsheet(records(1), 'open', 'records', mode='overwrite')
+    assert sheets_service.methods() == ['values.batchUpdate']
+    written = sheets_service.requests[0][1]['body']['data']
+    assert written == [{'range': 'records!A:C', 'values': [['2024-01-01', 'steps', '1.5'],
+                                                           ['', '', ''], ['', '', '']]}]
+    assert sheets_service.get_values(WKBID, 'records!A:C') == [['2024-01-01', 'steps', '1.5']]
+
+
+def test_overwrite_sheet_name_range_clears(gsheet_db, sheets_service, monkeypatch, capsys):
+    config = {'wkbid': WKBID, 'sheets': {'records': {'data': 'records', 'header': 'records!A1:C1'}}}
+    monkeypatch.setitem(gsheet_db.GSHEET_CONFIG, 'open', config)
+    gsheet_db.post_to_gsheet(records(3), 'open', 'records')
+    sheets_service.reset_requests()
+
+    gsheet_db.post_to_gsheet(records(1), 'open', 'records', mode='overwrite')
+    assert sheets_service.methods() == ['values.batchClear', 'values.batchUpdate']
+    assert 'clearing it instead' in capsys.readouterr().out
+    assert sheets_service.get_values(WKBID, 'records') == [['2024-01-01', 'steps', '1.5']]
+
+
+@pytest.mark.parametrize('rngid, row_offset, expected', [
+    ('records!A2:C', 3, 'records!A5:C'), ('records!A2:C10', 3, 'records!A5:C10'), ('records!A2:C4', 3, ''),
+])
+def test_range_below(gsheet_db, rngid, row_offset, expected):
+    assert gsheet_db.range_below(rngid, row_offset) == expected
+
+
+def post_table(gsheet_db, n, rngid, monkeypatch, **kwargs):
+    eng = create_engine('sqlite://')
+    records(n).to_sql('records', eng, index=False)
+    config = {'wkbid': WKBID, 'sheets': {'records': {'data': rngid, 'header': 'records!A1:C1'}}}
+    monkeypatch.setitem(gsheet_db.GSHEET_CONFIG, 'open', config)
+    gsheet_db.post_table_to_gsheet('records', 'open', 'records', con=eng, **kwargs)
+
+
+def test_post_table_writes_chunks_then_clears_rows_below(gsheet_db, sheets_service, monkeypatch):
+    sheets_service.set_values(WKBID, 'records!A2:C6', [['old', 'rows', str(i)] for i in range(5)])
+    post_table(gsheet_db, 3, 'records!A2:C', monkeypatch, chunksize=2)
+
+    assert sheets_service.methods() == ['values.update', 'values.update', 'values.clear']
+    assert [params['range'] for method, params in sheets_service.requests] == [
+        'records!A2:C3', 'records!A4:C4', 'records!A5:C']
+    assert sheets_service.get_values(WKBID, 'records!A2:C') == records(3).astype(str).values.tolist()
+
+
+def test_post_table_skips_clear_of_shorter_known_range(gsheet_db, sheets_service, monkeypatch):
+    post_table(gsheet_db, 3, 'records!A2:C', monkeypatch)
+    sheets_service.reset_requests()
+    post_table(gsheet_db, 3, 'records!A2:C', monkeypatch)
+
+    assert sheets_service.methods() == ['values.update']
+
+
+def test_post_table_rejects_sheet_name_range(gsheet_db, sheets_service, monkeypatch):
+    sheets_service.set_values(WKBID, 'records!A2:C2', [['old', 'row', '1']])
+    with pytest.raises(ValueError):
+        post_table(gsheet_db, 3, 'records', monkeypatch)
+
+    assert sheets_service.requests == []
+    assert sheets_service.get_values(WKBID, 'records!A2:C') == [['old', 'row', '1']]
+
+
+def load_myapp(sheets_service, n_records, n_form):
+    sheets_service.set_values(WKBID, 'config!A1:D2', [['group', 'parameter', 'value', 'data_type'],
+                                                      ['report', 'days', '7', 'int']])
+    sheets_service.set_values(WKBID, f'records!A1:C{n_records + 1}', [['date', 'parameter', 'value']] + [
+        [f'2024-01-{i + 1:02d}', 'steps', str(float(i))] for i in range(n_records)])
+    sheets_service.set_values(WKBID, f'form!A2:C{n_form + 2}', [['date', 'parameter', 'value']] + [
+        [f'2024-02-{i + 1:02d}', 'steps', str(i + 0.5)] for i in range(n_form)])
+
+
+def test_myapp_update_posts_only_appended_row(gsheet_db, sheets_service, monkeypatch):
+    import myapp
+    monkeypatch.setattr(gsheet_db, 'load', lambda *args, **kwargs: None)
+    load_myapp(sheets_service, 20, 1)
+    sheets_service.reset_requests()
+
+    myapp.update()
+    posts = [params for method, params in sheets_service.requests if method != 'values.batchGet']
+    assert len(posts) == 1
+    assert [d['range'] for d in posts[0]['body']['data']] == ['records!A22:C22']
+    assert sheets_service.get_values(WKBID, 'records!A22:C') == [['2024-02-01', 'steps', '0.5']]
+
+
+def test_delta_post_unchanged_after_read(gsheet_db, sheets_service):
+    load_myapp(sheets_service, 5, 0)
+    tbl = gsheet_db.get_sheet('myapp', 'records')
+    sheets_service.reset_requests()
+
+    assert gsheet_db.post_delta_to_gsheet(tbl, 'myapp', 'records') == 0
+    assert sheets_service.requests == []
+
+
+def test_delta_post_counts_blanked_cells(gsheet_db, sheets_service):
+    load_myapp(sheets_service, 5, 0)
+    tbl = gsheet_db.get_sheet('myapp', 'records')
+
+    assert gsheet_db.post_delta_to_gsheet(tbl.iloc[0:0], 'myapp', 'records') == 15
+    assert sheets_service.get_values(WKBID, 'records!A2:C') == []
+    assert gsheet_db.post_delta_to_gsheet(tbl.iloc[0:0], 'myapp', 'records') == 0
+
+
+def test_delta_post_changed_cell(gsheet_db, sheets_service):
+    load_myapp(sheets_service, 5, 0)
+    tbl = gsheet_db.get_sheet('myapp', 'records')
+    tbl.loc[2, 'value'] = 42.0
+    sheets_service.reset_requests()
+
+    assert gsheet_db.post_delta_to_gsheet(tbl, 'myapp', 'records') == 1
+    assert [d['range'] for d in sheets_service.requests[0][1]['body']['data']] == ['records!C4:C4']
+
+
+@pytest.fixture
+def typed_table():
+    eng = create_engine('sqlite://')
+    with eng.begin() as con:
+        con.exec_driver_sql('CREATE TABLE typed (id INTEGER PRIMARY KEY, last_modified DATETIME, day DATE, '
+                            'value FLOAT, count INTEGER, label VARCHAR(10), flag BOOLEAN)')
+    pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'last_modified': pd.to_datetime(['2024-01-01', '2024-01-02 10:11:12.5', None, '2024-01-03'],
+                                        format='ISO8601'),
+        'day': [datetime.date(2024, 1, 1), None, datetime.date(2024, 2, 1), datetime.date(2024, 3, 1)],
+        'value': [7.0, 0.1, None, 1 / 3],
+        'count': [1, None, 3, 4],
+        'label': ['a', None, '10', 'x'],
+        'flag': [True, False, None, True]
+    }).to_sql('typed', eng, if_exists='append', index=False)
+    return eng
+
+
+@pytest.mark.parametrize('method', db.FINGERPRINT_METHODS)
+def test_fingerprints_same_chunked_and_as_frame(typed_table, method):
+    fields = ['last_modified', 'day', 'value', 'count', 'label', 'flag']
+    chunked = db.get_table_fingerprints('typed', 'id', fields, con=typed_table, chunksize=3, method=method)
+    # a generic backend hashes the table as pandas reads it, with float counts and datetime64 days
+    frame = db.fingerprint_rows(pd.read_sql_table('typed', typed_table), 'id', fields, method=method)
+
+    assert chunked[db.FINGERPRINT_FIELD].dtype == 'uint64'
+    assert chunked[db.FINGERPRINT_FIELD].tolist() == frame[db.FINGERPRINT_FIELD].tolist()
+    assert chunked[db.FINGERPRINT_FIELD].nunique() == 4
+
+
+def test_md5_fingerprint_is_digest_text():
+    tbl = pd.DataFrame({'id': [1], 'value': [7.0], 'label': [None]})
+    expected = db._md5_digest(db.FINGERPRINT_SEPARATOR.join(['7', db.FINGERPRINT_NULL]))
+
+    assert db.fingerprint_rows(tbl, 'id', ['value', 'label'], method='md5')[db.FINGERPRINT_FIELD].tolist() == \
+        [expected]
+
+
+def test_md5_fingerprint_in_sql_only_for_mysql(typed_table):
+    sql_table = db.get_sql_table('typed', typed_table, required=True)
+    compiled = str(db._sql_fingerprint([sql_table.c.value, sql_table.c.day]).compile(
+        dialect=db.mysql_dialect.dialect())).lower()
+
+    assert 'md5(concat_ws(' in compiled and 'date_format' in compiled
+    assert not db.digest_in_sql(typed_table)
+    with pytest.raises(ValueError):
+        db.get_table_fingerprints('typed', 'id', ['value'], con=typed_table, in_sql=True)
+
+
+def test_range_summaries_same_from_rows_and_frame(typed_table):
+    fields = ['day', 'value', 'count', 'label', 'flag']
+    ranges = [(None, 3), (3, None), (10, None)]
+    read = db.get_range_summaries('typed', 'id', fields, ranges, 'last_modified', con=typed_table)
+    frame = db.summarize_ranges(pd.read_sql_table('typed', typed_table), 'id', fields, ranges, 'last_modified')
+
+    pd.testing.assert_frame_equal(read, frame, check_dtype=False)
+    assert read['count'].tolist() == [2, 2, 0]
+    assert read['digest'].iloc[2] == 0
+
+
+@pytest.mark.parametrize('keys, parts, expected', [
+    ([1, 2, 3, 4, 5, 6, 7], 3, [4, 6]), ([1, 2], 4, [2]), ([], 4, []), ([5, 5, 5, 6], 2, []), ([5, 6, 6, 7], 4, [6, 7]),
+])
+def test_range_splits(keys, parts, expected):
+    assert db.range_splits(keys, parts) == expected
+
+
+def test_range_splits_same_in_sql(typed_table):
+    pd.DataFrame({'id': range(5, 40, 3)}).to_sql('typed', typed_table, if_exists='append', index=False)
+    ranges = [(None, None), (3, 20), (100, None)]
+    keys = sorted(pd.read_sql_table('typed', typed_table)['id'])
+
+    assert db._sql_range_splits('typed', 'id', ranges, 4, typed_table) == \
+        [db.range_splits([k for k in keys if (lo is None or k >= lo) and (hi is None or k < hi)], 4)
+         for lo, hi in ranges]
+
+
+def test_range_summaries_not_implemented_by_template():
+    with pytest.raises(NotImplementedError):
+        db.get_range_summaries('events', 'id', ['value'], [(None, None)], 'last_modified',
+                               con=templates.DBConnection())
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, db.FINGERPRINT_NULL), (float('nan'), db.FINGERPRINT_NULL), (pd.NaT, db.FINGERPRINT_NULL),
+    (True, '1'), (7, '7'), (7.0, '7'), (0.1, '0.1'), ('7.0', '7.0'),
+    (pd.Timestamp('2024-01-02'), '2024-01-02'), (datetime.date(2024, 1, 2), '2024-01-02'),
+    (datetime.datetime(2024, 1, 2, 3, 4, 5, 600), '2024-01-02 03:04:05'),
+])
+def test_digest_text(value, expected):
+    assert db.digest_text(value) == expected
+
+
+def test_sql_table_reflected_once_per_engine(typed_table):
+    with typed_table.begin() as con:
+        con.exec_driver_sql('CREATE TABLE other (id INTEGER PRIMARY KEY)')
+    table = db.get_sql_table('typed', typed_table)
+    with typed_table.connect() as con:
+        assert db.get_sql_table('typed', con) is table
+
+    # only the target table is reflected
+    assert list(db._schema_cache[typed_table].tables) == ['typed']
+    assert db.get_sql_table('missing', typed_table) is None
+    with pytest.raises(db.NoSuchTableError):
+        db.get_sql_table('missing', typed_table, required=True)
+
+
+def test_rows_update_and_delete_use_cached_table(typed_table):
+    table = db.get_sql_table('typed', typed_table)
+    db.rows_update(pd.DataFrame({'id': [1], 'label': ['b']}), 'typed', key='id', eng=typed_table)
+    db.rows_delete(pd.DataFrame({'id': [2]}), 'typed', key='id', eng=typed_table)
+
+    assert db.get_sql_table('typed', typed_table) is table
+    rows = pd.read_sql_table('typed', typed_table)
+    assert rows['id'].tolist() == [1, 3, 4]
+    assert rows['label'].tolist()[0] == 'b'
+
+
+def test_invalidate_schema_reflects_altered_table(typed_table):
+    db.get_sql_table('typed', typed_table)
+    with typed_table.begin() as con:
+        con.exec_driver_sql('ALTER TABLE typed ADD COLUMN note VARCHAR(10)')
+    assert 'note' not in db.get_sql_table('typed', typed_table).c
+
+    db.invalidate_schema('typed', typed_table)
+    assert 'note' in db.get_sql_table('typed', typed_table).c
+
+
+def upsert_rows():
+    return pd.DataFrame({'id': [3, 5], 'label': ['c', 'e'], 'value': [3.5, 5.5]})
+
+
+@pytest.mark.parametrize('method', db.UPSERT_METHODS)
+def test_rows_upsert_updates_and_inserts(typed_table, method):
+    db.rows_upsert(upsert_rows(), 'typed', key='id', eng=typed_table, method=method)
+    rows = pd.read_sql_table('typed', typed_table).set_index('id')
+
+    assert rows.index.tolist() == [1, 2, 3, 4, 5]
+    assert rows.loc[[3, 5], 'label'].tolist() == ['c', 'e']
+    assert rows.loc[[3, 5], 'value'].tolist() == [3.5, 5.5]
+    assert rows.loc[3, 'count'] == 3  # fields not in the rows are kept
+
+
+def test_rows_upsert_auto_stages_without_unique_key(typed_table, monkeypatch):
+    with typed_table.begin() as con:
+        con.exec_driver_sql('CREATE TABLE loose (id INTEGER, label VARCHAR(10))')
+        con.exec_driver_sql("INSERT INTO loose VALUES (3, 'x')")
+    staged = []
+    monkeypatch.setattr(db, '_rows_upsert_staging', lambda rows, table, key, eng: staged.append(table.name))
+    db.rows_upsert(upsert_rows()[['id', 'label']], 'loose', key='id', eng=typed_table)
+
+    assert staged == ['loose']
+
+
+def test_rows_update_staging(typed_table):
+    db.rows_update(pd.DataFrame({'id': [1, 4], 'label': ['p', 'q']}), 'typed', key='id', eng=typed_table,
+                   method='staging')
+    rows = pd.read_sql_table('typed', typed_table)
+
+    assert rows['label'].tolist() == ['p', None, '10', 'q']
+    assert inspect(typed_table).get_table_names() == ['typed']  # the staging table is dropped
+
+
+def test_rows_upsert_rejects_unknown_method(typed_table):
+    with pytest.raises(ValueError):
+        db.rows_upsert(upsert_rows(), 'typed', key='id', eng=typed_table, method='merge')
+
+
+@pytest.fixture
+def typed_sheet(gsheet_db, sheets_service, monkeypatch):
+    config = {'wkbid': WKBID, 'sheets': {'records': {
+        'data': 'records!A2:E', 'header': 'records!A1:E1', 'date_format': '%Y-%m-%d',
+        'data_types': {'date': 'date', 'count': 'int', 'value': 'float', 'kind': 'category', 'label': 'str'}}}}
+    monkeypatch.setitem(gsheet_db.GSHEET_CONFIG, 'typed', config)
+    sheets_service.set_values(WKBID, 'records!A1:E4', [['date', 'count', 'value', 'kind', 'label'],
+                                                       ['2024-01-02', '3', '1.5', 'a', '007'],
+                                                       ['not a date', '2.5', '', 'b', 'x'],
+                                                       ['2024-01-04', '', 'n/a', 'a', '']], input_option='RAW')
+    return gsheet_db
+
+
+def test_get_sheet_coerces_data_types(typed_sheet):
+    tbl = typed_sheet.get_sheet('typed', 'records')
+
+    assert str(tbl['date'].dtype) == 'datetime64[ns]'
+    assert str(tbl['count'].dtype) == 'Int64'
+    assert tbl['count'].tolist()[0] == 3 and tbl['count'].isna().tolist() == [False, True, True]
+    assert tbl['value'].dtype == 'float64' and tbl['value'].isna().tolist() == [False, True, True]
+    assert str(tbl['kind'].dtype) == 'category'
+    assert tbl['label'].tolist() == ['007', 'x', None]  # trailing blank cells are not returned
+
+
+def test_get_sheet_reports_coercion_errors(typed_sheet):
+    typed_sheet.get_sheet('typed', 'records')
+    errors = typed_sheet.COERCION_ERRORS[('typed', 'records')]
+
+    # blanks are nulls, not errors
+    assert errors[['row', 'field', 'value', 'data_type']].values.tolist() == [
+        [1, 'date', 'not a date', 'date'], [1, 'count', '2.5', 'int'], [2, 'value', 'n/a', 'float']]
+
+
+def test_coercion_plan_compiled_once(typed_sheet):
+    plan = typed_sheet.coercion_plan('typed', 'records')
+    typed_sheet.get_sheet('typed', 'records')
+
+    assert typed_sheet.coercion_plan('typed', 'records') is plan
+    assert [(field, typeId) for field, typeId, converter in plan] == [
+        ('date', 'date'), ('count', 'int'), ('value', 'float'), ('kind', 'category'), ('label', 'str')]
+
+
+@pytest.fixture
+def async_db(gsheet_db, sheets_service, monkeypatch):
+    """ database module with a second spreadsheet 'other', and a fresh async engine closed after the test
+    """
+    other = 'wkb-other'
+    sheets_service.sheets[other] = ['records']
+    config = dict(gsheet_db.GSHEET_CONFIG, other={
+        'wkbid': other, 'sheets': {'records': {'data': 'records!A2:C', 'header': 'records!A1:C1'}}})
+    monkeypatch.setattr(gsheet_db, 'GSHEET_CONFIG', config)
+    monkeypatch.setattr(gsheet_db, 'gs_async_engine', None)
+    yield gsheet_db
+    if gsheet_db.gs_async_engine is not None:
+        gsheet_db.gs_async_engine.close()
+
+
+def test_async_engine_shares_sync_engine_state(async_db):
+    engine = async_db.async_engine(max_concurrency=2)
+
+    assert async_db.async_engine() is engine
+    assert engine.max_concurrency == 2
+    assert engine.cache is async_db.gs_engine.cache
+    assert engine.scheduler is async_db.gs_engine.scheduler
+    assert engine.rowCounts is async_db.gs_engine.rowCounts
+
+
+def test_get_workbooks_async_reads_each_workbook_in_one_request(async_db, sheets_service):
+    load_myapp(sheets_service, 3, 0)
+    sheets_service.set_values('wkb-other', 'records!A1:C2', [['date', 'parameter', 'value'],
+                                                              ['2024-03-01', 'weight', '70']])
+    sheets_service.reset_requests()
+
+    workbooks = asyncio.run(async_db.get_workbooks_async(['myapp', 'other']))
+    assert sheets_service.methods() == ['values.batchGet', 'values.batchGet']
+    assert len(workbooks['myapp']['records']) == 3
+    assert workbooks['other']['records'].values.tolist() == [['2024-03-01', 'weight', '70']]
+
+
+def test_post_to_gsheets_async_writes_every_workbook(async_db, sheets_service):
+    asyncio.run(async_db.post_to_gsheets_async([('myapp', 'records', records(2)),
+                                                ('other', 'records', records(1, value=9.0))]))
+
+    assert sheets_service.get_values(WKBID, 'records!A2:C') == [['2024-01-01', 'steps', '1.5'],
+                                                                ['2024-01-02', 'steps', '2.5']]
+    assert sheets_service.get_values('wkb-other', 'records!A2:C') == [['2024-01-01', 'steps', '9.0']]
+    assert async_db.gs_engine.get_rowcount(WKBID, 'records!A2:C') == 2
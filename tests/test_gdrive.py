@@ -0,0 +1,133 @@
+from sqlgsheet import gdrive as gd
+from sqlgsheet import cache
+from tests.test_quota import http_error
+
+
+def test_folder_ids_looked_up_every_time_by_default(drive_service):
+    for _ in range(2):
+        assert gd.get_folder_id('reports') == 'reports'
+
+    assert drive_service.methods() == ['files.list', 'files.list']
+
+
+def test_enabled_cache_resolves_each_folder_once(drive_service):
+    gd.enable_cache()
+    for _ in range(2):
+        assert gd.get_folder_id_by_path('reports/2024') == 'y2024'
+
+    assert drive_service.methods() == ['files.list', 'files.list']
+
+
+def test_files_in_folder_named_with_slash(drive_service):
+    files = gd.get_files_in_folder('a/b')
+    nested = gd.get_files_in_folder('', folder_id=gd.get_folder_id_by_path('reports/2024'))
+
+    assert [f['name'] for f in files] == ['note.txt']
+    assert sorted([f['name'] for f in nested]) == ['feb.csv', 'jan.csv']
+
+
+def test_moved_file_parents_invalidated(drive_service):
+    gd.enable_cache()
+    assert gd.get_file_parent_folder_ids('jan') == ['y2024']
+    gd.move_file_to_folder('jan', 'reports', source_id='y2024')
+
+    assert gd.get_file_parent_folder_ids('jan') == ['reports']
+    assert drive_service.methods() == ['files.get', 'files.update', 'files.get']
+
+
+def test_drive_cache_persists_between_runs(tmp_path):
+    path = str(tmp_path / 'drive_cache.db')
+    cache.DriveCache(path=path).put(('folder', '', 'reports'), 'reports')
+
+    assert cache.DriveCache(path=path).get(('folder', '', 'reports')) == 'reports'
+
+
+def test_drive_cache_entries_expire(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    path = str(tmp_path / 'drive_cache.db')
+    drive_cache = cache.DriveCache(ttl=60, path=path)
+    drive_cache.put(('parents', 'jan'), ['y2024'])
+    now[0] += 61
+
+    assert drive_cache.get(('parents', 'jan')) is None
+    assert cache.DriveCache(ttl=60, path=path).get(('parents', 'jan')) is None
+
+
+def test_iter_files_requests_every_page(drive_service):
+    files = list(gd.iter_files("'y2024' in parents", page_size=1))
+
+    assert sorted([f['name'] for f in files]) == ['feb.csv', 'jan.csv']
+    assert [params['pageToken'] for method, params in drive_service.requests] == [None, '1']
+
+
+def test_download_file_in_chunks(drive_service):
+    assert gd.download_file('jan', chunksize=4) == b'day,steps\n1,10\n'
+    assert drive_service.methods() == ['files.get_media'] * 4
+
+
+def test_download_files_streams_to_disk(drive_service, tmp_path):
+    destination_dir = str(tmp_path / 'downloads')
+    files = gd.download_files_in_folder('2024', 'y2024', destination_dir=destination_dir, workers=2)
+
+    assert sorted(files) == ['feb.csv', 'jan.csv']
+    with open(files['feb.csv'], 'rb') as file:
+        assert file.read() == b'day,steps\n1,12\n'
+
+
+def test_download_files_streams_chunks_to_callback(drive_service):
+    chunks = []
+    files = gd.download_files([{'id': 'jan', 'name': 'jan.csv'}], chunksize=8,
+                              callback=lambda f, chunk: chunks.append((f['name'], chunk)))
+
+    assert files == {'jan.csv': 15}
+    assert chunks == [('jan.csv', b'day,step'), ('jan.csv', b's\n1,10\n')]
+
+
+def test_download_files_as_bytes(drive_service):
+    files = gd.download_files([{'id': 'jan', 'name': 'jan.csv'}, {'id': 'feb', 'name': 'feb.csv'}])
+
+    assert files == {'jan.csv': b'day,steps\n1,10\n', 'feb.csv': b'day,steps\n1,12\n'}
+
+
+def test_move_files_in_one_batch(drive_service):
+    results = gd.move_files_to_folder(['jan', 'feb'], 'reports', source_id='y2024')
+
+    assert results['jan']['error'] is None and results['feb']['error'] is None
+    assert drive_service.requests == [('batch', {'size': 2})]
+    assert drive_service.files_by_id['feb']['parents'] == ['reports']
+
+
+def test_batch_execute_splits_items(drive_service):
+    results = gd.batch_execute(['jan', 'feb', 'note'], lambda file_id: drive_service.files().get(fileId=file_id),
+                               batch_size=2)
+
+    assert list(results) == ['jan', 'feb', 'note']
+    assert results['note']['response'] == {'parents': ['slash']}
+    assert drive_service.requests == [('batch', {'size': 2}), ('batch', {'size': 1})]
+
+
+def test_batch_retries_rate_limited_items(drive_service, monkeypatch):
+    monkeypatch.setattr(gd.time, 'sleep', lambda seconds: None)
+    drive_service.errors['feb'] = [http_error(429)]
+    parent_ids = gd.get_files_parent_folder_ids(['jan', 'feb', 'note'])
+
+    assert parent_ids == {'jan': ['y2024'], 'feb': ['y2024'], 'note': ['slash']}
+    assert drive_service.requests == [('batch', {'size': 3}), ('batch', {'size': 1})]
+
+
+def test_batch_returns_errors_not_retried(drive_service):
+    error = http_error(404)
+    drive_service.errors['feb'] = [error]
+    parent_ids = gd.get_files_parent_folder_ids(['jan', 'feb'])
+
+    assert parent_ids == {'jan': ['y2024'], 'feb': error}
+    assert drive_service.methods() == ['batch']
+
+
+def test_batch_parent_lookups_use_cache(drive_service):
+    gd.enable_cache()
+    assert gd.get_file_parent_folder_ids('jan') == ['y2024']
+    gd.get_files_parent_folder_ids(['jan', 'feb'])
+
+    assert drive_service.requests == [('files.get', {'fileId': 'jan'}), ('batch', {'size': 1})]
@@ -0,0 +1,187 @@
+import pytest
+from sqlgsheet import gsheet as gs
+from tests.conftest import WKBID
+
+
+def test_batch_get_rangevalues_one_request(sheets_engine, sheets_service):
+    sheets_service.set_values(WKBID, 'records!A1:C3', [['date', 'parameter', 'value'],
+                                                       ['2024-01-01', 'steps', '10'],
+                                                       ['2024-01-02', 'steps', '12']])
+    sheets_service.set_values(WKBID, 'form!A2:C3', [['date', 'parameter', 'value'],
+                                                    ['2024-01-03', 'steps', '9']])
+    ranges = ['records!A1:C1', 'records!A2:C', 'form!A2:C2', 'form!A3:C']
+    values = sheets_engine.batch_get_rangevalues(WKBID, ranges)
+
+    assert sheets_service.requests == [('values.batchGet', {'spreadsheetId': WKBID, 'ranges': ranges})]
+    assert values == [[['date', 'parameter', 'value']],
+                      [['2024-01-01', 'steps', '10'], ['2024-01-02', 'steps', '12']],
+                      [['date', 'parameter', 'value']],
+                      [['2024-01-03', 'steps', '9']]]
+    assert sheets_engine.get_rowcount(WKBID, 'records!A2:C') == 2
+
+
+def test_batch_get_rangevalues_requests_only_uncached(sheets_engine, sheets_service):
+    sheets_service.set_values(WKBID, 'records!A1:C2', [['date', 'parameter', 'value'], ['2024-01-01', 'steps', '10']])
+    sheets_engine.enable_cache()
+    sheets_engine.batch_get_rangevalues(WKBID, ['records!A1:C1'])
+    sheets_service.reset_requests()
+
+    values = sheets_engine.batch_get_rangevalues(WKBID, ['records!A1:C1', 'records!A2:C'])
+    assert sheets_service.requests == [('values.batchGet', {'spreadsheetId': WKBID, 'ranges': ['records!A2:C']})]
+    assert values == [[['date', 'parameter', 'value']], [['2024-01-01', 'steps', '10']]]
+
+    sheets_engine.batch_get_rangevalues(WKBID, ['records!A1:C1', 'records!A2:C'])
+    assert len(sheets_service.requests) == 1
+    sheets_engine.batch_get_rangevalues(WKBID, ['records!A1:C1'], refresh=True)
+    assert len(sheets_service.requests) == 2
+
+
+def test_get_sheets_one_request_per_workbook(gsheet_db, sheets_service):
+    sheets_service.set_values(WKBID, 'config!A1:D2', [['group', 'parameter', 'value', 'data_type'],
+                                                      ['report', 'days', '7', 'int']])
+    sheets_service.set_values(WKBID, 'records!A1:C2', [['date', 'parameter', 'value'], ['2024-01-01', 'steps', '10.5']])
+    sheets_service.set_values(WKBID, 'form!A2:C3', [['date', 'parameter', 'value'], ['2024-01-03', 'steps', '9']])
+
+    tables = gsheet_db.get_sheets('myapp')
+    assert sheets_service.methods() == ['values.batchGet']
+    assert sheets_service.requests[0][1]['ranges'] == ['config!A1:D1', 'config!A2:D', 'records!A1:C1',
+                                                       'records!A2:C', 'form!A2:C2', 'form!A3:C']
+    assert list(tables) == ['config', 'records', 'form']
+    assert tables['records']['value'].tolist() == [10.5]
+    assert tables['config']['parameter'].tolist() == ['days']
+
+
+def test_batch_set_rangevalues_one_request(sheets_engine, sheets_service):
+    range_values = [('records!A2:C3', [['2024-01-01', 'steps', '10'], ['2024-01-02', 'steps', '12']]),
+                    ('form!A3:C3', [['2024-01-03', 'steps', '9']])]
+    sheets_engine.batch_set_rangevalues(WKBID, range_values)
+
+    assert sheets_service.requests == [('values.batchUpdate', {'spreadsheetId': WKBID, 'body': {
+        'valueInputOption': 'RAW',
+        'data': [{'range': 'records!A2:C3', 'values': [['2024-01-01', 'steps', '10'], ['2024-01-02', 'steps', '12']]},
+                 {'range': 'form!A3:C3', 'values': [['2024-01-03', 'steps', '9']]}]}})]
+    assert sheets_service.get_values(WKBID, 'records!A2:C') == [['2024-01-01', 'steps', '10'],
+                                                                ['2024-01-02', 'steps', '12']]
+    assert sheets_service.get_values(WKBID, 'form!A3:C') == [['2024-01-03', 'steps', '9']]
+
+
+def test_batch_set_rangevalues_invalidates_cache(sheets_engine, sheets_service):
+    sheets_service.set_values(WKBID, 'records!A2:C2', [['2024-01-01', 'steps', '10']])
+    sheets_engine.enable_cache()
+    sheets_engine.batch_get_rangevalues(WKBID, ['records!A2:C'])
+    sheets_engine.batch_set_rangevalues(WKBID, [('records!C2:C2', [['11']])])
+    sheets_service.reset_requests()
+
+    assert sheets_engine.batch_get_rangevalues(WKBID, ['records!A2:C']) == [[['2024-01-01', 'steps', '11']]]
+    assert sheets_service.methods() == ['values.batchGet']
+
+
+def test_batch_clear_rangevalues_one_request(sheets_engine, sheets_service):
+    sheets_service.set_values(WKBID, 'records!A1:C3', [['date', 'parameter', 'value'],
+                                                       ['2024-01-01', 'steps', '10'],
+                                                       ['2024-01-02', 'steps', '12']])
+    sheets_service.set_values(WKBID, 'form!A3:C3', [['2024-01-03', 'steps', '9']])
+    sheets_engine.batch_get_rangevalues(WKBID, ['records!A2:C'])
+    sheets_service.reset_requests()
+
+    sheets_engine.batch_clear_rangevalues(WKBID, ['records!A2:C', 'form!A3:C'])
+    assert sheets_service.requests == [('values.batchClear', {'spreadsheetId': WKBID,
+                                                              'body': {'ranges': ['records!A2:C', 'form!A3:C']}})]
+    assert sheets_service.get_values(WKBID, 'records!A1:C') == [['date', 'parameter', 'value']]
+    assert sheets_service.get_values(WKBID, 'form!A1:C') == []
+    assert sheets_engine.get_rowcount(WKBID, 'records!A2:C') == 0
+
+
+@pytest.fixture
+def parameter_table(sheets_engine, sheets_service, monkeypatch):
+    monkeypatch.setattr(gs, 'shtEng', sheets_engine)
+    sheets_service.set_values(WKBID, 'config!B1:C4', [['parameter', 'value'],
+                                                      ['days', '7'],
+                                                      ['steps', '10'],
+                                                      ['weight', '70']])
+    pt = gs.ParameterTable(WKBID, 'config', wkbKey='wkb-test')
+    sheets_service.reset_requests()
+    return pt
+
+
+def test_parameter_table_commits_assigned_tblData_edits(parameter_table, sheets_service):
+    df = parameter_table.tblData
+    df.loc[1, parameter_table.valField] = '12'
+    assert parameter_table.dirty_rows == []  # tblData is a copy
+    parameter_table.tblData = df
+    assert parameter_table.dirty_rows == [1]
+    parameter_table.commit()
+
+    assert sheets_service.methods() == ['values.batchUpdate']
+    assert sheets_service.requests[0][1]['body']['data'] == [{'range': 'config!B3:C3',
+                                                              'values': [['steps', '12']]}]
+    assert parameter_table.dirty_rows == []
+    assert parameter_table.getValue('steps') == 12.0
+
+
+def test_parameter_table_commits_replaced_tblData_column(parameter_table, sheets_service):
+    df = parameter_table.tblData
+    df['value'] = ['7', '10', '71']
+    parameter_table.tblData = df
+    assert parameter_table.getValue('weight') == 71.0
+    parameter_table.commit()
+
+    assert sheets_service.requests[0][1]['body']['data'] == [{'range': 'config!B4:C4',
+                                                              'values': [['weight', '71']]}]
+    assert sheets_service.get_values(WKBID, 'config!B4:C4') == [['weight', '71']]
+
+
+def test_parameter_table_setters_mark_changed_rows(parameter_table, sheets_service):
+    parameter_table.setValue(8, key='days')
+    parameter_table.setValues(['72'], keys=['weight'])
+    assert parameter_table.dirty_rows == [0, 2]
+    assert parameter_table.dirty_blocks == [(0, 0), (2, 2)]
+    parameter_table.commit()
+
+    assert sheets_service.requests[0][1]['body']['data'] == [
+        {'range': 'config!B2:C2', 'values': [['days', 8]]},
+        {'range': 'config!B4:C4', 'values': [['weight', '72']]}]
+    assert parameter_table.dirty_rows == []
+
+
+def test_parameter_table_commits_contiguous_rows_as_one_range(parameter_table, sheets_service):
+    parameter_table.setValues(['8', '11'], keys=['days', 'steps'])
+    assert parameter_table.dirty_blocks == [(0, 1)]
+    parameter_table.commit()
+
+    assert sheets_service.requests[0][1]['body']['data'] == [
+        {'range': 'config!B2:C3', 'values': [['days', '8'], ['steps', '11']]}]
+
+
+def test_parameter_table_commit_without_changes_sends_nothing(parameter_table, sheets_service):
+    parameter_table.tblData = parameter_table.tblData
+    parameter_table.commit()
+
+    assert sheets_service.requests == []
+
+
+def test_parameter_table_full_commit_writes_whole_table(parameter_table, sheets_service):
+    parameter_table.setValue('9', key='days')
+    parameter_table.commit(full=True)
+
+    assert sheets_service.methods() == ['values.update']
+    assert sheets_service.get_values(WKBID, 'config!B2:C4') == [['days', '9'], ['steps', '10'], ['weight', '70']]
+    assert parameter_table.dirty_rows == []
+
+
+def test_get_rangevalues_cached_until_overlapping_clear(sheets_engine, sheets_service):
+    sheets_service.set_values(WKBID, 'records!A2:C2', [['2024-01-01', 'steps', '10']])
+    sheets_service.set_values(WKBID, 'form!A3:C3', [['2024-01-03', 'steps', '9']])
+    sheets_engine.enable_cache()
+    for _ in range(2):
+        sheets_engine.get_rangevalues(WKBID, 'records!A2:C')
+        sheets_engine.get_rangevalues(WKBID, 'form!A3:C')
+    assert sheets_service.methods() == ['values.get', 'values.get']
+
+    sheets_engine.clear_rangevalues(WKBID, 'records!B2:B')
+    sheets_service.reset_requests()
+    assert sheets_engine.get_rangevalues(WKBID, 'records!A2:C') == [['2024-01-01', '', '10']]
+    assert sheets_engine.get_rangevalues(WKBID, 'form!A3:C') == [['2024-01-03', 'steps', '9']]
+    assert sheets_service.methods() == ['values.get']
+    assert sheets_engine.get_rangevalues(WKBID, 'form!A3:C', refresh=True) == [['2024-01-03', 'steps', '9']]
+    assert sheets_service.methods() == ['values.get', 'values.get']
@@ -0,0 +1,105 @@
+import io
+import json
+import pandas as pd
+import pytest
+from sqlgsheet import instrument
+
+
+@pytest.fixture
+def stats():
+    aggregator = instrument.PrometheusExporter()
+    instrument.add_hook(aggregator)
+    yield aggregator
+    instrument.clear_hooks()
+
+
+def test_span_disabled_without_hooks():
+    assert not instrument.enabled()
+    with instrument.span('load') as s:
+        assert s is None
+
+
+def test_nested_spans_record_parent_and_measure(stats):
+    spans = []
+    instrument.add_hook(spans.append)
+    with instrument.span('sync', table='records'):
+        with instrument.span('load') as s:
+            s.measure(pd.DataFrame({'value': [1.0, 2.0]}))
+
+    assert [(s.name, s.parent) for s in spans] == [('load', 'sync'), ('sync', None)]
+    assert spans[0].rows == 2 and spans[0].bytes == 16
+    assert spans[1].attrs == {'table': 'records'}
+
+
+def test_span_records_error(stats):
+    with pytest.raises(KeyError):
+        with instrument.span('load'):
+            raise KeyError('records')
+
+    assert stats.stats()['load']['errors'] == 1
+
+
+def test_timed_measures_argument_and_result(stats):
+    @instrument.timed('post', measure_arg='values')
+    def post(rngid, values):
+        return len(values)
+
+    @instrument.timed('get', measure_result=True)
+    def get():
+        return {'values': [['a'], ['b'], ['c']]}
+
+    post('records!A2:C', values=[[1], [2]])
+    get()
+
+    assert stats.stats()['post']['rows'] == 2
+    assert stats.stats()['get']['rows'] == 3
+    assert sorted(stats.summary().index) == ['get', 'post']
+
+
+@pytest.mark.parametrize('obj, expected', [
+    ([[1], [2]], (2, None)),
+    ({'valueRanges': [{'values': [[1]]}, {}]}, (1, None)),
+    ({'files': [{'id': 'a'}]}, (1, None)),
+    ({'a': pd.DataFrame({'x': [1]}), 'b': pd.DataFrame({'x': [1, 2]})}, (3, 24)),
+    ('text', (None, None)),
+])
+def test_measure(obj, expected):
+    assert instrument.measure(obj) == expected
+
+
+def test_failing_hook_does_not_fail_the_call(stats, capsys):
+    def broken(s):
+        raise RuntimeError('hook down')
+    instrument.add_hook(broken)
+    with instrument.span('load'):
+        pass
+
+    assert stats.stats()['load']['count'] == 1
+    assert 'hook down' in capsys.readouterr().err
+
+
+def test_json_log_hook_writes_lines():
+    stream = io.StringIO()
+    instrument.add_hook(instrument.JSONLogHook(stream))
+    try:
+        with instrument.span('load', table='records'):
+            pass
+    finally:
+        instrument.clear_hooks()
+
+    line = json.loads(stream.getvalue())
+    assert line['name'] == 'load' and line['attrs'] == {'table': 'records'}
+
+
+def test_prometheus_exposition(stats, tmp_path):
+    with instrument.span('load'):
+        pass
+    path = str(tmp_path / 'sqlgsheet.prom')
+    stats.write(path)
+
+    with open(path) as f:
+        exposition = f.read()
+    assert '# TYPE sqlgsheet_span_count_total counter' in exposition
+    assert 'sqlgsheet_span_count_total{span="load"} 1' in exposition
+    stats.reset()
+    assert stats.stats() == {}
@@ -0,0 +1,25 @@
+from sqlalchemy.pool import NullPool
+from sqlgsheet import pool
+
+
+def test_engine_options_by_backend():
+    registry = pool.EngineRegistry()
+    assert registry.engine_options('sqlite:////tmp/myapp.db')['poolclass'] is NullPool
+    assert 'pool_size' not in registry.engine_options('sqlite:////tmp/myapp.db')
+    assert 'poolclass' not in registry.engine_options('sqlite://')
+    options = registry.engine_options('mysql+pymysql://user:pw@host/db', {'pool_size': 2})
+    assert options['pool_size'] == 2 and options['max_overflow'] == pool.POOL_CONFIG['max_overflow']
+
+
+def test_registry_shares_and_disposes_engines(tmp_path):
+    url = f'sqlite:///{tmp_path / "myapp.db"}'
+    with pool.EngineRegistry() as registry:
+        engine = registry.get_engine(url)
+        assert registry.get_engine(url) is engine
+        assert registry.get_engine(url, {'pool_recycle': 60}) is not engine
+        assert len(registry) == 2
+        assert not isinstance(registry.get_engine('sqlite://').pool, NullPool)
+        registry.dispose(url)
+        assert len(registry) == 1
+        assert registry.get_engine(url) is not engine
+    assert len(registry) == 0
@@ -0,0 +1,101 @@
+import threading
+import time
+import pytest
+from httplib2 import Response
+from googleapiclient.errors import HttpError
+from sqlgsheet import quota
+
+
+def http_error(status, retry_after=None):
+    headers = {'status': status}
+    if retry_after is not None:
+        headers['retry-after'] = retry_after
+    return HttpError(Response(headers), b'{}')
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+    monkeypatch.setattr(quota.time, 'sleep', waits.append)
+    return waits
+
+
+def scheduler(**kwargs) -> quota.RequestScheduler:
+    return quota.RequestScheduler(quotas={'test': {'requests': 100, 'period': 1}}, **kwargs)
+
+
+def failing(errors, result='ok'):
+    # fn raising the errors in turn, then returning result
+    errors = list(errors)
+
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn
+
+
+def test_retries_rate_limit_and_server_errors(sleeps):
+    requests = scheduler(max_retries=3)
+
+    assert requests.call(failing([http_error(429), http_error(503, retry_after='2')]), 'test') == 'ok'
+    assert requests.metrics()['test']['requests'] == 3
+    assert requests.metrics()['test']['retries'] == 2
+    assert 0 <= sleeps[0] <= quota.BACKOFF_BASE
+    assert sleeps[1] == 2.0  # the retry-after header of the response
+
+
+def test_client_errors_and_exhausted_retries_raise(sleeps):
+    requests = scheduler(max_retries=2)
+    with pytest.raises(HttpError):
+        requests.call(failing([http_error(404)]), 'test')
+    with pytest.raises(HttpError):
+        requests.call(failing([http_error(429)] * 3), 'test')
+
+    assert requests.metrics()['test']['failures'] == 2
+    assert requests.metrics()['test']['retries'] == 2
+    assert len(sleeps) == 2
+
+
+def test_backoff_is_capped():
+    requests = scheduler(backoff_base=1.0, backoff_max=8.0)
+
+    assert all(0 <= requests.backoff(attempt) <= min(8.0, 2 ** attempt) for attempt in range(10))
+    assert requests.backoff(0, http_error(429, retry_after='100')) == 8.0
+
+
+def test_token_bucket_waits_for_refill(sleeps, monkeypatch):
+    monkeypatch.setattr(quota.time, 'monotonic', lambda: 50.0)
+    bucket = quota.TokenBucket(rate=10, capacity=2)
+
+    assert [bucket.acquire() for _ in range(4)] == [0.0, 0.0, pytest.approx(0.1), pytest.approx(0.2)]
+    assert sleeps == [pytest.approx(0.1), pytest.approx(0.2)]
+
+
+def test_concurrent_reads_with_the_same_key_share_one_request():
+    requests = scheduler()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'values': [['1']]}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(requests.call(fn, 'test', key=('get', 'a'))))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(requests.call(fn, 'test', key=('get', 'a'))))
+    follower.start()
+    while requests.metrics()['test']['coalesced'] == 0:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader, follower]:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert results == [{'values': [['1']]}] * 2
+    assert requests.metrics()['test']['coalesced'] == 1
@@ -0,0 +1,332 @@
+import json
+import datetime
+import pytest
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlgsheet import sync
+from sqlgsheet import database as db
+from sqlgsheet import instrument
+from sqlgsheet import benchmark
+from tests.fakes import FakeTableConnection, FakeSummaryConnection
+
+
+def edit_counts(edits) -> dict:
+    return {(r, a): len(rows) for r in edits for a, rows in edits[r].items() if len(rows) > 0}
+
+
+def events(n) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        benchmark.KEY: np.arange(n),
+        benchmark.LAST_MODIFIED: benchmark.START_TIME + pd.to_timedelta(rng.integers(0, 10 ** 6, n), unit='s'),
+        'value': rng.random(n),
+        'label': rng.choice(['alpha', 'beta'], n)
+    })
+
+
+def sqlite_syncer(tmp_path, master, slave, sync_mode, **options) -> sync.DBSyncer:
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for r, tbl in zip(sync.DB_ROLES, [master, slave]):
+        paths[r] = str(tmp_path / f'{r}.db')
+        benchmark.write_database(tbl, paths[r])
+    sync_config = {
+        'master': {'db_type': 'sqlite', 'database': f'sqlite:///{paths["master"]}'},
+        'slave': {'db_type': 'sqlite', 'database': f'sqlite:///{paths["slave"]}'},
+        'tables': {benchmark.TABLE_NAME: {'key': benchmark.KEY, 'last_modified': benchmark.LAST_MODIFIED}},
+        'sync_mode': sync_mode,
+        'watermarks': str(tmp_path / 'watermarks.json'),
+        **options
+    }
+    return sync.DBSyncer(sync_config=sync_config)
+
+
+def test_merge_edits_partitioned_int_and_float_keys():
+    master = pd.DataFrame({'id': range(200), 'value': ['a'] * 200, 'last_modified': [5] * 200})
+    slave = master.astype({'id': 'float64'})
+    slave.loc[slave['id'] == 7, ['value', 'last_modified']] = ['b', 6]
+    edits = sync._concat_edits(list(sync.merge_edits_partitioned([master], [slave], key='id', partitions=8)))
+
+    assert edit_counts(edits) == {('master', 'update'): 1}
+    assert edits['master']['update']['id'].tolist() == [7]
+
+
+def test_merge_edits_partitioned_spans():
+    master = pd.DataFrame({'id': range(20), 'value': ['a'] * 20, 'last_modified': [5] * 20})
+    stats = instrument.Aggregator()
+    instrument.add_hook(stats)
+    try:
+        edits = list(sync.merge_edits_partitioned([master], [master.copy()], key='id', partitions=4))
+    finally:
+        instrument.remove_hook(stats)
+
+    assert len(edits) == 4
+    spans = stats.stats()
+    assert spans['sync.merge_edits_partitioned.spill']['rows'] == 40
+    assert spans['sync.merge_edits_partitioned.merge']['count'] == 4
+    assert spans['sync.merge_edits_partitioned.merge']['rows'] == 40
+
+
+@pytest.mark.parametrize('method', db.FINGERPRINT_METHODS)
+def test_fingerprint_sync_by_method(tmp_path, monkeypatch, method):
+    master = events(500)
+    slave = master.copy()
+    slave.loc[7, 'value'] = 0.5  # changed without a last_modified update
+    syncer = sqlite_syncer(tmp_path, master, slave, 'fingerprint')
+    # md5 is the method of pairs with a mysql side
+    monkeypatch.setattr(sync.DBSyncer, '_fingerprint_method', lambda self: method)
+    syncer.sync(edits_apply=False)
+
+    edits = syncer.edits[benchmark.TABLE_NAME]
+    assert edit_counts(edits) == {('slave', 'update'): 1}
+    assert edits['slave']['update'][benchmark.KEY].tolist() == [7]
+
+
+ROW_READS = ['database.get_table', 'database.get_table_columns', 'database.get_table_fingerprints',
+             'database.get_rows_in_ranges']
+
+
+def sync_row_reads(syncer) -> int:
+    # rows read from the two databases by a sync without applying the edits
+    stats = instrument.Aggregator()
+    instrument.add_hook(stats)
+    try:
+        syncer.sync(edits_apply=False)
+    finally:
+        instrument.remove_hook(stats)
+    return sum([s['rows'] for name, s in stats.stats().items() if name in ROW_READS])
+
+
+def low_diff_pair(n) -> tuple:
+    master = events(n)
+    slave = master.copy()
+    changed = [10, n // 2]
+    slave.loc[changed, 'value'] = 0.5
+    slave.loc[changed, benchmark.LAST_MODIFIED] += pd.Timedelta(seconds=1)
+    return master, slave, changed
+
+
+def generic_syncer(master, slave, connection, sync_mode) -> tuple:
+    cons = {r: connection({benchmark.TABLE_NAME: tbl}) for r, tbl in zip(sync.DB_ROLES, [master, slave])}
+    sync_config = {
+        'master': {'db_type': 'generic'},
+        'slave': {'db_type': 'generic'},
+        'tables': {benchmark.TABLE_NAME: {'key': benchmark.KEY, 'last_modified': benchmark.LAST_MODIFIED,
+                                          'fingerprint_fields': ['value', 'label']}},
+        'sync_mode': sync_mode
+    }
+    syncer = sync.DBSyncer(sync_config=sync_config)
+    for r in sync.DB_ROLES:
+        syncer.db_connect(db_role=r, con_obj=cons[r])
+    return syncer, cons
+
+
+def test_merkle_sync_reads_fewer_rows_than_full():
+    master, slave, changed = low_diff_pair(20000)
+    full, full_cons = generic_syncer(master, slave, FakeSummaryConnection, 'full')
+    merkle, merkle_cons = generic_syncer(master, slave, FakeSummaryConnection, 'merkle')
+    full.sync(edits_apply=False)
+    merkle.sync(edits_apply=False)
+
+    assert [c.rows_read for c in full_cons.values()] == [20000, 20000]
+    # only the rows of the leaf ranges that differ, no keys
+    assert all([c.rows_read <= 2 * sync.MERKLE_LEAF_ROWS for c in merkle_cons.values()])
+    for syncer in [full, merkle]:
+        edits = syncer.edits[benchmark.TABLE_NAME]
+        assert edit_counts(edits) == {('master', 'update'): 2}
+        assert sorted(edits['master']['update'][benchmark.KEY]) == changed
+
+
+def test_merkle_sync_reads_generic_tables_once():
+    master, slave, changed = low_diff_pair(5000)
+    syncer, cons = generic_syncer(master, slave, FakeTableConnection, 'merkle')
+    syncer.sync(edits_apply=False)
+
+    # the template raises NotImplementedError for the range methods, so each table is read once
+    assert [c.rows_read for c in cons.values()] == [5000, 5000]
+    edits = syncer.edits[benchmark.TABLE_NAME]
+    assert edit_counts(edits) == {('master', 'update'): 2}
+    assert sorted(edits['master']['update'][benchmark.KEY]) == changed
+
+
+def test_merkle_sync_sqlite_reads_fingerprints_once(tmp_path):
+    master, slave, changed = low_diff_pair(20000)
+    syncer = sqlite_syncer(tmp_path, master, slave, 'merkle')
+    rows = sync_row_reads(syncer)
+
+    # the fingerprints of both sides, and the rows of the leaf ranges that differ
+    assert rows <= 40000 + 4 * sync.MERKLE_LEAF_ROWS
+    edits = syncer.edits[benchmark.TABLE_NAME]
+    assert edit_counts(edits) == {('master', 'update'): 2}
+    assert sorted(edits['master']['update'][benchmark.KEY]) == changed
+
+
+def test_merkle_sync_md5_method(tmp_path, monkeypatch):
+    master, slave, changed = low_diff_pair(5000)
+    syncer = sqlite_syncer(tmp_path, master, slave, 'merkle', merkle_leaf_rows=100)
+    monkeypatch.setattr(sync.DBSyncer, '_fingerprint_method', lambda self: 'md5')
+    rows = sync_row_reads(syncer)
+
+    assert rows < 5000 + 5000 + 4 * 100
+    edits = syncer.edits[benchmark.TABLE_NAME]
+    assert edit_counts(edits) == {('master', 'update'): 2}
+    assert sorted(edits['master']['update'][benchmark.KEY]) == changed
+
+
+def random_tables(seed, last_modified_type) -> tuple:
+    # keys drawn with replacement from a small range, so each table has duplicate keys
+    # and keys missing from the other table
+    rng = np.random.default_rng(seed)
+    tables = []
+    for n in rng.integers(0, 40, 2):
+        last_modified = rng.integers(0, 20, n)
+        if last_modified_type == 'datetime':
+            last_modified = benchmark.START_TIME + pd.to_timedelta(last_modified, unit='h')
+        tables.append(pd.DataFrame({'id': rng.integers(0, 30, n), 'last_modified': last_modified,
+                                    'value': rng.random(n)}))
+    return tuple(tables)
+
+
+def sorted_rows(rows) -> pd.DataFrame:
+    if len(rows) == 0:
+        return pd.DataFrame()
+    return rows.sort_values(list(rows.columns)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('last_modified_type', ['int', 'datetime'])
+@pytest.mark.parametrize('seed', range(20))
+def test_merge_edits_columnar_matches_reference(seed, last_modified_type):
+    master, slave = random_tables(seed, last_modified_type)
+    columnar = sync.merge_edits(master, slave, key='id', mode='columnar')
+    reference = sync.merge_edits(master, slave, key='id', mode='reference')
+
+    for r in sync.DB_ROLES:
+        for a in columnar[r]:
+            pd.testing.assert_frame_equal(sorted_rows(columnar[r][a]), sorted_rows(reference[r][a]))
+
+
+def test_sync_reads_replaced_database_file(tmp_path):
+    master = events(100)
+    syncer = sqlite_syncer(tmp_path, master, master.iloc[:50], 'full')
+    syncer.sync()
+    assert syncer.sync_status() == 'synced'
+
+    # a warm invocation downloads the databases again to the same paths
+    replaced = events(120)
+    replaced['value'] = 0.25
+    for r in sync.DB_ROLES:
+        (tmp_path / f'{r}.db').unlink()
+    benchmark.write_database(replaced, str(tmp_path / 'master.db'))
+    benchmark.write_database(replaced.iloc[:10], str(tmp_path / 'slave.db'))
+    syncer.sync()
+
+    slave = pd.read_sql_table(benchmark.TABLE_NAME, f'sqlite:///{tmp_path / "slave.db"}')
+    assert len(slave) == 120
+    assert (slave['value'] == 0.25).all()
+
+
+def test_parallel_sync_in_workers(tmp_path):
+    master, slave, changed = low_diff_pair(100)
+    syncer = sqlite_syncer(tmp_path, master, slave, 'full')
+    syncer.sync(edits_apply=False, workers=2)
+
+    assert syncer.table_status[benchmark.TABLE_NAME]['errors'] == ''
+    edits = syncer.edits[benchmark.TABLE_NAME]
+    assert sorted(edits['master']['update'][benchmark.KEY]) == changed
+
+
+def test_parallel_sync_rejects_generic_connections_and_keep_connection(tmp_path):
+    master, slave, changed = low_diff_pair(100)
+    generic, cons = generic_syncer(master, slave, FakeTableConnection, 'full')
+    with pytest.raises(ValueError):
+        generic.sync(edits_apply=False, workers=2)
+    with pytest.raises(ValueError):
+        sqlite_syncer(tmp_path, master, slave, 'full').sync(edits_apply=False, keep_connection=True, workers=2)
+    assert [c.rows_read for c in cons.values()] == [0, 0]
+
+
+@pytest.mark.parametrize('values, expected', [
+    ([3, np.int64(5), None], 5), (['2024-01-01', '2024-01-02'], '2024-01-02'), ([None, np.nan], None),
+    ([pd.Timestamp('2024-01-01 10:00:00.250'), '2024-01-01 10:00:00'], pd.Timestamp('2024-01-01 10:00:00.250')),
+])
+def test_max_value(values, expected):
+    assert sync._max_value(values) == expected
+
+
+def test_incremental_watermark_full_precision(tmp_path, monkeypatch):
+    master = events(10)
+    master[benchmark.LAST_MODIFIED] = pd.Timestamp('2024-01-01 10:00:00') + pd.to_timedelta(range(10), unit='ms')
+    syncer = sqlite_syncer(tmp_path, master, master.copy(), 'incremental')
+    syncer.sync()
+    with open(tmp_path / 'watermarks.json') as f:
+        watermark = json.load(f)[benchmark.TABLE_NAME]['master']
+
+    assert watermark['last_modified'] == '2024-01-01T10:00:00.009000'
+    assert watermark['last_modified_type'] == sync.WATERMARK_DATETIME_TYPE
+
+    # an edit within the same second as the watermark
+    eng = create_engine(f'sqlite:///{tmp_path / "master.db"}')
+    with eng.begin() as con:
+        con.execute(text(f'UPDATE {benchmark.TABLE_NAME} SET value = 0.5, {benchmark.LAST_MODIFIED} = :lm '
+                         f'WHERE {benchmark.KEY} = 3'), {'lm': datetime.datetime(2024, 1, 1, 10, 0, 0, 500000)})
+    eng.dispose()
+    since = []
+    get_table_since = sync.db.get_table_since
+    monkeypatch.setattr(sync.db, 'get_table_since',
+                        lambda table_name, field, value, con=None: since.append(value) or
+                        get_table_since(table_name, field, value, con=con))
+    syncer = sync.DBSyncer(sync_config=syncer.sync_config)  # loads the saved watermarks
+    syncer.sync(edits_apply=False)
+
+    assert since == [pd.Timestamp('2024-01-01 10:00:00.009')] * 2
+    edits = syncer.edits[benchmark.TABLE_NAME]
+    assert edit_counts(edits) == {('slave', 'update'): 1}
+    assert edits['slave']['update'][benchmark.KEY].tolist() == [3]
+
+
+def test_sync_apply_mode_upsert(tmp_path):
+    master, slave, changed = low_diff_pair(100)
+    syncer = sqlite_syncer(tmp_path, master, slave.iloc[:90], 'full', apply_mode='upsert')
+    syncer.sync()
+
+    synced = {r: pd.read_sql_table(benchmark.TABLE_NAME, f'sqlite:///{tmp_path / f"{r}.db"}') for r in sync.DB_ROLES}
+    assert len(synced['slave']) == 100
+    pd.testing.assert_frame_equal(synced['master'], synced['slave'])
+
+
+def edit_keys(edits) -> dict:
+    return {(r, a): sorted(rows[benchmark.KEY]) for r in edits for a, rows in edits[r].items() if len(rows) > 0}
+
+
+def test_pushdown_classifies_edits_as_full(tmp_path):
+    master, slave = benchmark.make_tables(300, 0.9, 0.1, 0.05, 0.05, skew=0)
+    full = sqlite_syncer(tmp_path / 'full', master, slave, 'full')
+    full.sync(edits_apply=False)
+    pushdown = sqlite_syncer(tmp_path / 'pushdown', master, slave, 'pushdown')
+    assert sync_row_reads(pushdown) == 0
+
+    expected = edit_keys(full.edits[benchmark.TABLE_NAME])
+    assert edit_keys(pushdown.edits[benchmark.TABLE_NAME]) == expected
+    assert {(r, a): n for r, actions in pushdown.edit_counts[benchmark.TABLE_NAME].items()
+            for a, n in actions.items() if n > 0} == {edit: len(keys) for edit, keys in expected.items()}
+
+
+def test_pushdown_sync_applies_edits_as_full(tmp_path):
+    master, slave = benchmark.make_tables(300, 0.9, 0.1, 0.05, 0.05, skew=0)
+    synced = {}
+    for sync_mode in ['full', 'pushdown']:
+        sqlite_syncer(tmp_path / sync_mode, master, slave, sync_mode).sync()
+        synced[sync_mode] = {r: pd.read_sql_table(benchmark.TABLE_NAME, f'sqlite:///{tmp_path / sync_mode / f"{r}.db"}')
+                             .sort_values(benchmark.KEY, ignore_index=True) for r in sync.DB_ROLES}
+
+    pd.testing.assert_frame_equal(synced['pushdown']['master'], synced['pushdown']['slave'])
+    pd.testing.assert_frame_equal(synced['pushdown']['master'], synced['full']['master'])
+
+
+def test_pushdown_supported(tmp_path):
+    files = [create_engine(f'sqlite:///{tmp_path / f"{r}.db"}') for r in sync.DB_ROLES]
+
+    assert sync.pushdown_supported(*files)
+    assert not sync.pushdown_supported(files[0], create_engine('sqlite://'))
+    assert not sync.pushdown_supported(files[0], FakeTableConnection({}))